@@ -12,6 +12,10 @@
 #           USR1 : reload the configuration
 #           USR2 : switch the proxy between active/inactive
 #           TERM : gracefuly stop the proxy
+#           TTIN : profile the proxy for a while (or stop the profiling)
+#           TTOU : take a memory snapshot, then write the difference with it
+#           In multi-workers mode, the signals sent to the main process are relayed
+#           to all the workers.
 
 # imports
 #----------
@@ -39,6 +43,34 @@ class Dummy:
         pass
 
 
+# load the rules and run the proxy (in each worker process in multi-workers mode)
+# return False if the proxy could not be started
+def startProxy(worker = None):
+    myVars.worker = worker
+
+    # create the rule processor and load the rules
+    myVars.dns_processor = packages.RuleProcessor(myVars)
+    myVars.dns_processor.loadRules()
+
+    # profiler started by the signals
+    myVars.profiler = packages.Profiler(myVars)
+
+    # change the signal handler
+    myVars.signals = packages.SignalHandler(myVars)
+    signal.signal(signal.SIGUSR1, myVars.signals.USR1)
+    signal.signal(signal.SIGUSR2, myVars.signals.USR2)
+    signal.signal(signal.SIGTERM, myVars.signals.TERM)
+    signal.signal(signal.SIGTTIN, myVars.signals.TTIN)
+    signal.signal(signal.SIGTTOU, myVars.signals.TTOU)
+
+    # create the proxy
+    myVars.proxy = packages.UDPProxy(myVars)
+    if myVars.proxy.initialize() == False:
+        return False
+
+    return myVars.proxy.run()
+
+
 # begin
 #----------
 
@@ -46,6 +78,9 @@ class Dummy:
 myVars = Dummy()
 myVars.application = app
 
+# exit status of the program
+status = 0
+
 # create the lock
 appLock = packages.Lock("/tmp/{0}.lock".format(app.PROGRAM_NAME))
 try:
@@ -68,23 +103,17 @@ try:
     myVars.logger.info("* S. LEGRAND / v.{0}".format(app.PROGRAM_VERSION))
     myVars.logger.info("********************************")
 
-    # create the rule processor and load the rules
-    myVars.dns_processor = packages.RuleProcessor(myVars)
-    myVars.dns_processor.loadRules()
-
-    # change the signal handler
-    myVars.signals = packages.SignalHandler(myVars)
-    signal.signal(signal.SIGUSR1, myVars.signals.USR1)
-    signal.signal(signal.SIGUSR2, myVars.signals.USR2)
-    signal.signal(signal.SIGTERM, myVars.signals.TERM)
-
-    # create the proxy
-    myVars.proxy = packages.UDPProxy(myVars)
-    if myVars.proxy.initialize() == True:
-        myVars.proxy.run()
+    # run the proxy in this process or in several workers
+    if packages.workersCount(app.config) > 1:
+        myVars.workers = packages.WorkerPool(myVars, startProxy)
+        if myVars.workers.run() == False:
+            status = 1
+    elif startProxy() == False:
+        status = 1
 
     # last message
     myVars.logger.info("*********** END ****************")
+    myVars.logger.close()
 
 # exception thrown by the Lock mechanism
 except IOError:
@@ -94,4 +123,6 @@ except IOError:
 finally:
     appLock.release()
 
+sys.exit(status)
+
 
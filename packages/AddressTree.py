@@ -0,0 +1,184 @@
+# @file     AddressTree.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Radix tree of IPv4 networks with longest-prefix match
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The clients of the rules can be given as addresses (192.168.1.20), networks
+#           (192.168.10.0/24) or ranges (192.168.1.100-192.168.1.149), a range being cut
+#           into the networks covering it.
+#           The networks are kept in a binary tree over the bits of the addresses where
+#           the nodes with a single child are merged (Patricia tree): a lookup follows at
+#           most 32 nodes whatever the number of networks, and returns the value of the
+#           most specific network containing the address.
+
+# imports
+#----------
+
+
+# globals
+#----------
+
+# number of bits of an IPv4 address
+ADDRESS_BITS = 32
+ADDRESS_MASK = 0xFFFFFFFF
+
+
+# functions
+#----------
+
+# return the integer value of an IPv4 address (ValueError if it is not valid)
+def addressToInt(text):
+    parts = text.strip().split('.')
+    if (len(parts) != 4) or not all(part.isdigit() for part in parts):
+        raise ValueError("Invalid address '{0}'".format(text))
+
+    value = 0
+    for part in parts:
+        byte = int(part)
+        if byte > 255:
+            raise ValueError("Invalid address '{0}'".format(text))
+        value = (value << 8) | byte
+
+    return value
+
+
+# return the address with only its first length bits
+def maskAddress(address, length):
+    if length == 0:
+        return 0
+
+    return address & ((ADDRESS_MASK << (ADDRESS_BITS - length)) & ADDRESS_MASK)
+
+
+# return the list of the networks (address, prefix length) covering a range of addresses
+def rangeToNetworks(first, last):
+    networks = list()
+    while first <= last:
+        # largest network aligned on the first address and not going past the last one
+        length = ADDRESS_BITS
+        while length > 0:
+            size = 1 << (ADDRESS_BITS - length + 1)
+            if (first & (size - 1)) or (first + size - 1 > last):
+                break
+            length = length - 1
+
+        networks.append((first, length))
+        first = first + (1 << (ADDRESS_BITS - length))
+
+    return networks
+
+
+# parse a client of a rule: address, network address/length or range first-last
+# return the list of the networks (address, prefix length), ValueError if it is not valid
+def parseNetworks(text):
+    text = text.strip()
+
+    if '/' in text:
+        address, length = text.split('/', 1)
+        if not length.strip().isdigit() or (int(length) > ADDRESS_BITS):
+            raise ValueError("Invalid network '{0}'".format(text))
+        return [ (maskAddress(addressToInt(address), int(length)), int(length)) ]
+
+    if '-' in text:
+        first, last = text.split('-', 1)
+        first, last = addressToInt(first), addressToInt(last)
+        if first > last:
+            raise ValueError("Invalid range '{0}'".format(text))
+        return rangeToNetworks(first, last)
+
+    return [ (addressToInt(text), ADDRESS_BITS) ]
+
+
+# return the integer value of the address of a client, None if it is not an IPv4 address
+def clientAddress(ip):
+    try:
+        return addressToInt(ip)
+    except (ValueError, AttributeError):
+        return None
+
+
+# class
+#----------
+
+# a node of the tree: a network and the value given to it (None for an intermediate node)
+class AddressNode:
+    __slots__ = ( 'address', 'length', 'value', 'children' )
+
+    # constructor
+    def __init__(self, address, length, value = None):
+        self.address  = address
+        self.length   = length
+        self.value    = value
+        self.children = [ None, None ]
+
+
+class AddressTree:
+    # constructor
+    def __init__(self):
+        self.root  = AddressNode(0, 0)
+        self.count = 0
+
+
+    # number of networks in the tree
+    def __len__(self):
+        return self.count
+
+
+    # give a value to a network (replace the previous value of the same network)
+    def insert(self, address, length, value):
+        address = maskAddress(address, length)
+        node = self.root
+
+        while True:
+            if node.length == length:
+                if node.value is None:
+                    self.count = self.count + 1
+                node.value = value
+                return
+
+            bit = (address >> (ADDRESS_BITS - 1 - node.length)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = AddressNode(address, length, value)
+                self.count = self.count + 1
+                return
+
+            # number of leading bits shared by the network and the child
+            common = min(child.length, length, ADDRESS_BITS - (child.address ^ address).bit_length())
+            if common == child.length:
+                node = child
+                continue
+
+            # insert a node for the shared bits between the node and its child
+            middle = AddressNode(maskAddress(address, common), common)
+            middle.children[(child.address >> (ADDRESS_BITS - 1 - common)) & 1] = child
+            node.children[bit] = middle
+
+            if common == length:
+                middle.value = value
+            else:
+                middle.children[(address >> (ADDRESS_BITS - 1 - common)) & 1] = AddressNode(address, length, value)
+
+            self.count = self.count + 1
+            return
+
+
+    # return the value of the most specific network containing an address, None if there is none
+    def lookup(self, address):
+        node = self.root
+        found = node.value
+
+        while node.length < ADDRESS_BITS:
+            child = node.children[(address >> (ADDRESS_BITS - 1 - node.length)) & 1]
+            if (child is None) or ((address ^ child.address) >> (ADDRESS_BITS - child.length)):
+                break
+
+            if child.value is not None:
+                found = child.value
+            node = child
+
+        return found
@@ -0,0 +1,194 @@
+# @file     CacheSnapshot.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Snapshot of the caches on disk, to restart with warm caches
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The file holds a header, the index of the answers (question, times, position
+#           of the answer), the verdicts (client, domain, day, time bucket, id of the rule)
+#           and the answers themselves, one after the other.
+#           When the proxy starts, only the index is read: the file is memory-mapped and
+#           an answer is read the first time its question is asked. The answers that have
+#           expired are dropped. The verdicts are only restored with the same rules
+#           (same fingerprint of the rule set).
+#           The snapshot is written in a temporary file renamed at the end, so that a
+#           crash while writing leaves the previous snapshot.
+
+# imports
+#----------
+import os
+import mmap
+import time
+import struct
+
+
+# globals
+#----------
+
+# magic, version, time of the snapshot, fingerprint of the rules, number of answers and of verdicts
+HEADER = struct.Struct('<4sHdIII')
+MAGIC = 'DPCS'
+VERSION = 2
+
+# question type and class, DNSSEC bits of the query, time when stored, expiration time,
+# position and size of the answer
+ANSWER = struct.Struct('<HHBddII')
+
+# day, time bucket, id of the rule (0 for the default action)
+VERDICT = struct.Struct('<BHI')
+
+# size of a string
+LENGTH = struct.Struct('<H')
+
+
+# functions
+#----------
+
+# return a string with its size
+def packString(text):
+    text = str(text)
+    return LENGTH.pack(len(text)) + text
+
+
+# read a string at a position of a buffer
+# return the string and the position after it
+def unpackString(data, index):
+    length = LENGTH.unpack_from(data, index)[0]
+    index = index + LENGTH.size
+    return data[index:index + length], index + length
+
+
+# write a snapshot
+# answers is a list of (key in the cache, answer, time when stored, expiration time)
+# verdicts a list of ((ip, domain, day, bucket), rule id)
+def writeSnapshot(path, answers, verdicts, fingerprint):
+    now = time.time()
+    index = list()
+    blobs = list()
+    position = 0
+
+    for (domain, qtype, qclass, bits), data, stored, expires in answers:
+        if expires <= now:
+            continue
+
+        index.append(packString(domain) + ANSWER.pack(qtype, qclass, bits, stored, expires, position, len(data)))
+        blobs.append(data)
+        position = position + len(data)
+
+    for (ip, domain, day, bucket), rule_id in verdicts:
+        index.append(packString(ip) + packString(domain) + VERDICT.pack(day, bucket, rule_id))
+
+    temp = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(temp, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, now, fingerprint, len(blobs), len(verdicts)))
+        fh.write(''.join(index))
+        for blob in blobs:
+            fh.write(str(blob))
+
+    os.rename(temp, path)
+    return len(blobs), len(verdicts)
+
+
+# class
+#----------
+class CacheSnapshot:
+    # constructor
+    def __init__(self, path):
+        self.path = path
+
+        # key in the cache -> (time when stored, expiration time, position, size) of the answers not restored yet
+        self.answers = dict()
+
+        # list of ((ip, domain, day, bucket), rule id)
+        self.verdicts = list()
+
+        self.fingerprint = None
+        self.created = None
+        self.expired = 0
+        self.mm = None
+        self.fd = None
+        self.base = 0
+
+
+    # read the index of the snapshot (IOError / ValueError if it cannot be read)
+    def open(self):
+        self.fd = open(self.path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.fd.fileno(), 0, access = mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            self.close()
+            raise ValueError("empty snapshot")
+
+        try:
+            magic, version, self.created, self.fingerprint, answers, verdicts = HEADER.unpack_from(self.mm, 0)
+            if (magic, version) != (MAGIC, VERSION):
+                self.close()
+                raise ValueError("unknown format")
+
+            now = time.time()
+            mm = self.mm
+            index = HEADER.size
+
+            for i in range(answers):
+                domain, index = unpackString(mm, index)
+                qtype, qclass, bits, stored, expires, position, size = ANSWER.unpack_from(mm, index)
+                index = index + ANSWER.size
+                if expires > now:
+                    self.answers[(domain, qtype, qclass, bits)] = (stored, expires, position, size)
+                else:
+                    self.expired = self.expired + 1
+
+            for i in range(verdicts):
+                ip, index = unpackString(mm, index)
+                domain, index = unpackString(mm, index)
+                day, bucket, rule_id = VERDICT.unpack_from(mm, index)
+                index = index + VERDICT.size
+                self.verdicts.append(((ip, domain, day, bucket), rule_id))
+
+            self.base = index
+        except struct.error:
+            self.close()
+            raise ValueError("truncated snapshot")
+
+
+    # release the file once all the answers have been restored
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+        self.answers = dict()
+
+
+    # remove the answer of a key of the cache from the snapshot
+    # return (answer, time when stored, expiration time), None if not found or expired
+    def pop(self, key, now):
+        item = self.answers.pop(key, None)
+        if item is None:
+            return None
+
+        stored, expires, position, size = item
+        data = self.mm[self.base + position:self.base + position + size]
+
+        if not self.answers:
+            self.close()
+
+        if expires <= now:
+            return None
+
+        return data, stored, expires
+
+
+    # return the list of (key in the cache, answer, time when stored, expiration time) not restored yet
+    # (they are kept in the snapshot)
+    def items(self, now):
+        base = self.base
+        return [ (key, self.mm[base + position:base + position + size], stored, expires)
+                 for key, (stored, expires, position, size) in self.answers.iteritems() if expires > now ]
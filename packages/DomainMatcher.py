@@ -0,0 +1,265 @@
+# @file     DomainMatcher.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Index of the domain patterns used by the rule processor
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The patterns are regular expressions searched in the requested domain
+#           (case insensitive). Those anchored on a domain name whose dots are escaped
+#           are stored in hash tables and matched by walking the labels of the requested
+#           domain, so their cost does not depend on the number of patterns:
+#               ^www\.tf1\.fr$                the domain only
+#               \.tf1\.fr$ or .*\.tf1\.fr$    its sub-domains only
+#               (^|\.)tf1\.fr$               the domain and its sub-domains
+#           The other patterns, plain names included (google.com also matches
+#           notgoogle.com or google.com.au, ^www.tf1.fr$ matches wwwxtf1.fr), are
+#           combined into a few alternations without groups, which tell if one of their
+#           patterns matches; only the patterns of the alternations matching the domain
+#           are searched one by one.
+#           Patterns can be added and removed after compile(): only the alternations
+#           of the modified chunks are compiled again.
+#           Large lists of domains (DomainList) are indexed by the hashes of their names,
+#           computed once per requested domain for all the lists.
+
+# imports
+#----------
+import re
+
+from DomainList import suffixHashes
+
+
+# globals
+#----------
+
+# maximum number of patterns combined in one regular expression (the patterns of a matching
+# alternation are searched one by one)
+MAX_GROUPS = 90
+
+# recognize the patterns that are domain names (with escaped dots) anchored at the end:
+# prefix, domain name
+DOMAIN_PATTERN = re.compile(r'^(\^|\\\.|\.\*\\\.|\(\^\|\\\.\))?((?:[a-z0-9_-]+\\\.)+[a-z0-9_-]+)\$$', re.IGNORECASE)
+
+# kind of pattern
+KIND_EXACT      = 0         # the domain only
+KIND_SUBDOMAINS = 1         # the sub-domains only
+KIND_SUFFIX     = 2         # the domain and its sub-domains
+KIND_REGEX      = 3         # regular expression
+KIND_LIST       = 4         # list of domains and their sub-domains
+
+
+# functions
+#----------
+
+# find how a pattern should be matched
+# return the kind of pattern and the domain name (the pattern itself for regex)
+def parsePattern(pattern):
+    match = DOMAIN_PATTERN.match(pattern)
+    if match is None:
+        return KIND_REGEX, pattern
+
+    prefix, name = match.groups()
+    name = name.replace('\\.', '.').lower()
+
+    # ^domain$
+    if prefix == '^':
+        return KIND_EXACT, name
+
+    # \.domain$ or .*\.domain$
+    if prefix in ('\\.', '.*\\.'):
+        return KIND_SUBDOMAINS, name
+
+    # (^|\.)domain$
+    if prefix is not None:
+        return KIND_SUFFIX, name
+
+    # domain$ also matches the names ending with it (notdomain)
+    return KIND_REGEX, pattern
+
+
+# remove the leading and trailing '.*' of a regular expression
+# they do not change the result of re.search() but make it much slower
+def searchPattern(pattern):
+    if pattern.startswith('.*') and (pattern[2:3] not in ('*', '+', '?', '{')):
+        pattern = pattern[2:]
+
+    if pattern.endswith('.*') and not pattern.endswith('\\.*'):
+        pattern = pattern[:-2]
+
+    return pattern
+
+
+# class
+#----------
+class DomainMatcher:
+    # constructor
+    def __init__(self):
+        # domain name -> values matching this domain
+        self.names = dict()
+
+        # domain name -> values matching the sub-domains of this domain
+        self.parents = dict()
+
+        # value -> (kind, domain name, index of its chunk of regular expressions)
+        self.patterns = dict()
+
+        # chunks of (value, compiled regex) and their alternation (None for a regex with groups)
+        self.chunks   = list()
+        self.combined = list()
+        self.dirty    = set()
+
+        # value -> list of domains
+        self.lists = dict()
+
+        # value -> position used to sort the values returned by match()
+        self.order = dict()
+
+
+    # return a copy of the matcher that can be modified without changing this one
+    # (the lists are shared and replaced, never modified in place)
+    def copy(self):
+        matcher = DomainMatcher()
+        matcher.names    = dict(self.names)
+        matcher.parents  = dict(self.parents)
+        matcher.patterns = dict(self.patterns)
+        matcher.chunks   = list(self.chunks)
+        matcher.combined = list(self.combined)
+        matcher.dirty    = set(self.dirty)
+        matcher.lists    = dict(self.lists)
+        matcher.order    = dict(self.order)
+        return matcher
+
+
+    # add a pattern associated with a value (a value has only one pattern)
+    # values are returned by match() in the order of insertion, or the one given to reorder()
+    def add(self, pattern, value):
+        kind, name = parsePattern(pattern)
+        chunk = None
+
+        if kind == KIND_REGEX:
+            regex = re.compile(searchPattern(pattern), re.IGNORECASE)
+
+            # a regex with groups cannot be combined and has its own chunk
+            if regex.groups > 0:
+                chunk = self.__chunk(full = True)
+            else:
+                chunk = self.__chunk()
+
+            self.chunks[chunk] = self.chunks[chunk] + [ (value, regex) ]
+            self.combined[chunk] = (None, self.chunks[chunk])
+            if regex.groups == 0:
+                self.dirty.add(chunk)
+
+        if kind in (KIND_EXACT, KIND_SUFFIX):
+            self.names[name] = self.names.get(name, []) + [ value ]
+
+        if kind in (KIND_SUBDOMAINS, KIND_SUFFIX):
+            self.parents[name] = self.parents.get(name, []) + [ value ]
+
+        self.patterns[value] = (kind, name, chunk)
+        self.order.setdefault(value, len(self.order))
+        return kind
+
+
+    # add a list of domains associated with a value
+    def addList(self, domains, value):
+        self.lists[value] = domains
+        self.patterns[value] = (KIND_LIST, None, None)
+        self.order.setdefault(value, len(self.order))
+        return KIND_LIST
+
+
+    # remove the pattern of a value
+    def remove(self, value):
+        kind, name, chunk = self.patterns.pop(value)
+        self.order.pop(value, None)
+
+        if kind == KIND_LIST:
+            del self.lists[value]
+            return
+
+        if chunk is not None:
+            self.chunks[chunk] = [ item for item in self.chunks[chunk] if item[0] != value ]
+            self.combined[chunk] = (None, self.chunks[chunk])
+            self.dirty.add(chunk)
+
+        for table in (self.names, self.parents):
+            values = table.get(name)
+            if values and (value in values):
+                values = [ v for v in values if v != value ]
+                if values:
+                    table[name] = values
+                else:
+                    del table[name]
+
+
+    # change the position of the values returned by match(): value -> position
+    def reorder(self, order):
+        self.order = dict((value, order[value]) for value in self.patterns)
+
+
+    # return the index of a chunk with room for one more regex (of an empty chunk when full)
+    def __chunk(self, full = False):
+        for index, chunk in enumerate(self.chunks):
+            if (not chunk) or (not full and len(chunk) < MAX_GROUPS and chunk[0][1].groups == 0):
+                return index
+
+        self.chunks.append(list())
+        self.combined.append((None, self.chunks[-1]))
+        return len(self.chunks) - 1
+
+
+    # combine the regular expressions of the chunks modified since the last call
+    def compile(self):
+        for index in self.dirty:
+            chunk = self.chunks[index]
+            if (not chunk) or (chunk[0][1].groups > 0):
+                continue
+
+            # (groups would only slow down the search)
+            text = '|'.join('(?:{0})'.format(regex.pattern) for value, regex in chunk)
+            self.combined[index] = (re.compile(text, re.IGNORECASE), chunk)
+
+        self.dirty = set()
+
+
+    # return the sorted list of the values whose pattern matches the domain
+    def match(self, domain):
+        domain = domain.lower()
+        values = list()
+
+        # the domain itself
+        found = self.names.get(domain)
+        if found:
+            values.extend(found)
+
+        # its parent domains
+        index = domain.find('.')
+        while index >= 0:
+            found = self.parents.get(domain[index + 1:])
+            if found:
+                values.extend(found)
+            index = domain.find('.', index + 1)
+
+        # the regular expressions: the combined alternation tells if one of them matches
+        for combined, chunk in self.combined:
+            if (combined is not None) and (combined.search(domain) is None):
+                continue
+
+            for value, regex in chunk:
+                if regex.search(domain):
+                    values.append(value)
+
+        # the lists of domains
+        if self.lists:
+            hashes = suffixHashes(domain)
+            for value, domains in self.lists.iteritems():
+                if domains.contains(hashes):
+                    values.append(value)
+
+        if len(values) > 1:
+            values = sorted(set(values), key = self.order.get)
+
+        return values
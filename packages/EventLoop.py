@@ -0,0 +1,203 @@
+# @file     EventLoop.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Wait for the events on the sockets of the proxy
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Three engines can be selected with the 'event_loop' option:
+#           select : portable, the set of sockets is scanned at each call
+#           poll   : no limit on the file descriptors numbers
+#           epoll  : Linux only, the cost of a call does not depend on the number of sockets
+#           'auto' picks the best engine available on the system.
+#           The sockets can be added and removed while the loop runs, and can be
+#           watched for writing while they have data waiting to be sent.
+#           A signal received during the wait returns empty lists of events.
+
+# imports
+#----------
+import errno
+import select
+
+
+# globals
+#----------
+
+EVENT_LOOPS = [ 'auto', 'select', 'poll', 'epoll' ]
+
+DEFAULT_EVENT_LOOP = 'auto'
+
+
+# functions
+#----------
+
+# return the name of the best engine available
+def bestEventLoop():
+    if hasattr(select, 'epoll'):
+        return 'epoll'
+
+    if hasattr(select, 'poll'):
+        return 'poll'
+
+    return 'select'
+
+
+# create the engine of the name given with the list of sockets to watch
+def createEventLoop(name, sockets):
+    if name == 'auto':
+        name = bestEventLoop()
+
+    if name == 'epoll':
+        return EpollLoop(sockets)
+
+    if name == 'poll':
+        return PollLoop(sockets)
+
+    return SelectLoop(sockets)
+
+
+# return True if the exception has been raised by a signal
+def _interrupted(e):
+    code = e.args[0] if e.args else None
+    return code == errno.EINTR
+
+
+# class
+#----------
+class SelectLoop:
+    name = 'select'
+
+    # constructor
+    def __init__(self, sockets):
+        self.sockets = list(sockets)
+        self.writers = list()
+
+    # watch a new socket
+    def register(self, sock):
+        self.sockets.append(sock)
+
+    # stop watching a socket
+    def unregister(self, sock):
+        if sock in self.sockets:
+            self.sockets.remove(sock)
+        if sock in self.writers:
+            self.writers.remove(sock)
+
+    # wait (or not) for a socket to be writable
+    def watchWrite(self, sock, enabled):
+        if enabled and (sock not in self.writers):
+            self.writers.append(sock)
+        elif (not enabled) and (sock in self.writers):
+            self.writers.remove(sock)
+
+    # wait for the readable and writable sockets
+    def wait(self, timeout):
+        try:
+            rd, wr, ex = select.select(self.sockets, self.writers, [], timeout)
+        except (select.error, IOError, OSError) as e:
+            if not _interrupted(e):
+                raise
+            return list(), list()
+
+        return rd, wr
+
+    # release the resources
+    def close(self):
+        pass
+
+
+class PollLoop:
+    name = 'poll'
+
+    # constructor
+    def __init__(self, sockets):
+        self.poller = select.poll()
+        self.fds = dict()
+
+        for sock in sockets:
+            self.register(sock)
+
+    # watch a new socket
+    def register(self, sock):
+        self.fds[sock.fileno()] = sock
+        self.poller.register(sock.fileno(), select.POLLIN)
+
+    # stop watching a socket
+    def unregister(self, sock):
+        if self.fds.pop(sock.fileno(), None) is not None:
+            self.poller.unregister(sock.fileno())
+
+    # wait (or not) for a socket to be writable
+    def watchWrite(self, sock, enabled):
+        self.poller.modify(sock.fileno(), (select.POLLIN | select.POLLOUT) if enabled else select.POLLIN)
+
+    # wait for the readable and writable sockets
+    def wait(self, timeout):
+        # poll expects milliseconds
+        if timeout is not None:
+            timeout = int(timeout * 1000 + 0.999)
+
+        try:
+            events = self.poller.poll(timeout)
+        except (select.error, IOError, OSError) as e:
+            if not _interrupted(e):
+                raise
+            return list(), list()
+
+        # errors and hang-ups are reported as readable so that the owner sees them
+        rd = [ self.fds[fd] for fd, event in events if event & (select.POLLIN | select.POLLERR | select.POLLHUP) ]
+        wr = [ self.fds[fd] for fd, event in events if event & select.POLLOUT ]
+        return rd, wr
+
+    # release the resources
+    def close(self):
+        pass
+
+
+class EpollLoop:
+    name = 'epoll'
+
+    # constructor
+    def __init__(self, sockets):
+        self.poller = select.epoll()
+        self.fds = dict()
+
+        for sock in sockets:
+            self.register(sock)
+
+    # watch a new socket
+    def register(self, sock):
+        self.fds[sock.fileno()] = sock
+        self.poller.register(sock.fileno(), select.EPOLLIN)
+
+    # stop watching a socket
+    def unregister(self, sock):
+        if self.fds.pop(sock.fileno(), None) is not None:
+            self.poller.unregister(sock.fileno())
+
+    # wait (or not) for a socket to be writable
+    def watchWrite(self, sock, enabled):
+        self.poller.modify(sock.fileno(), (select.EPOLLIN | select.EPOLLOUT) if enabled else select.EPOLLIN)
+
+    # wait for the readable and writable sockets
+    def wait(self, timeout):
+        if timeout is None:
+            timeout = -1
+
+        try:
+            events = self.poller.poll(timeout)
+        except (select.error, IOError, OSError) as e:
+            if not _interrupted(e):
+                raise
+            return list(), list()
+
+        # errors and hang-ups are reported as readable so that the owner sees them
+        rd = [ self.fds[fd] for fd, event in events if event & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP) ]
+        wr = [ self.fds[fd] for fd, event in events if event & select.EPOLLOUT ]
+        return rd, wr
+
+    # release the resources
+    def close(self):
+        self.poller.close()
@@ -0,0 +1,507 @@
+# @file     Forwarder.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Non-blocking forwarding engine between the clients and the real DNS
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The forwarder owns a small set of long-lived UDP sockets connected to each
+#           real DNS. Each forwarded query receives a new transaction ID so that the
+#           queries coming from different clients cannot collide. The in-flight table,
+#           keyed by (upstream ID, question), maps the answers back to the client.
+#           A query is kept upstream_timeout seconds after it has been sent first. When
+#           an attempt is slow (no answer after the retransmission timeout of the
+#           server, computed from its latency), the query is also sent to another
+#           server, up to upstream_retries times, and the answer of any of them is
+#           accepted. Only the servers of a query lost after upstream_timeout are
+#           counted as failing. Every upstream_probe_interval seconds, a probe query is
+#           sent to each server to follow its health and latency when it gets no traffic.
+#           The queries of the TCP clients, and the queries whose UDP answer has the TC
+#           flag, are sent over persistent TCP connections to the servers (at most
+#           upstream_tcp_connections per server), shared by all the queries.
+#           A query asking the same question as a query already in flight (same flags
+#           and DNSSEC OK bit) is not forwarded: it waits for the answer of the first
+#           one, sent to each waiting client with its own transaction ID and the case
+#           of its own question.
+#           A query can carry the expired answer of the cache: it is given to the client
+#           when an attempt gets no answer in time, and the query goes on to refresh the
+#           cache. A prefetch query refreshes the cache without any client.
+
+# imports
+#----------
+import time
+import heapq
+import errno
+import random
+import socket
+import struct
+
+from DNSQuery import DNSQuery
+from DNSQuery import FLAG_TC
+from UpstreamPool import UpstreamPool
+from TCPStream import openStream
+
+
+# globals
+#----------
+
+MAX_BUFFER = 32768
+
+# default values when the options are not present in the configuration
+DEFAULT_UPSTREAM_SOCKETS = 4
+DEFAULT_UPSTREAM_TIMEOUT = 2.0
+DEFAULT_UPSTREAM_RETRIES = 1
+DEFAULT_UPSTREAM_PROBE_INTERVAL = 10.0
+DEFAULT_UPSTREAM_TCP_CONNECTIONS = 2
+
+# flags of the query that change the answer: opcode, RD and CD
+COALESCE_FLAGS = 0x7910
+
+# probe query: NS records of the root zone, recursion desired
+PROBE_REQUEST = struct.pack('>6H', 0, 0x0100, 1, 0, 0, 0) + '\x00' + struct.pack('>HH', 2, 1)
+
+
+# functions
+#----------
+
+# return the key of the queries that can share the same answer
+def coalesceKey(query):
+    return (query.question(), query.flags & COALESCE_FLAGS, query.dnssec(), query.queries)
+
+
+# class
+#----------
+
+# a query waiting for its answer from the real DNS
+class InflightQuery:
+    # constructor
+    def __init__(self, query, sock, key, rule = None, tcp = False, probe = False, received = None):
+        self.query    = query           # DNSQuery object received from the client
+        self.sock     = sock            # socket (or TCP stream) used to answer the client
+        self.addr     = query.addr      # address of the client
+        self.key      = key             # key in the in-flight table
+        self.ckey     = None            # key in the table of the questions in flight
+        self.rule     = rule            # rule that has accepted the query (None for the default action)
+        self.sent     = time.time()     # time when the query has been forwarded
+        self.received = received or self.sent   # time when the query has been received from the client
+        self.deadline = None            # time after which the current attempt is considered slow
+        self.expires  = None            # time after which the query is lost (upstream_timeout after the first send)
+        self.retries  = 0               # number of times the query has been sent again
+        self.tcp      = tcp             # True when the query is sent over TCP
+        self.probe    = probe           # True for a probe query sent by the proxy
+        self.waiters  = list()          # queries of other clients waiting for the same answer
+        self.coalesced = False          # True for a query waiting for the answer of another one
+        self.stale    = None            # expired answer given to the client if the real DNS fails
+        self.answered = False           # True when the client has already been answered (or for a prefetch)
+
+        self.upstreams = dict()         # server -> time when the query has been sent to it
+        self.pending   = list()         # servers of the current attempt
+
+
+class Forwarder:
+    # constructor
+    def __init__(self, dummy, dns_host, dns_port):
+        self.dummy  = dummy
+        self.config = dummy.application.config
+        self.logger = dummy.logger
+        self.metrics = dummy.metrics
+
+        # real DNS servers
+        self.pool = UpstreamPool(dummy, dns_host, dns_port)
+
+        # TCP connections to the servers: socket -> (server, stream)
+        self.streams = dict()
+        self.loop    = None
+
+        # in-flight table and the heap of (deadline, sequence, entry)
+        self.inflight  = dict()
+        self.deadlines = list()
+        self.sequence  = 0
+
+        # coalescing key -> query forwarded for the clients asking the same question
+        self.questions = dict()
+        self.coalesced = 0
+        self.waiting   = 0
+
+        # read the options
+        self.count    = DEFAULT_UPSTREAM_SOCKETS
+        self.timeout  = DEFAULT_UPSTREAM_TIMEOUT
+        self.retries  = DEFAULT_UPSTREAM_RETRIES
+        self.interval = DEFAULT_UPSTREAM_PROBE_INTERVAL
+        self.tcp_count = DEFAULT_UPSTREAM_TCP_CONNECTIONS
+        self.coalesce  = True
+
+        if self.config.has_option('proxy', 'upstream_sockets'):
+            self.count = max(1, self.config.getint('proxy', 'upstream_sockets'))
+
+        if self.config.has_option('proxy', 'upstream_timeout'):
+            self.timeout = self.config.getfloat('proxy', 'upstream_timeout')
+
+        if self.config.has_option('proxy', 'upstream_retries'):
+            self.retries = max(0, self.config.getint('proxy', 'upstream_retries'))
+
+        if self.config.has_option('proxy', 'upstream_probe_interval'):
+            self.interval = max(0, self.config.getfloat('proxy', 'upstream_probe_interval'))
+
+        if self.config.has_option('proxy', 'upstream_tcp_connections'):
+            self.tcp_count = max(1, self.config.getint('proxy', 'upstream_tcp_connections'))
+
+        if self.config.has_option('proxy', 'upstream_coalesce'):
+            self.coalesce = self.config.getboolean('proxy', 'upstream_coalesce')
+
+        # time of the next probes
+        self.next_probe = None
+
+        # probe query decoded once
+        self.probe = DNSQuery()
+        self.probe.decode(PROBE_REQUEST, (None, None))
+
+
+    # create the upstream sockets and watch them with the event loop
+    def initialize(self, loop):
+        if self.pool.initialize(self.count) == False:
+            return False
+
+        self.loop = loop
+        for sock in self.pool.sockets():
+            self.loop.register(sock)
+
+        if self.interval:
+            self.next_probe = time.time() + self.interval
+
+        self.logger.info("{0} sockets per upstream, timeout set to {1}s, {2} retries", self.count, self.timeout, self.retries)
+        return True
+
+
+    # close all the upstream sockets
+    def close(self):
+        for sock in list(self.streams.keys()):
+            self.__closeStream(sock)
+
+        self.pool.close()
+
+
+    # return True if the socket belongs to the forwarder
+    def owns(self, sock):
+        return (sock in self.streams) or (self.pool.owner(sock) is not None)
+
+
+    # return the number of queries waiting for an answer (with the ones coalesced)
+    def pending(self):
+        return len(self.inflight) + self.waiting
+
+
+    # return the statistics of the real DNS servers
+    def stats(self):
+        return "{0}, {1} queries coalesced".format(self.pool.stats(), self.coalesced)
+
+
+    # allocate a transaction ID not used by another query with the same question
+    def __allocate(self, question):
+        while True:
+            upstream_id = random.randint(0, 0xFFFF)
+            key = (upstream_id, question)
+            if key not in self.inflight:
+                return key
+
+
+    # return a TCP connection to a server, opening a new one while the limit is not reached
+    def __stream(self, upstream):
+        if len(upstream.streams) < self.tcp_count:
+            stream = openStream((upstream.host, upstream.port))
+            upstream.streams.append(stream)
+            self.streams[stream.sock] = (upstream, stream)
+            self.loop.register(stream.sock)
+            return stream
+
+        upstream.stream_index = (upstream.stream_index + 1) % len(upstream.streams)
+        return upstream.streams[upstream.stream_index]
+
+
+    # close a TCP connection to a server
+    # the queries sent through it will be sent again when their retransmission timeout expires
+    def __closeStream(self, sock):
+        upstream, stream = self.streams.pop(sock)
+        upstream.streams.remove(stream)
+
+        self.loop.unregister(sock)
+        stream.close()
+
+
+    # send a query to the servers given and set the deadline of the attempt
+    # return False if the query could not be sent to any server
+    def __send(self, entry, upstreams, now):
+        # rewrite the transaction ID of the request
+        data = struct.pack('>H', entry.key[0]) + entry.query.data[2:]
+
+        entry.pending = list()
+        for upstream in upstreams:
+            try:
+                if entry.tcp:
+                    stream = self.__stream(upstream)
+                    stream.write(data)
+                    if stream.closed:
+                        self.__closeStream(stream.sock)
+                        raise socket.error('connection closed')
+                    if stream.pending():
+                        self.loop.watchWrite(stream.sock, True)
+                    upstream.queries += 1
+                else:
+                    upstream.send(data)
+            except socket.error as e:
+                self.logger.error('Unable to forward the query to the real DNS {0}: {1}', upstream, str(e))
+                continue
+
+            entry.upstreams[upstream] = now
+            entry.pending.append(upstream)
+
+        if not entry.pending:
+            return False
+
+        if entry.expires is None:
+            entry.expires = now + self.timeout
+
+        # the probes are not sent again
+        deadline = entry.expires
+        if not entry.probe:
+            deadline = min(deadline, now + max([ u.rto(self.timeout) for u in entry.pending ]))
+        self.__schedule(entry, deadline)
+
+        return True
+
+
+    # set the time of the next check of a query
+    def __schedule(self, entry, deadline):
+        entry.deadline = deadline
+        self.sequence += 1
+        heapq.heappush(self.deadlines, (deadline, self.sequence, entry))
+
+
+    # forward a query from a client to the real DNS
+    # (received is the time when the query has been received, for the latency of the answer,
+    # stale the expired answer given to the client if the real DNS does not answer in time)
+    def forward(self, query, sock, rule = None, tcp = False, received = None, stale = None):
+        entry = InflightQuery(query, sock, None, rule, tcp, received = received)
+        entry.stale = stale
+
+        # the same question is already in flight: wait for its answer
+        ckey = coalesceKey(query) if self.coalesce else None
+        leader = self.questions.get(ckey)
+        if leader is not None:
+            entry.coalesced = True
+            leader.waiters.append(entry)
+            self.coalesced += 1
+            self.waiting += 1
+            return True
+
+        return self.__start(entry, ckey)
+
+
+    # send a query to refresh the answer of the cache before it expires
+    def prefetch(self, query):
+        ckey = coalesceKey(query) if self.coalesce else None
+        if ckey in self.questions:
+            return False
+
+        entry = InflightQuery(query, None, None)
+        entry.answered = True
+        return self.__start(entry, ckey)
+
+
+    # send a new query to the real DNS and add it to the in-flight tables
+    def __start(self, entry, ckey):
+        entry.key = self.__allocate(entry.query.question())
+        if self.__send(entry, self.pool.select(), entry.sent) == False:
+            return False
+
+        self.inflight[entry.key] = entry
+        if ckey is not None:
+            entry.ckey = ckey
+            self.questions[ckey] = entry
+
+        return True
+
+
+    # remove a query from the in-flight table
+    # return the query and the queries waiting for its answer
+    def __remove(self, entry):
+        del self.inflight[entry.key]
+
+        if (entry.ckey is not None) and (self.questions.get(entry.ckey) is entry):
+            del self.questions[entry.ckey]
+
+        self.waiting -= len(entry.waiters)
+        return [ entry ] + entry.waiters
+
+
+    # send a probe query to all the servers
+    def __probe(self, now):
+        for upstream in self.pool.upstreams:
+            entry = InflightQuery(self.probe, None, self.__allocate(self.probe.question()), probe = True)
+            if self.__send(entry, [ upstream ], now):
+                self.inflight[entry.key] = entry
+
+
+    # read all the answers available on an upstream socket or TCP connection
+    # return a list of (entry, response) with the response ready for the client
+    def receive(self, sock):
+        answers = list()
+
+        # answers over TCP
+        if sock in self.streams:
+            upstream, stream = self.streams[sock]
+            for response in stream.read():
+                self.__answer(upstream, response, answers)
+
+            if stream.closed:
+                self.logger.debug('TCP connection to the real DNS {0} has been closed.', upstream)
+                self.__closeStream(sock)
+
+            return answers
+
+        # answers over UDP
+        upstream = self.pool.owner(sock)
+        while True:
+            try:
+                response = sock.recv(MAX_BUFFER)
+            except socket.error as e:
+                if e.errno == errno.ECONNREFUSED:
+                    self.logger.debug('Real DNS {0} has refused a query.', upstream)
+                elif e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.logger.warning('Error when reading an upstream socket: {0}', str(e))
+                break
+
+            self.__answer(upstream, response, answers)
+
+        return answers
+
+
+    # match an answer of a server with its in-flight query
+    def __answer(self, upstream, response, answers):
+        # decode the answer to retrieve the question
+        answer = DNSQuery()
+        if answer.decode(response, (upstream.host, upstream.port), edns = False) is None:
+            self.logger.warning('Unable to decode an answer from the real DNS {0}.', upstream)
+            return
+
+        key = (answer.requestID, answer.question())
+        entry = self.inflight.get(key)
+        if (entry is None) or (upstream not in entry.upstreams):
+            self.logger.debug('Answer {0} does not match any in-flight query.', answer.requestID)
+            return
+
+        now = time.time()
+        rtt = now - entry.upstreams[upstream]
+        self.pool.success(upstream, rtt)
+        if not entry.probe:
+            self.metrics.upstream.record(rtt)
+
+        # truncated answer: ask the same server again over TCP
+        if (answer.flags & FLAG_TC) and not entry.tcp and not entry.probe:
+            self.logger.debug('Truncated answer for [{0}], asking again over TCP.', entry.query.domain)
+            entry.tcp = True
+            if self.__send(entry, [ upstream ], now):
+                return
+
+        entries = self.__remove(entry)
+        if entry.probe:
+            return
+
+        # restore the transaction ID (and the case of the question) of each client
+        end = entry.query.end
+        for waiter in entries:
+            query = waiter.query
+            if (query.end == end) and (query.data[12:end] != response[12:end]):
+                data = struct.pack('>H', query.requestID) + response[2:12] + query.data[12:end] + response[end:]
+            else:
+                data = struct.pack('>H', query.requestID) + response[2:]
+
+            answers.append((waiter, data))
+
+
+    # send the data waiting for a writable TCP connection
+    def flush(self, sock):
+        if sock not in self.streams:
+            return
+
+        upstream, stream = self.streams[sock]
+        stream.flush()
+
+        if stream.closed:
+            self.__closeStream(sock)
+        elif not stream.pending():
+            self.loop.watchWrite(sock, False)
+
+
+    # send again the slow queries, remove the ones without answer after upstream_timeout, and
+    # send the probes
+    # return the list of the expired entries (the ones with a stale answer to give to their client
+    # and the lost ones)
+    def expire(self, now = None):
+        if now is None:
+            now = time.time()
+
+        expired = list()
+        while self.deadlines and (self.deadlines[0][0] <= now):
+            deadline, sequence, entry = heapq.heappop(self.deadlines)
+
+            # the entry has already been answered or sent again
+            if (self.inflight.get(entry.key) is not entry) or (entry.deadline != deadline):
+                continue
+
+            # no answer in upstream_timeout: the query is lost and its servers have failed
+            if entry.expires <= now:
+                for upstream in entry.upstreams:
+                    self.pool.failure(upstream, self.timeout)
+
+                entries = self.__remove(entry)
+                if not entry.probe:
+                    expired.extend([ waiter for waiter in entries if not waiter.answered ])
+                continue
+
+            # slow attempt: give the expired answers of the cache to the clients waiting for this query
+            for waiter in [ entry ] + entry.waiters:
+                if (waiter.stale is not None) and not waiter.answered:
+                    waiter.answered = True
+                    expired.append(waiter)
+
+            # try another server (an answer to the previous attempts is still accepted)
+            if entry.retries < self.retries:
+                entry.retries += 1
+                if self.__send(entry, self.pool.select(entry.upstreams), now):
+                    continue
+
+            # wait for the answers of the servers already asked
+            self.__schedule(entry, entry.expires)
+
+        if (self.next_probe is not None) and (self.next_probe <= now):
+            self.__probe(now)
+            self.next_probe = now + self.interval
+
+        return expired
+
+
+    # return the number of seconds before the next event (None if nothing is pending)
+    def nextTimeout(self, now = None):
+        if now is None:
+            now = time.time()
+
+        # drop the entries already answered at the head of the queue
+        while self.deadlines:
+            deadline, sequence, entry = self.deadlines[0]
+            if (self.inflight.get(entry.key) is entry) and (entry.deadline == deadline):
+                break
+            heapq.heappop(self.deadlines)
+
+        times = list()
+        if self.deadlines:
+            times.append(self.deadlines[0][0])
+        if self.next_probe is not None:
+            times.append(self.next_probe)
+
+        if not times:
+            return None
+
+        return max(0, min(times) - now)
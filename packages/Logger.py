@@ -6,10 +6,29 @@
 # @history
 #           2017-01-26 - 1.0.0 - SLE
 #           Initial Version
+#           2026-10-18 - 1.1.0 - SLE
+#           Asynchronous mode
+# @notes
+#           The messages can take arguments (positional or named), merged with
+#           str.format only when the message is written: a message below the log level
+#           costs one comparison. The keywords exc_info and extra are given to logging.
+#           The messages are written directly by default. In asynchronous mode
+#           (log_mode = async), the messages are put in a ring
+#           buffer of log_queue_size messages and written to the file by a thread.
+#           When the buffer is full, the oldest messages are dropped and counted.
+#           After a fork, the child has to call afterFork() to get its own thread, and
+#           its own file when it is a worker: the processes sharing a file would rotate
+#           it each on its own, losing the messages written in between.
 
 # imports
 #----------
+import os
+import sys
+import time
 import logging
+import binascii
+import threading
+import collections
 
 from logging.handlers import TimedRotatingFileHandler
 
@@ -24,29 +43,71 @@ LOGGER_LEVEL_WARNING    = logging.WARNING
 LOGGER_LEVEL_ERROR      = logging.ERROR
 LOGGER_LEVEL_CRITICAL   = logging.CRITICAL
 
+# logging modes
+LOG_MODE_SYNC  = 'sync'
+LOG_MODE_ASYNC = 'async'
+
+LOG_MODES = [ LOG_MODE_SYNC, LOG_MODE_ASYNC ]
+
+# default values when the options are not present in the configuration
+DEFAULT_LOG_MODE       = LOG_MODE_SYNC
+DEFAULT_LOG_QUEUE_SIZE = 10000
+
+# time between two writes of the asynchronous thread
+LOG_FLUSH_INTERVAL = 0.1
+
 
 # class
 #----------
+
+# hexadecimal dump of a message, computed only when the log is written
+class HexDump(object):
+    __slots__ = ( 'data', )
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return binascii.hexlify(self.data)
+
+
 class Logger:
     # constructor
     def __init__(self, dummy):
         self.dummy = dummy
         self.logLevel = None
+        config = dummy.application.config
 
         # retrieve the log file name from the configuration
-        logfile = dummy.application.config.get("proxy", "log_file")
+        self.logfile = config.get("proxy", "log_file")
 
-        # create a handler for rotating the logs every day and keeping 1 week of data
         self.logger = logging.getLogger("Rotating Log")
-        handler = TimedRotatingFileHandler(logfile, when = "d", interval = 1, backupCount = 5)
-        handler.setFormatter( logging.Formatter("%(asctime)s %(levelname)-8s %(message)s") )
+        self.handler = self.__handler(self.logfile)
+        self.logger.addHandler(self.handler)
+
+        # asynchronous mode
+        self.mode = DEFAULT_LOG_MODE
+        if config.has_option("proxy", "log_mode"):
+            self.mode = config.get("proxy", "log_mode").lower()
+            if self.mode not in LOG_MODES:
+                self.mode = DEFAULT_LOG_MODE
+
+        self.queue_size = DEFAULT_LOG_QUEUE_SIZE
+        if config.has_option("proxy", "log_queue_size"):
+            self.queue_size = max(1, config.getint("proxy", "log_queue_size"))
 
-        self.logger.addHandler(handler)
+        self.queue   = collections.deque(maxlen = self.queue_size)
+        self.dropped = 0
+        self.thread  = None
+        self.running = False
+
+        if self.mode == LOG_MODE_ASYNC:
+            self.__start()
 
         # set the default level
         self.level(LOGGER_LEVEL_INFO)
-        if self.dummy.application.config.has_option("proxy", "debug"):
-            if self.dummy.application.config.getboolean("proxy", "debug") == True:
+        if config.has_option("proxy", "debug"):
+            if config.getboolean("proxy", "debug") == True:
                 self.level(LOGGER_LEVEL_DEBUG)
                 self.debug("Mode debug activated")
 
@@ -60,22 +121,124 @@ class Logger:
             self.logLevel = level
             self.logger.setLevel(level)
 
+    # return True if the messages of this level are written
+    def enabled(self, level):
+        return level >= self.logLevel
+
+
+    # create a handler for rotating the logs every day and keeping 1 week of data
+    def __handler(self, logfile):
+        handler = TimedRotatingFileHandler(logfile, when = "d", interval = 1, backupCount = 5)
+        handler.setFormatter( logging.Formatter("%(asctime)s %(levelname)-8s %(message)s") )
+        return handler
+
+    # start the thread writing the messages
+    def __start(self):
+        self.running = True
+        self.thread = threading.Thread(target = self.__run, name = "Logger")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # body of the thread
+    def __run(self):
+        while self.running:
+            time.sleep(LOG_FLUSH_INTERVAL)
+            self.flush()
+
+    # write a message to the file
+    def __write(self, created, level, message, args, kwargs):
+        exc_info = kwargs.pop('exc_info', None)
+        extra = kwargs.pop('extra', None)
+
+        if args or kwargs:
+            try:
+                message = message.format(*args, **kwargs)
+            except (IndexError, KeyError, ValueError):
+                message = "{0} {1}".format(message, (args, kwargs) if kwargs else args)
+
+        record = self.logger.makeRecord(self.logger.name, level, '', 0, message, None, exc_info, extra = extra)
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        self.logger.handle(record)
+
+    # write the messages waiting in the queue
+    def flush(self):
+        dropped = self.dropped
+        if dropped:
+            self.dropped = self.dropped - dropped
+            self.__write(time.time(), LOGGER_LEVEL_WARNING, "{0} log messages have been dropped", (dropped, ), {})
+
+        queue = self.queue
+        while queue:
+            try:
+                created, level, message, args, kwargs = queue.popleft()
+            except IndexError:
+                break
+
+            self.__write(created, level, message, args, kwargs)
+
+    # write the last messages and stop the thread
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.flush()
+
+    # restart the thread in a child process: the messages of the parent are not written twice
+    # a worker writes to the log file with its number before the extension (dnsProxy.1.log)
+    def afterFork(self, worker = None):
+        self.queue.clear()
+        self.dropped = 0
+
+        if worker is not None:
+            root, ext = os.path.splitext(self.logfile)
+            self.logger.removeHandler(self.handler)
+            self.handler.close()
+            self.handler = self.__handler("{0}.{1}{2}".format(root, worker, ext))
+            self.logger.addHandler(self.handler)
+
+        if self.mode == LOG_MODE_ASYNC:
+            self.__start()
+
+    # send a message with the level given
+    def log(self, level, message, *args, **kwargs):
+        if level < self.logLevel:
+            return
+
+        # the exception has to be retrieved before the message is queued
+        if kwargs.get('exc_info') and not isinstance(kwargs['exc_info'], tuple):
+            kwargs['exc_info'] = sys.exc_info()
+
+        if self.thread is None:
+            self.__write(time.time(), level, message, args, kwargs)
+            return
+
+        if len(self.queue) == self.queue_size:
+            self.dropped = self.dropped + 1
+
+        self.queue.append((time.time(), level, message, args, kwargs))
+
+
     # send a debug message
     def debug(self, message, *args, **kwargs):
-        self.logger.debug(message, *args, **kwargs)
+        if LOGGER_LEVEL_DEBUG >= self.logLevel:
+            self.log(LOGGER_LEVEL_DEBUG, message, *args, **kwargs)
 
     # send an info message
     def info(self, message, *args, **kwargs):
-        self.logger.info(message, *args, **kwargs)
+        if LOGGER_LEVEL_INFO >= self.logLevel:
+            self.log(LOGGER_LEVEL_INFO, message, *args, **kwargs)
 
     # send a warning message
     def warning(self, message, *args, **kwargs):
-        self.logger.warning(message, *args, **kwargs)
+        self.log(LOGGER_LEVEL_WARNING, message, *args, **kwargs)
 
     # send an error message
     def error(self, message, *args, **kwargs):
-        self.logger.error(message, *args, **kwargs)
+        self.log(LOGGER_LEVEL_ERROR, message, *args, **kwargs)
 
     # send a critical message
     def critical(self, message, *args, **kwargs):
-        self.logger.critical(message, *args, **kwargs)
+        self.log(LOGGER_LEVEL_CRITICAL, message, *args, **kwargs)
@@ -0,0 +1,215 @@
+# @file     Metrics.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Counters and latency histograms exposed in the Prometheus text format
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The histograms use log-linear buckets (2 per power of 2, from 8us to 8s):
+#           recording a value is one bisect and one increment, cheap enough to stay
+#           always on. The counters are plain integers updated by the packet loop.
+#           When metrics_port is set, a thread serves http://metrics_address:port/metrics
+#           (the port is shifted by the number of the worker in multi-workers mode).
+#           The values are read without lock: a scrape can see a query half counted,
+#           never blocks the packet loop. A scrape does not change any value, so several
+#           scrapers can read the same endpoint (the rates are computed by Prometheus
+#           from the counters).
+
+# imports
+#----------
+import bisect
+import threading
+import BaseHTTPServer
+
+
+# globals
+#----------
+
+# buckets of the histograms, in seconds
+SUB_BUCKETS = 2
+BUCKETS = [ (2 ** e) * (1 + float(s) / SUB_BUCKETS) / 1000000.0 for e in range(3, 23) for s in range(SUB_BUCKETS) ]
+
+# default values when the options are not present in the configuration
+DEFAULT_METRICS_ADDRESS = '127.0.0.1'
+
+# prefix of all the metrics
+PREFIX = 'dnsproxy_'
+
+
+# functions
+#----------
+
+# return the labels of a metric in the text format
+def formatLabels(labels):
+    if not labels:
+        return ''
+
+    items = [ '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels ]
+    return '{' + ','.join(items) + '}'
+
+
+# class
+#----------
+
+# latency histogram
+class Histogram:
+    # constructor
+    def __init__(self):
+        self.counts = [ 0 ] * (len(BUCKETS) + 1)
+        self.sum    = 0.0
+
+    # add a value (in seconds)
+    def record(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    # return the lines of the histogram in the text format
+    def format(self, name, labels = ()):
+        lines = list()
+        counts = list(self.counts)
+
+        total = 0
+        for bound, count in zip(BUCKETS, counts):
+            total += count
+            lines.append('{0}_bucket{1} {2}'.format(name, formatLabels(list(labels) + [ ('le', '{0:g}'.format(bound)) ]), total))
+
+        total += counts[-1]
+        lines.append('{0}_bucket{1} {2}'.format(name, formatLabels(list(labels) + [ ('le', '+Inf') ]), total))
+        lines.append('{0}_sum{1} {2}'.format(name, formatLabels(labels), self.sum))
+        lines.append('{0}_count{1} {2}'.format(name, formatLabels(labels), total))
+        return lines
+
+
+# HTTP handler of the endpoint
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # no access log on stderr
+    def log_message(self, format, *args):
+        pass
+
+
+class Metrics:
+    # constructor
+    def __init__(self, dummy):
+        self.dummy  = dummy
+        self.config = dummy.application.config
+        self.logger = dummy.logger
+
+        # latency of each stage
+        self.decode   = Histogram()
+        self.rules    = Histogram()
+        self.upstream = Histogram()
+        self.total    = Histogram()
+
+        # counters
+        self.queries  = 0
+        self.tcp      = 0
+        self.invalid  = 0
+        self.limited  = 0               # refused as their client is over its rate limit
+        self.shed     = 0               # failed as too many queries are waiting for the real DNS
+        self.verdicts = dict()          # (verdict, section) -> count
+
+        # functions returning the other metrics: list of (name, type, help, [ (labels, value) ])
+        self.collectors = list()
+
+        # read the options
+        self.port = None
+        self.address = DEFAULT_METRICS_ADDRESS
+
+        if self.config.has_option('proxy', 'metrics_port'):
+            self.port = self.config.getint('proxy', 'metrics_port') or None
+
+        if self.config.has_option('proxy', 'metrics_address'):
+            self.address = self.config.get('proxy', 'metrics_address')
+
+        self.server = None
+        self.thread = None
+
+
+    # count a verdict of the rule processor
+    def verdict(self, accepted, rule):
+        key = ('allow' if accepted else 'deny', 'default' if rule is None else rule.section)
+        self.verdicts[key] = self.verdicts.get(key, 0) + 1
+
+
+    # add a function returning other metrics
+    def addCollector(self, collector):
+        self.collectors.append(collector)
+
+
+    # start the HTTP endpoint
+    def start(self):
+        if self.port is None:
+            return
+
+        port = self.port + (getattr(self.dummy, 'worker', None) or 0)
+        try:
+            self.server = BaseHTTPServer.HTTPServer((self.address, port), MetricsHandler)
+        except Exception as e:
+            self.logger.error("Unable to start the metrics endpoint on {0}:{1}: {2}", self.address, port, str(e))
+            self.server = None
+            return
+
+        self.server.metrics = self
+        self.thread = threading.Thread(target = self.server.serve_forever, name = "Metrics")
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.logger.info("Metrics available on http://{0}:{1}/metrics", self.address, port)
+
+
+    # stop the HTTP endpoint
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.thread = None
+
+
+    # return all the metrics in the text format
+    def render(self):
+        lines = list()
+
+        def add(name, kind, text, values):
+            name = PREFIX + name
+            lines.append('# HELP {0} {1}'.format(name, text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in values:
+                lines.append('{0}{1} {2}'.format(name, formatLabels(labels), value))
+
+        queries = self.queries
+        add('queries_total', 'counter', 'Queries received', [ ((('transport', 'udp'), ), queries - self.tcp), ((('transport', 'tcp'), ), self.tcp) ])
+        add('invalid_queries_total', 'counter', 'Queries that could not be decoded', [ ((), self.invalid) ])
+        add('limited_queries_total', 'counter', 'Queries refused as their client is over its rate limit', [ ((), self.limited) ])
+        add('shed_queries_total', 'counter', 'Queries failed as too many queries are waiting for the real DNS', [ ((), self.shed) ])
+        add('verdicts_total', 'counter', 'Decisions of the rule processor by rule section',
+            [ ((('verdict', v), ('section', s)), count) for (v, s), count in sorted(self.verdicts.items()) ])
+
+        for name, histogram, text in [ ('decode',   self.decode,   'Time to decode a query'),
+                                       ('rules',    self.rules,    'Time to evaluate the rules'),
+                                       ('upstream', self.upstream, 'Round trip to the real DNS'),
+                                       ('total',    self.total,    'Time between a query and its answer') ]:
+            name = '{0}{1}_seconds'.format(PREFIX, name)
+            lines.append('# HELP {0} {1}'.format(name, text))
+            lines.append('# TYPE {0} histogram'.format(name))
+            lines.extend(histogram.format(name))
+
+        for collector in self.collectors:
+            for name, kind, text, values in collector():
+                add(name, kind, text, values)
+
+        return '\n'.join(lines) + '\n'
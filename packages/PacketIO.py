@@ -0,0 +1,300 @@
+# @file     PacketIO.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Batched receive/send of the datagrams on the listening socket
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           On Linux, the datagrams are read with one recvmmsg call into preallocated
+#           buffers and the answers are flushed with one sendmmsg call (through ctypes).
+#           When these calls are not available, the socket is drained with a loop of
+#           non-blocking recvfrom and the answers are sent one by one with sendto.
+#           Only IPv4 addresses are handled, like the listening socket.
+
+# imports
+#----------
+import errno
+import socket
+import struct
+import ctypes
+import ctypes.util
+
+
+# globals
+#----------
+
+# default number of datagrams read/sent per system call
+DEFAULT_BATCH_SIZE = 32
+
+# size of a receive buffer (larger datagrams are dropped)
+SLOT_SIZE = 4096
+
+# flags (values for Linux)
+MSG_DONTWAIT = 0x40
+MSG_TRUNC    = 0x20
+
+# size of a struct sockaddr_in
+SOCKADDR_SIZE = 16
+
+# family field of a struct sockaddr_in, in the byte order of the host
+SOCKADDR_FAMILY = struct.pack('=H', socket.AF_INET)
+SOCKADDR_ZERO   = b'\x00' * 8
+
+
+# C structures
+#----------
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len',  ctypes.c_size_t),
+    ]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name',       ctypes.c_void_p),
+        ('msg_namelen',    ctypes.c_uint32),
+        ('msg_iov',        ctypes.POINTER(iovec)),
+        ('msg_iovlen',     ctypes.c_size_t),
+        ('msg_control',    ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags',      ctypes.c_int),
+    ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+# functions
+#----------
+
+# return (recvmmsg, sendmmsg) from the C library or None if they are not available
+def _loadMmsg():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+
+    recvmmsg.argtypes = [ ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p ]
+    recvmmsg.restype  = ctypes.c_int
+    sendmmsg.argtypes = [ ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int ]
+    sendmmsg.restype  = ctypes.c_int
+
+    return recvmmsg, sendmmsg
+
+MMSG = _loadMmsg()
+
+
+# class
+#----------
+
+# a set of preallocated messages for recvmmsg/sendmmsg
+class MessageVector:
+    # constructor
+    def __init__(self, count, slot_size):
+        self.count     = count
+        self.slot_size = slot_size
+
+        self.msgs  = (mmsghdr * count)()
+        self.iovs  = (iovec * count)()
+        self.names = ctypes.create_string_buffer(SOCKADDR_SIZE * count)
+        self.data  = ctypes.create_string_buffer(slot_size * count)
+
+        self.names_addr = ctypes.addressof(self.names)
+        self.data_addr  = ctypes.addressof(self.data)
+
+        for i in range(count):
+            self.iovs[i].iov_base = self.data_addr + i * slot_size
+            self.iovs[i].iov_len  = slot_size
+
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name    = self.names_addr + i * SOCKADDR_SIZE
+            hdr.msg_namelen = SOCKADDR_SIZE
+            hdr.msg_iov     = ctypes.pointer(self.iovs[i])
+            hdr.msg_iovlen  = 1
+
+
+class PacketIO:
+    # constructor
+    def __init__(self, dummy, sock):
+        self.dummy  = dummy
+        self.config = dummy.application.config
+        self.logger = dummy.logger
+
+        self.sock = sock
+        self.fd   = sock.fileno()
+        self.sock.setblocking(0)
+
+        # answers waiting to be sent
+        self.output = list()
+
+        # counters
+        self.received = 0
+        self.sent     = 0
+        self.reads    = 0
+        self.writes   = 0
+
+        # read the options
+        self.batch_size = DEFAULT_BATCH_SIZE
+        if self.config.has_option('proxy', 'batch_size'):
+            self.batch_size = max(1, self.config.getint('proxy', 'batch_size'))
+
+        # use the batched system calls when they are available
+        self.mode = 'loop'
+        if MMSG is not None:
+            self.recvmmsg, self.sendmmsg = MMSG
+            self.inputs  = MessageVector(self.batch_size, SLOT_SIZE)
+            self.outputs = MessageVector(self.batch_size, 0)
+            self.mode = 'mmsg'
+
+        self.logger.info("Packets will be read/sent by batches of {0} ({1})", self.batch_size, self.mode)
+
+
+    # switch to the loop of recvfrom/sendto
+    def __fallback(self, error):
+        self.logger.warning("Batched system calls are not available ({0}), switching to the loop mode", error)
+        self.mode = 'loop'
+
+
+    # return the statistics of the I/O
+    def stats(self):
+        return "received={0} in {1} reads, sent={2} in {3} writes".format(self.received, self.reads, self.sent, self.writes)
+
+
+    # read the datagrams available on the socket
+    # return a list of (data, addr)
+    def receive(self):
+        if self.mode == 'mmsg':
+            packets = self.__receiveMmsg()
+            if packets is not None:
+                return packets
+
+        return self.__receiveLoop()
+
+
+    def __receiveMmsg(self):
+        vector = self.inputs
+
+        count = self.recvmmsg(self.fd, vector.msgs, vector.count, MSG_DONTWAIT, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOSYS, errno.EOPNOTSUPP):
+                self.__fallback(errno.errorcode.get(error, error))
+                return None
+
+            if error not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self.logger.warning('Error when reading the listening socket: {0}', errno.errorcode.get(error, error))
+            return list()
+
+        self.reads += 1
+        self.received += count
+
+        packets = list()
+        for i in range(count):
+            hdr = vector.msgs[i].msg_hdr
+
+            # the kernel updates the length of the address: reset it for the next call
+            hdr.msg_namelen = SOCKADDR_SIZE
+
+            if hdr.msg_flags & MSG_TRUNC:
+                self.logger.warning('A datagram larger than {0} bytes has been dropped.', vector.slot_size)
+                continue
+
+            name = ctypes.string_at(vector.names_addr + i * SOCKADDR_SIZE, SOCKADDR_SIZE)
+            addr = (socket.inet_ntoa(name[4:8]), struct.unpack('>H', name[2:4])[0])
+            data = ctypes.string_at(vector.data_addr + i * vector.slot_size, vector.msgs[i].msg_len)
+
+            packets.append((data, addr))
+
+        return packets
+
+
+    def __receiveLoop(self):
+        packets = list()
+
+        while len(packets) < self.batch_size:
+            try:
+                packets.append(self.sock.recvfrom(SLOT_SIZE))
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    self.logger.warning('Error when reading the listening socket: {0}', str(e))
+                break
+
+        if packets:
+            self.reads += 1
+            self.received += len(packets)
+
+        return packets
+
+
+    # queue an answer for the next flush
+    def send(self, data, addr):
+        self.output.append((data, addr))
+
+
+    # send all the queued answers
+    def flush(self):
+        if not self.output:
+            return
+
+        output = self.output
+        self.output = list()
+
+        start = 0
+        if self.mode == 'mmsg':
+            while start < len(output):
+                sent = self.__sendMmsg(output[start:start + self.batch_size])
+                if sent is None:
+                    break
+                # the first answer of the batch has been refused: skip it only
+                if sent == 0:
+                    sent = 1
+                start += sent
+
+        for data, addr in output[start:]:
+            try:
+                self.sock.sendto(data, addr)
+                self.writes += 1
+                self.sent += 1
+            except socket.error as e:
+                self.logger.warning('Unable to send an answer to {0}: {1}', addr, str(e))
+
+
+    # send a batch of answers
+    # return the number of answers sent (0 if the first one failed), or None if the batched calls are not available
+    def __sendMmsg(self, batch):
+        vector = self.outputs
+
+        # keep a reference on the data until the call returns
+        buffers = list()
+        for i, (data, addr) in enumerate(batch):
+            name = SOCKADDR_FAMILY + struct.pack('>H', addr[1]) + socket.inet_aton(addr[0]) + SOCKADDR_ZERO
+            ctypes.memmove(vector.names_addr + i * SOCKADDR_SIZE, name, SOCKADDR_SIZE)
+
+            # the answers built by the proxy are bytearrays
+            buf = ctypes.c_char_p(bytes(data))
+            buffers.append(buf)
+
+            vector.iovs[i].iov_base = ctypes.cast(buf, ctypes.c_void_p).value
+            vector.iovs[i].iov_len  = len(data)
+
+        count = self.sendmmsg(self.fd, vector.msgs, len(batch), 0)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOSYS, errno.EOPNOTSUPP):
+                self.__fallback(errno.errorcode.get(error, error))
+                return None
+
+            # the call fails only when the first answer cannot be sent
+            self.logger.warning('Unable to send an answer to {0}: {1}', batch[0][1], errno.errorcode.get(error, error))
+            return 0
+
+        self.writes += 1
+        self.sent += count
+        return count
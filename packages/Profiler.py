@@ -0,0 +1,226 @@
+# @file     Profiler.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Profiling of the running proxy, started by a signal
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Sampling profiler: during profile_duration seconds, a timer (ITIMER_PROF,
+#           CPU time of the process) interrupts the main thread every few milliseconds
+#           and the stack of the interrupted frame is counted. At the end of the window
+#           two files are written next to the log:
+#               dnsProxy-profile-<pid>-<time>.txt     functions sorted by samples
+#               dnsProxy-profile-<pid>-<time>.folded  collapsed stacks (flamegraph.pl)
+#           The timer only runs during the window, so the profiler costs nothing when
+#           it is off.
+#           Memory: a first signal takes a snapshot of the memory, the second one writes
+#           the difference with the first snapshot (dnsProxy-memory-<pid>-<time>.txt).
+#           The allocations are traced with tracemalloc when the interpreter has it,
+#           otherwise the objects tracked by the garbage collector are counted by type.
+
+# imports
+#----------
+import os
+import gc
+import sys
+import time
+import signal
+import threading
+import collections
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# globals
+#----------
+
+# default duration of a profiling window (in seconds)
+DEFAULT_PROFILE_DURATION = 30.0
+
+# time between two samples (in seconds)
+SAMPLE_INTERVAL = 0.005
+
+# number of lines of the reports
+REPORT_LINES = 50
+
+
+# functions
+#----------
+
+# return the name of the function of a frame
+def frameName(frame):
+    code = frame.f_code
+    return "{0}:{1}".format(os.path.basename(code.co_filename), code.co_name)
+
+
+# return the objects tracked by the garbage collector: type -> (count, size)
+def countObjects():
+    counts = collections.defaultdict(lambda: [ 0, 0 ])
+    for obj in gc.get_objects():
+        item = counts[type(obj).__name__]
+        item[0] += 1
+        item[1] += sys.getsizeof(obj, 0)
+
+    return counts
+
+
+# class
+#----------
+class Profiler:
+    # constructor
+    def __init__(self, dummy):
+        self.dummy  = dummy
+        self.config = dummy.application.config
+        self.logger = dummy.logger
+
+        # collapsed stack -> number of samples
+        self.samples = None
+        self.started = None
+        self.timer   = None
+
+        # first memory snapshot
+        self.snapshot = None
+
+        # the reports are written next to the log
+        self.directory = os.path.dirname(os.path.abspath(self.config.get('proxy', 'log_file')))
+
+        self.duration = DEFAULT_PROFILE_DURATION
+        if self.config.has_option('proxy', 'profile_duration'):
+            self.duration = max(1.0, self.config.getfloat('proxy', 'profile_duration'))
+
+
+    # return the path of a report
+    def __path(self, kind, extension):
+        name = "dnsProxy-{0}-{1}-{2}{3}".format(kind, os.getpid(), time.strftime('%Y%m%d-%H%M%S'), extension)
+        return os.path.join(self.directory, name)
+
+
+    # start a profiling window, or stop the current one
+    # (called by the signal handler, in the main thread)
+    def toggle(self):
+        if self.samples is not None:
+            self.stop()
+            return
+
+        self.samples = collections.Counter()
+        self.started = time.time()
+
+        # the system calls interrupted by a sample are restarted
+        signal.signal(signal.SIGPROF, self.__sample)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+
+        # end of the window
+        self.timer = threading.Timer(self.duration, self.stop)
+        self.timer.daemon = True
+        self.timer.start()
+
+        self.logger.info("Profiling the proxy for {0}s...", self.duration)
+
+
+    # count the stack of the interrupted frame
+    def __sample(self, signum, frame):
+        samples = self.samples
+        if samples is None:
+            return
+
+        stack = list()
+        while frame is not None:
+            stack.append(frameName(frame))
+            frame = frame.f_back
+
+        stack.reverse()
+        samples[';'.join(stack)] += 1
+
+
+    # stop the profiling window and write the reports
+    # (called by the thread of the timer at the end of the window)
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        samples, self.samples = self.samples, None
+        if samples is None:
+            return
+
+        # (the handler of SIGPROF stays, doing nothing without the timer)
+        if threading.current_thread() is not self.timer:
+            self.timer.cancel()
+
+        elapsed = time.time() - self.started
+        total = sum(samples.values())
+
+        # samples where each function is running (own) or on the stack (total)
+        own = collections.Counter()
+        inclusive = collections.Counter()
+        for stack, count in samples.iteritems():
+            functions = stack.split(';')
+            own[functions[-1]] += count
+            for function in set(functions):
+                inclusive[function] += count
+
+        try:
+            path = self.__path('profile', '.folded')
+            with open(path, 'w') as fh:
+                for stack, count in samples.most_common():
+                    fh.write("{0} {1}\n".format(stack, count))
+
+            report = self.__path('profile', '.txt')
+            with open(report, 'w') as fh:
+                fh.write("{0} samples every {1}ms of CPU time in {2:.1f}s\n\n".format(total, SAMPLE_INTERVAL * 1000, elapsed))
+                fh.write("{0:>8} {1:>7} {2:>8} {3:>7}  function\n".format('own', '%', 'total', '%'))
+                for function, count in own.most_common(REPORT_LINES):
+                    fh.write("{0:>8} {1:>6.1f}% {2:>8} {3:>6.1f}%  {4}\n".format(
+                        count, 100.0 * count / max(1, total), inclusive[function], 100.0 * inclusive[function] / max(1, total), function))
+        except IOError as e:
+            self.logger.error("Unable to write the profile: {0}", str(e))
+            return
+
+        self.logger.info("Profile of {0} samples written to {1} and {2}", total, report, path)
+
+
+    # take a memory snapshot, or write the difference with the previous one
+    # (called by the signal handler)
+    def memory(self):
+        if self.snapshot is None:
+            if tracemalloc is not None:
+                tracemalloc.start()
+                self.snapshot = tracemalloc.take_snapshot()
+            else:
+                self.snapshot = countObjects()
+
+            self.logger.info("Memory snapshot taken, send the signal again to write the difference")
+            return
+
+        previous, self.snapshot = self.snapshot, None
+        lines = list()
+
+        if tracemalloc is not None:
+            current = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            for stat in current.compare_to(previous, 'lineno')[:REPORT_LINES]:
+                lines.append(str(stat))
+        else:
+            current = countObjects()
+            diff = list()
+            for name in set(current) | set(previous):
+                count, size = current.get(name, (0, 0))
+                before, before_size = previous.get(name, (0, 0))
+                diff.append((size - before_size, count - before, count, size, name))
+
+            lines.append("{0:>12} {1:>10} {2:>12} {3:>10}  type".format('size diff', 'count diff', 'size', 'count'))
+            for size_diff, count_diff, count, size, name in sorted(diff, reverse = True)[:REPORT_LINES]:
+                lines.append("{0:>+12} {1:>+10} {2:>12} {3:>10}  {4}".format(size_diff, count_diff, size, count, name))
+
+        try:
+            path = self.__path('memory', '.txt')
+            with open(path, 'w') as fh:
+                fh.write('\n'.join(lines) + '\n')
+        except IOError as e:
+            self.logger.error("Unable to write the memory report: {0}", str(e))
+            return
+
+        self.logger.info("Memory difference written to {0}", path)
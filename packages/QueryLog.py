@@ -0,0 +1,282 @@
+# @file     QueryLog.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Binary log of the queries and of their verdicts
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Each query is stored as a fixed-width record of 24 bytes, little-endian,
+#           aligned on 32 bits so that a segment can be read as an array of integers:
+#           time (s), client IP, hash of the domain, id of the rule, type of the query,
+#           verdict, flags, latency (us).
+#           The records of a day are appended to queries-YYYYMMDD.bin in the directory
+#           query_log_dir. The domains and the rules are interned: the first time a hash
+#           is used in a segment, its text is appended to queries-YYYYMMDD.names.
+#           The records are written by a thread, by batches, every second.
+#           tools/queryLog.py aggregates the segments.
+
+# imports
+#----------
+import os
+import time
+import zlib
+import socket
+import struct
+import threading
+import collections
+
+
+# globals
+#----------
+
+# time, client IP, domain hash, rule id, qtype, verdict, flags, latency
+RECORD = struct.Struct('<IIIIHBBI')
+
+# number of 32 bits words in a record and position of the fields
+RECORD_WORDS  = 6
+WORD_TIME     = 0
+WORD_CLIENT   = 1
+WORD_DOMAIN   = 2
+WORD_RULE     = 3
+WORD_TYPE     = 4               # qtype | verdict << 16 | flags << 24
+WORD_LATENCY  = 5
+BYTE_VERDICT  = 18
+
+# verdicts
+VERDICT_FORWARDED = 0           # accepted and answered by the real DNS
+VERDICT_CACHED    = 1           # accepted and answered from the cache
+VERDICT_DENIED    = 2           # denied by a rule or the default action
+VERDICT_LOST      = 3           # accepted but no answer from the real DNS
+VERDICT_STALE     = 4           # accepted and answered from an expired answer of the cache
+
+VERDICTS = [ 'forwarded', 'cached', 'denied', 'lost', 'stale' ]
+
+# flags
+FLAG_TCP = 0x01
+
+# kinds of the entries of the names table
+NAME_DOMAIN = 'D'
+NAME_RULE   = 'R'
+
+# maximum number of records waiting to be written
+QUERY_LOG_QUEUE_SIZE = 100000
+
+# time between two writes
+QUERY_LOG_FLUSH_INTERVAL = 1.0
+
+
+# functions
+#----------
+
+# return the hash of a domain or of a rule
+def nameHash(name):
+    return zlib.crc32(name) & 0xFFFFFFFF
+
+
+# return the IPv4 address as an integer (0 if it is not an IPv4 address)
+def ipToInt(ip):
+    try:
+        return struct.unpack('>I', socket.inet_aton(ip))[0]
+    except (socket.error, TypeError):
+        return 0
+
+
+# return the IPv4 address of an integer
+def intToIp(value):
+    return socket.inet_ntoa(struct.pack('>I', value))
+
+
+# return a name that cannot break a line of the names table
+def printable(name):
+    return name.replace('\t', ' ').replace('\n', ' ')
+
+
+# return the path of the segment (without extension) of a day (YYYYMMDD)
+def segmentPath(directory, day):
+    return os.path.join(directory, "queries-{0}".format(day))
+
+
+# read the names table of a segment: (kind, hash) -> text
+def readNames(path, names = None):
+    if names is None:
+        names = dict()
+
+    try:
+        with open(path) as fh:
+            for line in fh:
+                fields = line.rstrip('\n').split('\t', 2)
+                if len(fields) == 3:
+                    names[(fields[0], int(fields[1], 16))] = fields[2]
+    except IOError:
+        pass
+
+    return names
+
+
+# class
+#----------
+class QueryLog:
+    # constructor
+    def __init__(self, dummy):
+        self.dummy  = dummy
+        self.config = dummy.application.config
+        self.logger = dummy.logger
+
+        self.directory = None
+        if self.config.has_option('proxy', 'query_log_dir'):
+            self.directory = self.config.get('proxy', 'query_log_dir').strip() or None
+
+        # records waiting to be written: (time, record, domain hash, domain, rule)
+        self.queue   = collections.deque(maxlen = QUERY_LOG_QUEUE_SIZE)
+        self.dropped = 0
+
+        # current segment
+        self.day     = None
+        self.day_end = 0
+        self.fd      = None
+        self.names   = None
+        self.seen    = set()
+
+        self.thread  = None
+        self.running = False
+
+
+    # the log is enabled when a directory is given
+    def enabled(self):
+        return self.directory is not None
+
+
+    # start the thread writing the records
+    def start(self):
+        if not self.enabled():
+            return
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError as e:
+                self.logger.error("Unable to create the query log directory {0}: {1}", self.directory, str(e))
+                self.directory = None
+                return
+
+        self.logger.info("Queries will be logged in {0}", self.directory)
+
+        self.running = True
+        self.thread = threading.Thread(target = self.__run, name = "QueryLog")
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    # write the last records and stop the thread
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.flush()
+        self.__closeSegment()
+
+
+    # add a query to the log
+    def add(self, query, verdict, rule, latency, tcp = False):
+        if self.thread is None:
+            return
+
+        now = time.time()
+        domain = query.domain.lower()
+        domain_hash = nameHash(domain)
+        rule_id = 0 if rule is None else rule.id
+
+        record = RECORD.pack(int(now), ipToInt(query.ip), domain_hash, rule_id, query.qtype & 0xFFFF,
+                             verdict, FLAG_TCP if tcp else 0, int(latency * 1000000))
+
+        if len(self.queue) == QUERY_LOG_QUEUE_SIZE:
+            self.dropped = self.dropped + 1
+
+        self.queue.append((now, record, domain_hash, domain, rule))
+
+
+    # body of the thread
+    def __run(self):
+        while self.running:
+            time.sleep(QUERY_LOG_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except (IOError, OSError) as e:
+                self.logger.error("Unable to write the query log: {0}", str(e))
+
+
+    # close the current segment
+    def __closeSegment(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.names.close()
+
+        self.fd = None
+        self.names = None
+        self.day = None
+
+
+    # open the segment of the day of a record
+    def __openSegment(self, when):
+        self.__closeSegment()
+
+        local = time.localtime(when)
+        self.day = time.strftime('%Y%m%d', local)
+
+        # end of the day (local time)
+        self.day_end = time.mktime((local.tm_year, local.tm_mon, local.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+
+        path = segmentPath(self.directory, self.day)
+        self.fd = os.open(path + '.bin', os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.names = open(path + '.names', 'a')
+
+        # the names already written by another process or a previous run
+        self.seen = set(readNames(path + '.names').keys())
+
+
+    # write the records waiting in the queue, grouped by segment
+    def flush(self):
+        dropped = self.dropped
+        if dropped:
+            self.dropped = self.dropped - dropped
+            self.logger.warning("{0} queries have not been logged", dropped)
+
+        queue = self.queue
+        batch = list()
+        while queue:
+            try:
+                when, record, domain_hash, domain, rule = queue.popleft()
+            except IndexError:
+                break
+
+            # a new day begins
+            if (self.fd is None) or (when >= self.day_end):
+                self.__write(batch)
+                batch = list()
+                self.__openSegment(when)
+
+            if (NAME_DOMAIN, domain_hash) not in self.seen:
+                self.seen.add((NAME_DOMAIN, domain_hash))
+                self.names.write("{0}\t{1:08x}\t{2}\n".format(NAME_DOMAIN, domain_hash, printable(domain)))
+
+            if (rule is not None) and ((NAME_RULE, rule.id) not in self.seen):
+                self.seen.add((NAME_RULE, rule.id))
+                self.names.write("{0}\t{1:08x}\t{2}\n".format(NAME_RULE, rule.id, printable(str(rule))))
+
+            batch.append(record)
+
+        self.__write(batch)
+
+
+    # append a batch of records to the current segment
+    def __write(self, batch):
+        if not batch:
+            return
+
+        # the names are written first so that a record never refers to an unknown name
+        self.names.flush()
+        os.write(self.fd, ''.join(batch))
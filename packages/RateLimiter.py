@@ -0,0 +1,118 @@
+# @file     RateLimiter.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Limit the rate of the queries of each client
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Each client IP address has a token bucket: it holds at most client_burst
+#           tokens, refilled at client_rate tokens per second, and a query takes one
+#           token. A client without token is over its limit.
+#           The bucket of a client is a small list [ tokens, time of the last update,
+#           logged ] in a dictionary. The table is swept every few seconds: the buckets
+#           full again are removed, a new bucket being the same as a full one. When the
+#           table is full, the new clients are not limited until the next sweep.
+
+# imports
+#----------
+import time
+
+
+# globals
+#----------
+
+# default values when the options are not present in the configuration
+DEFAULT_CLIENT_RATE  = 0.0          # queries per second (0 to disable the limit)
+DEFAULT_CLIENT_BURST = 200          # queries
+
+# time between two sweeps of the table (in seconds)
+SWEEP_INTERVAL = 10.0
+
+# maximum number of clients in the table
+MAX_CLIENTS = 65536
+
+
+# functions
+#----------
+
+
+# class
+#----------
+class RateLimiter:
+    # constructor
+    def __init__(self, dummy):
+        self.dummy  = dummy
+        self.config = dummy.application.config
+        self.logger = dummy.logger
+
+        # client -> [ tokens, time of the last update, True when the client has been logged as over its limit ]
+        self.buckets = dict()
+        self.next_sweep = time.time() + SWEEP_INTERVAL
+
+        # number of queries over the limit
+        self.limited = 0
+
+        # read the options
+        self.rate  = DEFAULT_CLIENT_RATE
+        self.burst = DEFAULT_CLIENT_BURST
+
+        if self.config.has_option('proxy', 'client_rate'):
+            self.rate = max(0.0, self.config.getfloat('proxy', 'client_rate'))
+
+        if self.config.has_option('proxy', 'client_burst'):
+            self.burst = max(1, self.config.getint('proxy', 'client_burst'))
+
+        if self.enabled():
+            self.logger.info("Clients limited to {0} queries/s (burst of {1})", self.rate, self.burst)
+
+
+    # the limit can be disabled by setting the rate to 0
+    def enabled(self):
+        return self.rate > 0
+
+
+    # take a token from the bucket of a client
+    # return False if the client is over its limit
+    def allow(self, ip, now):
+        bucket = self.buckets.get(ip)
+        if bucket is None:
+            if len(self.buckets) < MAX_CLIENTS:
+                self.buckets[ip] = [ self.burst - 1, now, False ]
+            return True
+
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True
+
+        bucket[0] = tokens
+        self.limited = self.limited + 1
+
+        # log once per sweep for each client over its limit
+        if not bucket[2]:
+            bucket[2] = True
+            self.logger.warning("Client [{0}] is over its limit of {1} queries/s", ip, self.rate)
+
+        return False
+
+
+    # remove the buckets full again (called from time to time by the main loop)
+    def sweep(self, now):
+        refill = self.burst / self.rate
+        self.buckets = dict((ip, bucket) for ip, bucket in self.buckets.iteritems() if now - bucket[1] < refill)
+        for bucket in self.buckets.itervalues():
+            bucket[2] = False
+
+        self.next_sweep = now + SWEEP_INTERVAL
+
+
+    # return the counters of the limiter
+    def stats(self):
+        return {
+            'clients'   : len(self.buckets),
+            'limited'   : self.limited,
+        }
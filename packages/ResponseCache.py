@@ -0,0 +1,302 @@
+# @file     ResponseCache.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Cache the answers of the real DNS according to their TTL
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The answers are kept by question (domain, type, class and the DNSSEC bits DO
+#           and CD of the query, which change the records of the answer) until the minimum
+#           TTL of their records expires (or the SOA negative TTL for NXDOMAIN/NODATA).
+#           An answer is given with the question of the client, whose case can differ
+#           from the one of the first client (DNS 0x20).
+#           The least recently used answers are evicted when the cache is full.
+#           An answer asked at least cache_prefetch_hits times is refreshed from the real
+#           DNS before it expires (in the last cache_prefetch_ratio of its TTL), so that
+#           the popular names stay in the cache.
+#           An expired answer is kept cache_stale seconds more: it is given with a short
+#           TTL to the clients when the real DNS does not answer (serve-stale).
+#           After a restart, the answers of the last snapshot (CacheSnapshot) are moved
+#           to the cache the first time their question is asked.
+
+# imports
+#----------
+import time
+import struct
+import collections
+
+from DNSQuery import answerTTL
+from DNSQuery import FLAG_CD
+
+
+# globals
+#----------
+
+# default values when the options are not present in the configuration
+DEFAULT_CACHE_ENTRIES = 10000
+DEFAULT_CACHE_MEMORY  = 16          # in MB
+DEFAULT_CACHE_PREFETCH_HITS  = 3
+DEFAULT_CACHE_PREFETCH_RATIO = 0.1
+DEFAULT_CACHE_STALE   = 3600        # in seconds
+
+# TTL of the records of the expired answers given to the clients
+STALE_TTL = 30
+
+# estimated size of the structures around an answer
+ENTRY_OVERHEAD = 256
+
+
+# functions
+#----------
+
+# return the key of a query in the cache: (domain, type, class, DNSSEC bits)
+def cacheKey(query):
+    domain, qtype, qclass = query.question()
+    return (domain, qtype, qclass, (2 if query.dnssec() else 0) | (1 if query.flags & FLAG_CD else 0))
+
+
+# class
+#----------
+
+# an answer stored in the cache
+class CacheEntry:
+    # constructor
+    def __init__(self, data, offsets, ttl, now, prefetch_ratio = 0.0):
+        self.data    = data             # answer as received from the real DNS
+        self.offsets = offsets          # offsets of the TTL fields in the answer
+        self.stored  = now              # time when the answer has been stored
+        self.expires = now + ttl        # time when the answer has to be removed
+        self.refresh = now + ttl * (1.0 - prefetch_ratio)  # time after which a popular answer is refreshed
+        self.size    = len(data) + ENTRY_OVERHEAD
+        self.hits    = 0                # number of times the answer has been given
+        self.refreshing = False         # True when the answer is being refreshed
+
+
+class ResponseCache:
+    # constructor
+    def __init__(self, dummy):
+        self.dummy  = dummy
+        self.config = dummy.application.config
+        self.logger = dummy.logger
+
+        # answers sorted from the least to the most recently used
+        self.entries = collections.OrderedDict()
+        self.memory  = 0
+
+        # answers of the snapshot of the previous run not asked yet
+        self.snapshot = None
+
+        # counters
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.prefetches = 0
+        self.stales    = 0
+
+        # read the options
+        self.max_entries = DEFAULT_CACHE_ENTRIES
+        self.max_memory  = DEFAULT_CACHE_MEMORY * 1024 * 1024
+        self.prefetch_hits  = DEFAULT_CACHE_PREFETCH_HITS
+        self.prefetch_ratio = DEFAULT_CACHE_PREFETCH_RATIO
+        self.stale = DEFAULT_CACHE_STALE
+
+        if self.config.has_option('proxy', 'cache_entries'):
+            self.max_entries = self.config.getint('proxy', 'cache_entries')
+
+        if self.config.has_option('proxy', 'cache_memory'):
+            self.max_memory = self.config.getint('proxy', 'cache_memory') * 1024 * 1024
+
+        if self.config.has_option('proxy', 'cache_prefetch_hits'):
+            self.prefetch_hits = max(0, self.config.getint('proxy', 'cache_prefetch_hits'))
+
+        if self.config.has_option('proxy', 'cache_prefetch_ratio'):
+            self.prefetch_ratio = min(1.0, max(0.0, self.config.getfloat('proxy', 'cache_prefetch_ratio')))
+
+        if self.config.has_option('proxy', 'cache_stale'):
+            self.stale = max(0, self.config.getint('proxy', 'cache_stale'))
+
+        if self.enabled():
+            self.logger.info("Response cache set to {0} entries / {1} bytes", self.max_entries, self.max_memory)
+        else:
+            self.logger.info("Response cache is disabled")
+
+
+    # the cache can be disabled by setting its size to 0
+    def enabled(self):
+        return (self.max_entries > 0) and (self.max_memory > 0)
+
+
+    # look for the answer of a query
+    # return the answer with the request ID of the query (None if not found)
+    # and True when the answer is popular and has to be refreshed now
+    def get(self, query):
+        key = cacheKey(query)
+        now = time.time()
+        entry = self.entries.pop(key, None)
+        if (entry is None) and (self.snapshot is not None):
+            entry = self.__restore(key, now)
+
+        if entry is None:
+            self.misses = self.misses + 1
+            return None, False
+
+        # the answer has expired (it is kept a while to be given when the real DNS fails)
+        if entry.expires <= now:
+            if entry.expires + self.stale > now:
+                self.entries[key] = entry
+            else:
+                self.memory = self.memory - entry.size
+
+            self.misses = self.misses + 1
+            return None, False
+
+        # mark the answer as the most recently used
+        self.entries[key] = entry
+        self.hits = self.hits + 1
+        self.__evict()
+
+        # refresh the popular answers before they expire
+        entry.hits = entry.hits + 1
+        refresh = False
+        if (self.prefetch_hits > 0) and (entry.refresh <= now) and (entry.hits >= self.prefetch_hits) and not entry.refreshing:
+            entry.refreshing = True
+            self.prefetches = self.prefetches + 1
+            refresh = True
+
+        return self.__patch(entry, query, now - entry.stored), refresh
+
+
+    # return the answer of an entry with the request ID and the question of a query and the TTLs
+    # decreased by the time elapsed (or set to ttl when given)
+    def __patch(self, entry, query, elapsed, ttl = None):
+        data = bytearray(entry.data)
+        struct.pack_into('>H', data, 0, query.requestID)
+
+        # the same question with the case of the client
+        question = query.data[12:query.end]
+        if data[12:query.end] != question and data[12:query.end].lower() == question.lower():
+            data[12:query.end] = question
+
+        elapsed = int(elapsed)
+        if (elapsed > 0) or (ttl is not None):
+            for offset in entry.offsets:
+                if ttl is None:
+                    value = max(0, struct.unpack_from('>I', data, offset)[0] - elapsed)
+                else:
+                    value = ttl
+                struct.pack_into('>I', data, offset, value)
+
+        return str(data)
+
+
+    # return the expired answer of a query with a short TTL, None if there is none
+    # (given when the real DNS does not answer)
+    def getStale(self, query):
+        entry = self.entries.get(cacheKey(query))
+        if entry is None:
+            return None
+
+        now = time.time()
+        if not (entry.expires <= now < entry.expires + self.stale):
+            return None
+
+        return self.__patch(entry, query, 0, STALE_TTL)
+
+
+    # count an expired answer given to a client
+    def servedStale(self):
+        self.stales = self.stales + 1
+
+
+    # move the answer of a question from the snapshot to the cache
+    # return the entry (counted in the memory of the cache), None if not found
+    def __restore(self, key, now):
+        found = self.snapshot.pop(key, now)
+        if not self.snapshot.answers:
+            self.snapshot = None
+
+        if found is None:
+            return None
+
+        data, stored, expires = found
+        ttl, offsets = answerTTL(data)
+        entry = CacheEntry(data, offsets, expires - stored, stored, self.prefetch_ratio)
+        self.memory = self.memory + entry.size
+        return entry
+
+
+    # store the answer of the real DNS for a query
+    def put(self, query, response):
+        if not self.enabled():
+            return
+
+        key = cacheKey(query)
+
+        ttl, offsets = answerTTL(response)
+        if not ttl:
+            return
+
+        # replace the previous answer
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.memory = self.memory - previous.size
+
+        entry = CacheEntry(response, offsets, ttl, time.time(), self.prefetch_ratio)
+        self.entries[key] = entry
+        self.memory = self.memory + entry.size
+        self.__evict()
+
+
+    # evict the least recently used answers
+    def __evict(self):
+        while (len(self.entries) > self.max_entries) or (self.memory > self.max_memory):
+            key, evicted = self.entries.popitem(last = False)
+            self.memory = self.memory - evicted.size
+            self.evictions = self.evictions + 1
+
+
+    # use the answers of a snapshot (only the index of the snapshot is read)
+    def restore(self, snapshot):
+        if self.enabled() and snapshot.answers:
+            self.snapshot = snapshot
+        else:
+            snapshot.close()
+
+
+    # return the answers to save in a snapshot: (key, answer, time when stored, expiration time)
+    # the answers of the previous snapshot not asked yet are kept while there is room for them
+    def items(self):
+        now = time.time()
+        items = [ (key, entry.data, entry.stored, entry.expires) for key, entry in self.entries.iteritems() ]
+
+        if self.snapshot is not None:
+            room = self.max_entries - len(items)
+            if room > 0:
+                items = self.snapshot.items(now)[:room] + items
+
+        return items
+
+
+    # remove all the answers
+    def clear(self):
+        self.entries = collections.OrderedDict()
+        self.memory  = 0
+
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+
+    # return the counters of the cache
+    def stats(self):
+        return {
+            'entries'   : len(self.entries),
+            'memory'    : self.memory,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'evictions' : self.evictions,
+            'prefetches': self.prefetches,
+            'stale'     : self.stales,
+        }
@@ -9,11 +9,17 @@
 
 # imports
 #----------
+import os
 import re
 import time
+import bisect
 import threading
 
 from DNSRule import DNSRule
+from DNSRule import toMinutes
+from DomainList import DomainList
+from RuleTable import RuleTable
+from RuleSet import RuleSet
 
 
 # globals
@@ -22,15 +28,48 @@ from DNSRule import DNSRule
 RULE_MATCHED = True
 RULE_DO_NOT_MATCHED = False
 
-VALUES_IP = 0
-VALUES_DOMAIN = 1
-VALUES_TIME = 2
-VALUES_DAY = 3
+# values given to processRules
+VALUES_IP = 0           # ip address of the requester
+VALUES_DOMAIN = 1       # domain requested
+VALUES_TIME = 2         # time of the request in minutes since midnight
+VALUES_DAY = 3          # day of the week (0 = monday)
+
+# default size of the cache of the verdicts
+DEFAULT_VERDICT_CACHE = 10000
+
+# prefix of the key of the rules of a list of domains
+LIST_PREFIX = 'list:'
 
 
 # functions
 #----------
 
+# return the paths of the lists of domains of a section
+def listPaths(text):
+    return [ path.strip() for path in text.split(',') if path.strip() ]
+
+
+# return the size and the modification time of a list of domains
+def listStat(path):
+    try:
+        stat = os.stat(path)
+        return (path, stat.st_size, stat.st_mtime)
+    except OSError:
+        return (path, None, None)
+
+
+# return True if one of the rules of a section uses one of the aliases
+def usesAliases(options, aliases):
+    if not aliases:
+        return False
+
+    for name, text in options:
+        fields = text.split(';')
+        if (len(fields) == 4) and any(client.strip().lower() in aliases for client in fields[2].split(',')):
+            return True
+
+    return False
+
 
 # class
 #----------
@@ -40,40 +79,26 @@ class RuleProcessor:
         self.dummy  = dummy
         self.logger = dummy.logger
 
-        # lock
-        self.lock = threading.Lock()
+        # lock serializing the updates of the rule set
+        # (reentrant as the updates are triggered by signal handlers)
+        self.lock = threading.RLock()
 
-        # dictionary to contain rules
-        self.rules = dict()
-        self.count = 0
+        # current rule set (replaced as a whole, never modified)
+        self.ruleset = RuleSet()
 
-        # current rule matched
-        self.current = None
+        # cache of the verdicts
+        self.verdict_cache = DEFAULT_VERDICT_CACHE
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
 
-        # default action
-        self.default_action = None
-
-        # process rules trigger
-        self.process_rule = True
-        self.enable_time  = None
-        self.disable_time = None
-
-
-    # switch the process rules
 
     # reset the rules
     def reset(self):
         # acquire the lock before resetting things
         self.lock.acquire()
 
-        self.rules = dict()
-        self.count = 0
-        self.default_action = None
-        self.current = None
-
-        self.process_rule = True
-        self.enable_time  = None
-        self.disable_time = None
+        self.ruleset = RuleSet()
 
         # release the lock
         self.lock.release()
@@ -81,15 +106,24 @@ class RuleProcessor:
 
     # switch the mode
     def switchMode(self):
-        self.logger.warning('Switching rule processor from {0} to {1}'.format(self.process_rule, not(self.process_rule)))
-        self.process_rule = not self.process_rule
+        self.lock.acquire()
+
+        ruleset = self.ruleset
+        self.logger.warning('Switching rule processor from {0} to {1}', ruleset.process_rule, not(ruleset.process_rule))
+        self.ruleset = ruleset.switched()
+
+        self.lock.release()
+
 
     # load the rules
+    # only the domains of the sections added, removed or modified since the last load
+    # are built again, the other ones are shared with the current rule set
     def loadRules(self):
-        # acquire the lock
-        self.lock.acquire()
-
         config = self.dummy.application.config
+        current = self.ruleset
+
+        # the new rule set is built aside and published at the end
+        ruleset = current.derived()
 
         # read the aliases
         aliases = dict()
@@ -98,6 +132,16 @@ class RuleProcessor:
                 value = config.get("aliases", alias)
                 aliases[alias.lower()] = value
 
+        # the rules using a modified alias have to be built again
+        modified = set(alias for alias in set(aliases) | set(current.aliases) if aliases.get(alias) != current.aliases.get(alias))
+        ruleset.aliases = aliases
+
+        ruleset.sections = dict()
+        owners = dict()         # domain -> sections of the domain
+        order = dict()          # domain -> position of its first section
+        affected = set()        # domains to build again
+        added = changed = 0
+
         # read all the section
         for section in config.sections():
 
@@ -108,135 +152,300 @@ class RuleProcessor:
             # specific case for generic section
             if section.lower() == "generic":
                 domain = "generic"
+            elif config.has_option(section, "domain"):
+                domain = config.get(section, "domain")
+            elif config.has_option(section, "list"):
+                domain = LIST_PREFIX + ','.join(listPaths(config.get(section, "list")))
             else:
                 # ignore section badly configured
-                if config.has_option(section, "domain") == False:
-                    self.logger.warning("Section [{0}] has no domain defined !".format(section))
-                    continue
-                else:
-                    domain = config.get(section, "domain")
+                self.logger.warning("Section [{0}] has no domain defined !", section)
+                continue
 
-            # add the domain to the rules list
-            if domain not in self.rules:
-                self.rules[domain] = list()
+            # keep the rules of the sections not modified
+            # (the size and the date of the lists tell if they have been modified)
+            options = tuple(config.items(section))
+            signature = options
+            if domain.startswith(LIST_PREFIX):
+                signature = options + tuple(listStat(path) for path in listPaths(domain[len(LIST_PREFIX):]))
 
-            # read the rules for this domain
-            for rule in config.options(section):
+            previous = current.sections.get(section)
+            if (previous is not None) and (previous[1] == signature) and not usesAliases(options, modified):
+                entry = previous
+            else:
+                entry = (domain, signature, self.__readRules(section, domain, options, aliases))
+                affected.add(domain)
+                if previous is None:
+                    added = added + 1
+                else:
+                    changed = changed + 1
+                    affected.add(previous[0])
+
+            ruleset.sections[section] = entry
+            owners.setdefault(domain, list()).append(section)
+            order.setdefault(domain, len(order))
+
+        # domains of the sections removed
+        removed = [ section for section in current.sections if section not in ruleset.sections ]
+        for section in removed:
+            affected.add(current.sections[section][0])
+
+        # domains whose sections have moved
+        ruleset.owners = dict()
+        for domain, sections in owners.iteritems():
+            sections = tuple(sections)
+            ruleset.owners[domain] = sections
+            if current.owners.get(domain) != sections:
+                affected.add(domain)
+
+        # build the rules of the domains again
+        for domain in affected:
+            if domain in ruleset.rules:
+                ruleset.count = ruleset.count - len(ruleset.rules[domain])
+                ruleset.addBounds(ruleset.rules[domain], -1)
+                del ruleset.rules[domain]
+                del ruleset.tables[domain]
+
+            if domain in ruleset.matcher.patterns:
+                ruleset.matcher.remove(domain)
+
+            if domain not in ruleset.owners:
+                continue
 
-                # ignore domain
-                if rule == "domain":
+            # index the domain pattern or the list of domains
+            if domain.startswith(LIST_PREFIX):
+                domains = DomainList(listPaths(domain[len(LIST_PREFIX):]))
+                try:
+                    start = time.time()
+                    domains.load(self.logger)
+                except IOError as e:
+                    self.logger.error("Section [{0}] has a list that cannot be read: {1}", ruleset.owners[domain][0], str(e))
                     continue
 
-                # create a rule object
-                text = config.get(section, rule)
+                self.logger.info("{0} domains read from {1} in {2:.2f}s", len(domains), domain[len(LIST_PREFIX):], time.time() - start)
+                ruleset.matcher.addList(domains, domain)
+
+            elif domain != "generic":
                 try:
-                    obj = DNSRule( text, section, aliases )
-                    self.rules[domain].append(obj)
+                    ruleset.matcher.add(domain, domain)
+                except re.error:
+                    self.logger.error("Section [{0}] has an invalid domain '{1}' !", ruleset.owners[domain][0], domain)
+                    continue
+
+            # rules of all the sections of the domain and their decision table
+            rules = [ rule for section in ruleset.owners[domain] for rule in ruleset.sections[section][2] ]
+            ruleset.rules[domain] = rules
+            ruleset.tables[domain] = RuleTable(rules)
+            ruleset.count = ruleset.count + len(rules)
+            ruleset.addBounds(rules, 1)
 
-                    # rule counter
-                    self.count = self.count + 1
-                except:
-                    self.logger.error("An error occured when parsing the rule '{0}' for domain '{1}'.".format(text, domain))
-                    self.logger.error("Rule has been skipped.")
+        # the domains are matched in the order of the configuration
+        ruleset.matcher.reorder(order)
+        ruleset.matcher.compile()
+
+        if current.sections:
+            self.logger.info("Rules reloaded: {0} sections added, {1} modified, {2} removed, {3} domains rebuilt.",
+                             added, changed, len(removed), len(affected))
 
         # print a line in the logs
-        self.logger.info("{0} rules loaded.".format(self.count))
+        self.logger.info("{0} rules loaded.", ruleset.count)
 
         # load the default action
-        self.default_action = config.get("proxy", "default_action")
+        ruleset.default_action = config.get("proxy", "default_action")
 
         # load the processor other variables
         if config.has_option('proxy', 'process_rule'):
-            self.process_rule = config.getboolean('proxy', 'process_rule')
+            ruleset.process_rule = config.getboolean('proxy', 'process_rule')
         else:
-            self.process_rule = True
+            ruleset.process_rule = True
 
         # enable / disable processor time
-        if config.has_option('proxy', 'enable_processor_time'):
-            self.enable_time = config.get('proxy', 'enable_processor_time').replace(':','')
-            self.logger.info("Enable time set to {0}".format(self.enable_time))
-        else:
-            self.enable_time = None
+        ruleset.enable_time = self.__readTime(config, 'enable_processor_time')
+        if ruleset.enable_time is not None:
+            self.logger.info("Enable time set to {0}", config.get('proxy', 'enable_processor_time'))
 
-        if config.has_option('proxy', 'disable_processor_time'):
-            self.disable_time = config.get('proxy', 'disable_processor_time').replace(':','')
-            self.logger.info("Disable time set to {0}".format(self.disable_time))
-        else:
-            self.disable_time = None
+        ruleset.disable_time = self.__readTime(config, 'disable_processor_time')
+        if ruleset.disable_time is not None:
+            self.logger.info("Disable time set to {0}", config.get('proxy', 'disable_processor_time'))
 
         # avoid discrepancy in the enable / disable
-        if (self.enable_time == None) or (self.disable_time == None):
-            self.enable_time  = None
-            self.disable_time = None
+        if (ruleset.enable_time == None) or (ruleset.disable_time == None):
+            ruleset.enable_time  = None
+            ruleset.disable_time = None
+
+        # size of the cache of the verdicts (0 to disable it)
+        if config.has_option('proxy', 'verdict_cache'):
+            self.verdict_cache = max(0, config.getint('proxy', 'verdict_cache'))
+        else:
+            self.verdict_cache = DEFAULT_VERDICT_CACHE
 
+        ruleset.fingerprint = ruleset.computeFingerprint()
 
-        # release the lock
+        # publish the new rule set
+        self.lock.acquire()
+        self.ruleset = ruleset
         self.lock.release()
 
 
+    # return the counters of the cache of the verdicts
+    def stats(self):
+        return {
+            'entries'   : len(self.ruleset.verdicts),
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'evictions' : self.evictions,
+        }
+
+
+    # return the fingerprint of the rules and the verdicts of the cache, least recently used first:
+    # ((ip, domain, day, time bucket), id of the matching rule or 0 for the default action)
+    def verdicts(self):
+        ruleset = self.ruleset
+        return ruleset.fingerprint, [ (key, 0 if cached[0] is None else cached[0].id) for key, cached in ruleset.verdicts.iteritems() ]
+
+
+    # put back the verdicts saved with the same rules (see verdicts)
+    # return the number of verdicts restored
+    def restoreVerdicts(self, fingerprint, verdicts):
+        ruleset = self.ruleset
+        if (not self.verdict_cache) or (fingerprint != ruleset.fingerprint):
+            return 0
+
+        # the rules by identifier (the identifiers shared by several rules are ignored)
+        rules = dict()
+        for domain_rules in ruleset.rules.itervalues():
+            for rule in domain_rules:
+                rules[rule.id] = rule if rule.id not in rules else None
+
+        count = 0
+        for key, rule_id in verdicts[-self.verdict_cache:]:
+            rule = rules.get(rule_id) if rule_id else None
+            if rule_id and (rule is None):
+                continue
+
+            ruleset.verdicts[key] = (rule, )
+            count = count + 1
+
+        return count
+
+
+    # read a time option of the processor (None if it is not present or not valid)
+    def __readTime(self, config, option):
+        if not config.has_option('proxy', option):
+            return None
+
+        text = config.get('proxy', option)
+        try:
+            return toMinutes(text.replace(':', ''))
+        except ValueError:
+            self.logger.error("Invalid time '{0}' for the option '{1}'.", text, option)
+            self.logger.error("Option has been ignored.")
+            return None
+
+
+    # create the rules of a section
+    def __readRules(self, section, domain, options, aliases):
+        rules = list()
+        for rule, text in options:
+
+            # ignore domain
+            if rule in ("domain", "list"):
+                continue
+
+            # create a rule object
+            try:
+                rules.append(DNSRule( text, section, aliases, rule ))
+            except:
+                self.logger.error("An error occured when parsing the rule '{0}' for domain '{1}'.", text, domain)
+                self.logger.error("Rule has been skipped.")
+
+        return rules
+
+
     # process the rules against a set of parameters
+    # return True if the request is accepted and the rule that has matched (None for the default action)
     def processRules(self, values):
-        # acquire the lock
-        self.lock.acquire()
+        # use the same rule set for the whole request
+        ruleset = self.ruleset
 
         # check if we need to proceed
-        if self.process_rule == False:
+        if ruleset.process_rule == False:
             self.logger.debug('Rule Processor is disabled. Request accepted.')
-            self.lock.release()
-            return True
+            return True, None
 
         # check the time
-        if self.enable_time:
-            if not ((values[VALUES_TIME] > self.enable_time) and (values[VALUES_TIME] < self.disable_time)):
+        if ruleset.enable_time is not None:
+            if not ((values[VALUES_TIME] > ruleset.enable_time) and (values[VALUES_TIME] < ruleset.disable_time)):
                 self.logger.debug('Time outside check boundaries. Request accepted.')
-                self.lock.release()
-                return True
+                return True, None
 
 
-        self.logger.debug("Values = {0}".format(values))
+        self.logger.debug("Values = {0}", values)
 
-        # reset the current matching rule
-        self.current = None
+        ip, day, minute = values[VALUES_IP], values[VALUES_DAY], values[VALUES_TIME]
+
+        # the same rules apply between two bounds of the rules
+        verdicts = ruleset.verdicts
+        if self.verdict_cache:
+            key = (ip, values[VALUES_DOMAIN].lower(), day, bisect.bisect_right(ruleset.bounds, minute))
+            cached = verdicts.pop(key, None)
+            if cached is not None:
+                verdicts[key] = cached
+                self.hits = self.hits + 1
+                self.logger.debug("Verdict found in the cache")
+                return self.__decide(ruleset, cached[0]), cached[0]
+
+            self.misses = self.misses + 1
+
+        # current matching rule
+        current = None
 
         # process the generic rules first
         self.logger.debug("Testing generic rules")
-        for rule in self.rules['generic']:
-            self.logger.debug("Processing rule '{0}'".format(rule))
-            result = self.__processRule(rule, values)
-            if result == RULE_MATCHED:
-                self.logger.debug("Rule matched")
-                self.current = rule
-            else:
-                self.logger.debug("Rule did not matched")
+        if 'generic' in ruleset.tables:
+            for rule in ruleset.tables['generic'].lookup(ip, day, minute):
+                self.logger.debug("Processing rule '{0}'", rule)
+                result = self.__processRule(rule, current)
+                if result == RULE_MATCHED:
+                    self.logger.debug("Rule matched")
+                    current = rule
+                else:
+                    self.logger.debug("Rule did not matched")
 
         # process the specific rules
         self.logger.debug("Testing specific rules")
-        for domain in self.rules.keys():
-            if domain == "generic":
-                continue
+        for domain in ruleset.matcher.match(values[VALUES_DOMAIN]):
+            self.logger.debug("Requested domain '{0}' match '{1}'", values[VALUES_DOMAIN], domain)
+
+            for rule in ruleset.tables[domain].lookup(ip, day, minute):
+                self.logger.debug("Processing rule '{0}'", rule)
+                result = self.__processRule(rule, current)
+                if result == RULE_MATCHED:
+                    self.logger.debug("Rule matched")
+                    current = rule
+                else:
+                    self.logger.debug("Rule did not matched")
+
+        # remember the verdict
+        if self.verdict_cache:
+            verdicts[key] = (current, )
+            if len(verdicts) > self.verdict_cache:
+                verdicts.popitem(last = False)
+                self.evictions = self.evictions + 1
 
-            # check if the domain match
-            if re.search(domain, values[VALUES_DOMAIN]):
-                self.logger.debug("Requested domain '{0}' match '{1}'".format(values[VALUES_DOMAIN], domain))
+        return self.__decide(ruleset, current), current
 
-                for rule in self.rules[domain]:
-                    self.logger.debug("Processing rule '{0}'".format(rule))
-                    result = self.__processRule(rule, values)
-                    if result == RULE_MATCHED:
-                        self.logger.debug("Rule matched")
-                        self.current = rule
-                    else:
-                        self.logger.debug("Rule did not matched")
 
+    # return True if the request is accepted by the matching rule (None for the default action)
+    def __decide(self, ruleset, current):
         # action to be taken
         result = None
 
         # nothing has matched
-        if self.current is None:
+        if current is None:
             self.logger.warning("No rule has been found for this set of parameters.")
-            action = self.default_action
+            action = ruleset.default_action
 
-            if self.default_action == "deny":
+            if ruleset.default_action == "deny":
                 self.logger.warning("Domain has been denied by default action.")
                 result = False
             else:
@@ -244,72 +453,37 @@ class RuleProcessor:
                 result = True
         else:
             # action taken
-            if self.current.action == 'allow':
-                self.logger.debug("Domain has been accepted by rule {0}.".format(self.current))
+            if current.action == 'allow':
+                self.logger.debug("Domain has been accepted by rule {0}.", current)
                 result = True
             else:
-                self.logger.warning("Domain has been denied by rule {0}.".format(self.current))
+                self.logger.warning("Domain has been denied by rule {0}.", current)
                 result = False
 
-        # release the lock
-        self.lock.release()
         return result
 
 
-    # check one rule at a time
-    # values[0] = ip address of the requester
-    # values[1] = domain requested
-    # values[2] = time of the request
-    # values[3] = current day of the week
+    # check if a rule active for the request replaces the current matching rule
+    # the rule is discarded when its time window is less specific than the current one
     #
-    def __processRule(self, rule, values):
-        if (rule.day != '*') and (rule.day != values[VALUES_DAY]):
-            return RULE_DO_NOT_MATCHED
-
-        # check the ip
-        if (rule.ip != '*') and (rule.ip != values[VALUES_IP]):
-            return RULE_DO_NOT_MATCHED
-
-        # start and stop are wildcards
-        if (rule.start == '*') and (rule.stop == '*'):
-            pass   # nothing to be done
+    def __processRule(self, rule, current):
+        if current is None:
+            return RULE_MATCHED
 
         # start is a wildcard
         if (rule.start == '*') and (rule.stop != '*'):
-            if values[VALUES_TIME] > rules.stop:
+            if (current.stop != '*') and (rule.end > current.end):
                 return RULE_DO_NOT_MATCHED
 
-            if self.current:
-                if (self.current.stop != '*') and (rules.stop > self.current.stop):
-                    return RULE_DO_NOT_MATCHED
-
         # start & stop are not wildcard
         if (rule.start != '*') and (rule.stop != '*'):
-            if (values[VALUES_TIME] < rule.start) or (values[VALUES_TIME] > rule.stop):
+            if (rule.begin < current.begin) and (rule.end > current.end):
                 return RULE_DO_NOT_MATCHED
 
-            if self.current:
-                if self.current.start != '*':
-                    start = self.current.start
-                else:
-                    start = "0000"
-
-                if self.current.stop != '*':
-                    stop = self.current.stop
-                else:
-                    stop = "2359"
-
-                if (rule.start < start) and (rule.stop > stop):
-                    return RULE_DO_NOT_MATCHED
-
         # stop is a wildcard
         if (rule.start != '*') and (rule.stop == '*'):
-            if values[VALUES_TIME] < rule.start:
+            if (current.start != '*') and (rule.begin < current.begin):
                 return RULE_DO_NOT_MATCHED
 
-            if self.current:
-                if (self.current.start != '*') and (rule.start < self.current.start):
-                    return RULE_DO_NOT_MATCHED
-
         # if we passed all the test, the rule has matched
         return RULE_MATCHED
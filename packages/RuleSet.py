@@ -0,0 +1,113 @@
+# @file     RuleSet.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Snapshot of the state of the rule processor
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           A rule set is built completely before being published by the rule processor
+#           with a single reference assignment, and is never modified afterwards.
+#           Readers take a reference to the current rule set once per request and do
+#           not need any lock.
+#           A reload starts from a copy of the current rule set (derived) where only the
+#           domains of the sections added, removed or modified are built again.
+#           The verdicts memoized by the rule processor belong to the rule set: a new
+#           rule set (reload, switch of mode) starts with an empty cache. The verdicts
+#           are kept by time bucket, the minutes between two bounds of the rules.
+#           The fingerprint of the rule set tells if the verdicts of a snapshot of the
+#           cache have been taken with the same rules.
+
+# imports
+#----------
+import zlib
+import copy
+import collections
+
+from DNSRule import LAST_MINUTE
+from DomainMatcher import DomainMatcher
+
+
+# class
+#----------
+class RuleSet:
+    # constructor
+    def __init__(self):
+        # dictionary to contain rules
+        self.rules = dict()
+        self.count = 0
+
+        # section -> (domain, options of the section and state of its lists, rules of the section)
+        self.sections = dict()
+
+        # domain -> sections of the domain in the order of the configuration
+        self.owners = dict()
+
+        # aliases used to build the rules
+        self.aliases = dict()
+
+        # index of the domains
+        self.matcher = DomainMatcher()
+
+        # decision tables of the domains
+        self.tables = dict()
+
+        # minute -> number of rules starting or ending at this minute, and the sorted minutes
+        self.boundaries = dict()
+        self.bounds = ()
+
+        # (ip, domain, day, time bucket) -> (matching rule, ), least recently used first
+        self.verdicts = collections.OrderedDict()
+        self.fingerprint = 0
+
+        # default action
+        self.default_action = None
+
+        # process rules trigger
+        self.process_rule = True
+        self.enable_time  = None
+        self.disable_time = None
+
+
+    # return a copy of the rule set with the process rules trigger switched
+    # the rules and the tables are shared with this rule set
+    def switched(self):
+        ruleset = copy.copy(self)
+        ruleset.process_rule = not self.process_rule
+        ruleset.verdicts = collections.OrderedDict()
+        return ruleset
+
+
+    # return a copy of the rule set that can be modified without changing this one
+    # (the rules and the tables are shared until they are replaced)
+    def derived(self):
+        ruleset = copy.copy(self)
+        ruleset.rules    = dict(self.rules)
+        ruleset.tables   = dict(self.tables)
+        ruleset.sections = dict(self.sections)
+        ruleset.owners   = dict(self.owners)
+        ruleset.matcher  = self.matcher.copy()
+        ruleset.boundaries = dict(self.boundaries)
+        ruleset.verdicts = collections.OrderedDict()
+        return ruleset
+
+
+    # return the fingerprint of the sections and of the aliases of the rule set
+    def computeFingerprint(self):
+        sections = sorted((section, domain, signature) for section, (domain, signature, rules) in self.sections.iteritems())
+        return zlib.crc32(repr((sections, sorted(self.aliases.items())))) & 0xFFFFFFFF
+
+
+    # add (count = 1) or remove (count = -1) the time bounds of rules
+    def addBounds(self, rules, count):
+        for rule in rules:
+            for minute in (rule.begin, rule.end + 1):
+                if 0 < minute <= LAST_MINUTE:
+                    total = self.boundaries.get(minute, 0) + count
+                    if total > 0:
+                        self.boundaries[minute] = total
+                    else:
+                        self.boundaries.pop(minute, None)
+
+        self.bounds = tuple(sorted(self.boundaries))
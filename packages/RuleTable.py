@@ -0,0 +1,135 @@
+# @file     RuleTable.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Decision table of the rules of one domain
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The rules of a domain are compiled when they are loaded into one table per
+#           IP address (plus one table for the other addresses) and per day of the week.
+#           Each day is cut into the time segments where the same rules are active, so
+#           finding the rules matching a request is two dict/tuple indexes and a bisect.
+#           The rules given for networks of clients are kept in a radix tree: the table
+#           of a network holds the rules of all the networks containing it, so the table
+#           of the most specific network of a client is enough. The tables of the single
+#           addresses are also indexed by address, found without walking the tree.
+
+# imports
+#----------
+import bisect
+
+from DNSRule import DAYS
+from DNSRule import LAST_MINUTE
+from AddressTree import ADDRESS_BITS
+from AddressTree import AddressTree
+from AddressTree import clientAddress
+
+
+# globals
+#----------
+
+# day table used when no rule is active
+EMPTY_DAY = ((), ((),))
+
+
+# functions
+#----------
+
+# return the text of an address
+def intToAddress(address):
+    return '.'.join(str((address >> shift) & 0xFF) for shift in (24, 16, 8, 0))
+
+
+# class
+#----------
+class RuleTable:
+    # constructor
+    def __init__(self, rules):
+        # values shared between the days and the clients
+        shared = dict()
+        compiled = dict()
+
+        # rules applying to any client
+        wildcard = [ rule for rule in rules if rule.ip == '*' ]
+        self.default = self.__compile(wildcard, shared)
+
+        # rules applying to a client given by its name, merged with the wildcard rules
+        self.buckets = dict()
+        for name in set(name for rule in rules for name in rule.names):
+            selected = [ rule for rule in rules if (rule.ip == '*') or (name in rule.names) ]
+            self.buckets[name] = self.__compile(selected, shared)
+
+        # rules of each network
+        networks = dict()
+        for rule in rules:
+            for network in rule.networks:
+                networks.setdefault(network, set()).add(rule)
+
+        # the networks are added from the largest ones, the rules of a network are
+        # merged with the rules of the most specific network containing it
+        # (no tree when all the networks are single addresses, found by address)
+        self.tree = None
+        if any(length < ADDRESS_BITS for address, length in networks):
+            self.tree = AddressTree()
+
+        for address, length in sorted(networks, key = lambda network: network[1]):
+            parent = None if self.tree is None else self.tree.lookup(address)
+            selected = set(parent[0] if parent is not None else wildcard) | networks[(address, length)]
+            selected = tuple(rule for rule in rules if rule in selected)
+
+            if selected not in compiled:
+                compiled[selected] = self.__compile(selected, shared)
+
+            if self.tree is not None:
+                self.tree.insert(address, length, (selected, compiled[selected]))
+            if length == ADDRESS_BITS:
+                self.buckets.setdefault(intToAddress(address), compiled[selected])
+
+
+    # return the rules active for a client at a given day / minute
+    # the rules are returned in the order of the configuration
+    def lookup(self, ip, day, minute):
+        table = self.buckets.get(ip)
+        if table is None:
+            table = self.default
+            if self.tree is not None:
+                address = clientAddress(ip)
+                found = None if address is None else self.tree.lookup(address)
+                if found is not None:
+                    table = found[1]
+
+        bounds, segments = table[day]
+        return segments[bisect.bisect_right(bounds, minute)]
+
+
+    # compile a list of rules into a table for each day of the week
+    def __compile(self, rules, shared):
+        days = list()
+
+        for day in range(len(DAYS)):
+            selected = [ rule for rule in rules if rule.days & (1 << day) ]
+            if not selected:
+                days.append(EMPTY_DAY)
+                continue
+
+            # minutes where the list of active rules changes
+            bounds = set()
+            for rule in selected:
+                if rule.begin > 0:
+                    bounds.add(rule.begin)
+                if rule.end < LAST_MINUTE:
+                    bounds.add(rule.end + 1)
+            bounds = tuple(sorted(bounds))
+
+            # rules active in each segment [bounds[i - 1], bounds[i])
+            segments = list()
+            for start in (0,) + bounds:
+                active = tuple(rule for rule in selected if rule.begin <= start <= rule.end)
+                segments.append(shared.setdefault(active, active))
+
+            value = (bounds, tuple(segments))
+            days.append(shared.setdefault(value, value))
+
+        return tuple(days)
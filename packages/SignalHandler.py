@@ -36,8 +36,7 @@ class SignalHandler:
         self.application.config = None
         self.application.readConfig( self.dummy.config_path )
 
-        # reload the rules
-        self.dummy.dns_processor.reset()
+        # reload the rules: the new rule set replaces the current one once built
         self.dummy.dns_processor.loadRules()
 
     # change the process rule
@@ -45,6 +44,16 @@ class SignalHandler:
         self.logger.info('USR2: switching rule processor mode...')
         self.dummy.dns_processor.switchMode()
 
+    # start / stop a profiling window
+    def TTIN(self, signum, stack):
+        self.logger.info('TTIN: toggling the profiler...')
+        self.dummy.profiler.toggle()
+
+    # take a memory snapshot / write the difference with the previous one
+    def TTOU(self, signum, stack):
+        self.logger.info('TTOU: memory snapshot...')
+        self.dummy.profiler.memory()
+
     # stop the proxy gracefully
     def TERM(self, signum, stack):
         self.logger.info('TERM: stopping the proxy...')
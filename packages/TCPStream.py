@@ -0,0 +1,144 @@
+# @file     TCPStream.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Non-blocking TCP connection carrying DNS messages
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Each DNS message is preceded by its length on 2 bytes (RFC 1035 4.2.2).
+#           Several messages can be sent without waiting for the answers (pipelining)
+#           and the answers can come back in any order (RFC 7766).
+#           The messages that cannot be sent at once are kept in an output buffer
+#           until the socket is writable again.
+#           Both buffers are bounded: at most READ_SIZE bytes are read at once (the
+#           input buffer holds at most one incomplete message more), and a peer not
+#           reading its data is considered as closed once MAX_OUTPUT bytes are waiting
+#           for it. A closed stream has to be closed by its owner.
+
+# imports
+#----------
+import errno
+import socket
+import struct
+
+
+# globals
+#----------
+
+# size read from the socket at once
+READ_SIZE = 65536
+
+# length prefix of a message
+LENGTH = struct.Struct('>H')
+
+# maximum size of the output buffer (a few answers of the largest size)
+MAX_OUTPUT = 4 * (65535 + LENGTH.size)
+
+# errors meaning that the operation has to be retried later
+RETRY_ERRORS = ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.EINPROGRESS, errno.ENOTCONN )
+
+
+# functions
+#----------
+
+# open a connection to a server without waiting for the handshake
+def openStream(addr):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setblocking(0)
+
+    code = sock.connect_ex(addr)
+    if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+        sock.close()
+        raise socket.error(code, errno.errorcode.get(code, str(code)))
+
+    return TCPStream(sock, addr)
+
+
+# class
+#----------
+class TCPStream:
+    # constructor
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.sock.setblocking(0)
+
+        self.inbuf  = ''
+        self.outbuf = ''
+
+        self.closed = False
+        self.active = 0                 # time of the last activity, set by the owner
+
+
+    # read the data available on the socket (at most READ_SIZE bytes, the remaining data
+    # is read on the next event)
+    # return the list of the complete messages received
+    def read(self):
+        try:
+            data = self.sock.recv(READ_SIZE)
+        except socket.error as e:
+            if e.errno not in RETRY_ERRORS:
+                self.closed = True
+            data = ''
+        else:
+            # the peer has closed the connection
+            if not data:
+                self.closed = True
+
+        self.inbuf = self.inbuf + data
+
+        # split the messages
+        messages = list()
+        index = 0
+        while len(self.inbuf) - index >= 2:
+            length = LENGTH.unpack_from(self.inbuf, index)[0]
+            if len(self.inbuf) - index - 2 < length:
+                break
+
+            messages.append(self.inbuf[index + 2:index + 2 + length])
+            index = index + 2 + length
+
+        if index:
+            self.inbuf = self.inbuf[index:]
+
+        return messages
+
+
+    # queue a message and send as much data as possible
+    # the stream is considered as closed when the peer does not read its data
+    def write(self, message):
+        if self.closed:
+            return
+
+        self.outbuf = self.outbuf + LENGTH.pack(len(message)) + str(message)
+        self.flush()
+
+        if len(self.outbuf) > MAX_OUTPUT:
+            self.closed = True
+
+
+    # send the data waiting in the output buffer
+    def flush(self):
+        while self.outbuf and not self.closed:
+            try:
+                sent = self.sock.send(self.outbuf)
+            except socket.error as e:
+                if e.errno not in RETRY_ERRORS:
+                    self.closed = True
+                break
+
+            self.outbuf = self.outbuf[sent:]
+
+
+    # return True if some data is waiting to be sent
+    def pending(self):
+        return len(self.outbuf) > 0
+
+
+    # close the connection
+    def close(self):
+        self.closed = True
+        self.sock.close()
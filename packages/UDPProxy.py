@@ -10,11 +10,35 @@
 # imports
 #----------
 import time
+import errno
 import socket
-import select
-import binascii
+import threading
 
+from Logger import HexDump
 from DNSQuery import DNSQuery
+from DNSQuery import BLOCK_MODES
+from DNSQuery import BLOCK_NXDOMAIN
+from DNSQuery import SINKHOLE_TTL
+from DNSQuery import RCODE_SERVFAIL
+from DNSQuery import RCODE_REFUSED
+from Forwarder import Forwarder
+from ResponseCache import ResponseCache
+from PacketIO import PacketIO
+from TCPStream import TCPStream
+from EventLoop import EVENT_LOOPS
+from EventLoop import DEFAULT_EVENT_LOOP
+from EventLoop import createEventLoop
+from WorkerPool import workersCount
+from QueryLog import QueryLog
+from QueryLog import VERDICT_FORWARDED
+from QueryLog import VERDICT_CACHED
+from QueryLog import VERDICT_DENIED
+from QueryLog import VERDICT_LOST
+from QueryLog import VERDICT_STALE
+from Metrics import Metrics
+from RateLimiter import RateLimiter
+from CacheSnapshot import CacheSnapshot
+from CacheSnapshot import writeSnapshot
 
 
 # globals
@@ -22,10 +46,26 @@ from DNSQuery import DNSQuery
 
 MAX_BUFFER = 32768
 
+# default values when the options are not present in the configuration
+DEFAULT_TCP_CLIENTS      = 64
+DEFAULT_TCP_IDLE_TIMEOUT = 10.0
+DEFAULT_CACHE_SNAPSHOT_INTERVAL = 60.0
+DEFAULT_MAX_PENDING      = 10000
+
+# size of the queue of the TCP connections not accepted yet
+TCP_BACKLOG = 128
+
+# SO_REUSEPORT is not defined by all the versions of the socket module (value for Linux)
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
 
 # functions
 #----------
 
+# return True if the real DNS has failed to answer (SERVFAIL or REFUSED)
+def failed(response):
+    return (len(response) > 3) and ((ord(response[3]) & 0x0F) in (RCODE_SERVFAIL, RCODE_REFUSED))
+
 
 # class
 #----------
@@ -53,7 +93,7 @@ class UDPProxy:
         # listening port
         if self.config.has_option('proxy', 'listening_port'):
             self.listening_port = self.config.getint('proxy', 'listening_port')
-            self.logger.info("Proxy will listen on port {0}".format(self.listening_port))
+            self.logger.info("Proxy will listen on port {0}", self.listening_port)
         else:
             self.logger.error("Option 'listening_port' is not present in the 'proxy' section!")
             return False
@@ -72,7 +112,79 @@ class UDPProxy:
             self.logger.error("Option 'dns_port' is not present in the 'proxy' section!")
             return False
 
-        self.logger.info("DNS requests will be forwarded to {0}:{1}".format(self.dns_host, self.dns_port))
+        # way of blocking the denied requests
+        self.block_mode = BLOCK_NXDOMAIN
+        if self.config.has_option('proxy', 'block_mode'):
+            self.block_mode = self.config.get('proxy', 'block_mode').lower()
+            if self.block_mode not in BLOCK_MODES:
+                self.logger.error("Option 'block_mode' should be one of {0}!", ', '.join(BLOCK_MODES))
+                return False
+
+        self.sinkhole_ttl = SINKHOLE_TTL
+        if self.config.has_option('proxy', 'sinkhole_ttl'):
+            self.sinkhole_ttl = self.config.getint('proxy', 'sinkhole_ttl')
+
+        self.logger.info("Denied requests will be answered with {0}", self.block_mode)
+
+        # engine waiting for the events on the sockets
+        self.event_loop = DEFAULT_EVENT_LOOP
+        if self.config.has_option('proxy', 'event_loop'):
+            self.event_loop = self.config.get('proxy', 'event_loop').lower()
+            if self.event_loop not in EVENT_LOOPS:
+                self.logger.error("Option 'event_loop' should be one of {0}!", ', '.join(EVENT_LOOPS))
+                return False
+
+        # listen also over TCP (off by default: the port must be free for TCP too)
+        self.tcp = False
+        if self.config.has_option('proxy', 'tcp'):
+            self.tcp = self.config.getboolean('proxy', 'tcp')
+
+        self.tcp_clients = DEFAULT_TCP_CLIENTS
+        if self.config.has_option('proxy', 'tcp_clients'):
+            self.tcp_clients = max(1, self.config.getint('proxy', 'tcp_clients'))
+
+        self.tcp_idle_timeout = DEFAULT_TCP_IDLE_TIMEOUT
+        if self.config.has_option('proxy', 'tcp_idle_timeout'):
+            self.tcp_idle_timeout = self.config.getfloat('proxy', 'tcp_idle_timeout')
+
+        # several workers share the listening port
+        self.reuse_port = workersCount(self.config) > 1
+
+        # counters and latency histograms (shared with the forwarder)
+        self.metrics = Metrics(self.dummy)
+        self.dummy.metrics = self.metrics
+
+        # create the forwarding engine
+        self.forwarder = Forwarder(self.dummy, self.dns_host, self.dns_port)
+
+        # create the cache for the answers of the real DNS
+        self.cache = ResponseCache(self.dummy)
+
+        # binary log of the queries
+        self.querylog = QueryLog(self.dummy)
+
+        # rate limit of each client
+        self.limiter = RateLimiter(self.dummy)
+
+        # maximum number of queries waiting for the real DNS (0 for no limit)
+        self.max_pending = DEFAULT_MAX_PENDING
+        if self.config.has_option('proxy', 'max_pending'):
+            self.max_pending = max(0, self.config.getint('proxy', 'max_pending'))
+
+        # snapshot of the caches for the next start (one file per worker)
+        self.snapshot_path = None
+        if self.config.has_option('proxy', 'cache_snapshot'):
+            self.snapshot_path = self.config.get('proxy', 'cache_snapshot').strip() or None
+
+        worker = getattr(self.dummy, 'worker', None)
+        if (self.snapshot_path is not None) and (worker is not None):
+            self.snapshot_path = "{0}.{1}".format(self.snapshot_path, worker)
+
+        self.snapshot_interval = DEFAULT_CACHE_SNAPSHOT_INTERVAL
+        if self.config.has_option('proxy', 'cache_snapshot_interval'):
+            self.snapshot_interval = self.config.getfloat('proxy', 'cache_snapshot_interval')
+
+        self.snapshot_thread = None
 
         return True
 
@@ -82,88 +194,453 @@ class UDPProxy:
         self.isRunning = False
 
 
-    # run the proxy
-    def run(self):
-        # create the listening socket
+    # send an answer to a client over UDP or over its TCP connection
+    def __reply(self, target, query, data):
+        self.logger.debug('< {0}', HexDump(data))
+
+        if target is self.sock:
+            # the answer is too large for the client: let it ask again over TCP
+            if len(data) > query.payload():
+                data = query.truncate()
+
+            self.io.send(data, query.addr)
+            return
+
+        if target.closed:
+            return
+
+        target.write(data)
+        if target.closed:
+            self.logger.debug('TCP connection {0} does not read its answers, closing it.', target.addr)
+            self.__closeClient(target)
+        elif target.pending():
+            self.loop.watchWrite(target.sock, True)
+
+
+    # process a request from a client (stream is the TCP connection of the client)
+    def __request(self, data, addr, stream = None):
+        start = time.time()
+
+        if not data:
+            self.logger.debug('Connection {0} has closed.', addr)
+            return
+
+        self.logger.debug('New connection from {0}', addr)
+        self.logger.debug('> {0}', HexDump(data))
+
+        metrics = self.metrics
+        metrics.queries += 1
+        if stream is not None:
+            metrics.tcp += 1
+
+        # decode the DNS query
+        query = DNSQuery()
+        result = query.decode(data, addr)
+
+        decoded = time.time()
+        metrics.decode.record(decoded - start)
+
+        # unable to decode the packet!
+        if result is None:
+            metrics.invalid += 1
+            return
+
+        # client over its rate limit: refused without checking the rules
+        if self.limiter.enabled() and not self.limiter.allow(query.ip, start):
+            metrics.limited += 1
+            self.__reply(self.sock if stream is None else stream, query, query.answer(RCODE_REFUSED))
+            return
+
+        self.logger.info("New query from [{0}] : [{1}]", query.ip, query.domain)
+
+        # the same decision applies to both transports
+        target = self.sock if stream is None else stream
+
+        # create the values for the rules processor
+        now = time.localtime()
+        values = [ query.ip, query.domain, now.tm_hour * 60 + now.tm_min, now.tm_wday ]
+
+        # check the rules
+        result, rule = self.dummy.dns_processor.processRules(values)
+
+        metrics.rules.record(time.time() - decoded)
+        metrics.verdict(result, rule)
+
+        # request has been denied
+        if result == False:
+            mode = self.block_mode
+            if (rule is not None) and (rule.block_mode is not None):
+                mode = rule.block_mode
+
+            self.__reply(target, query, query.deny(mode, self.sinkhole_ttl))
+            latency = time.time() - start
+            metrics.total.record(latency)
+            self.querylog.add(query, VERDICT_DENIED, rule, latency, stream is not None)
+            return
+
+        # request has been authorized -> look for the answer in the cache
+        response, refresh = self.cache.get(query)
+        if response is not None:
+            self.__reply(target, query, response)
+            latency = time.time() - start
+            metrics.total.record(latency)
+            self.querylog.add(query, VERDICT_CACHED, rule, latency, stream is not None)
+
+            # refresh a popular answer before it expires
+            if refresh:
+                self.forwarder.prefetch(query)
+            return
+
+        # too many queries are waiting for the real DNS: fail right away (or give the expired answer)
+        stale = self.cache.getStale(query)
+        if self.max_pending and (self.forwarder.pending() >= self.max_pending):
+            metrics.shed += 1
+            if stale is not None:
+                self.cache.servedStale()
+            self.__reply(target, query, stale if stale is not None else query.answer(RCODE_SERVFAIL))
+            latency = time.time() - start
+            metrics.total.record(latency)
+            self.querylog.add(query, VERDICT_LOST if stale is None else VERDICT_STALE, rule, latency, stream is not None)
+            return
+
+        # forward it to the real DNS (with the expired answer to give if the real DNS fails)
+        if self.forwarder.forward(query, target, rule, stream is not None, start, stale) == False:
+            self.logger.warning("Unable to forward the query of [{0}] : [{1}]", query.ip, query.domain)
+            if stale is not None:
+                self.cache.servedStale()
+            self.__reply(target, query, stale if stale is not None else query.answer(RCODE_SERVFAIL))
+            latency = time.time() - start
+            metrics.total.record(latency)
+            self.querylog.add(query, VERDICT_LOST if stale is None else VERDICT_STALE, rule, latency, stream is not None)
+
+
+    # accept the new TCP clients
+    def __accept(self):
+        while True:
+            try:
+                sock, addr = self.tcp_sock.accept()
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    self.logger.warning('Error when accepting a TCP client: {0}', str(e))
+                return
+
+            if len(self.clients) >= self.tcp_clients:
+                self.logger.warning('Too many TCP clients, connection from {0} refused.', addr)
+                sock.close()
+                continue
+
+            self.logger.debug('New TCP connection from {0}', addr)
+            stream = TCPStream(sock, addr)
+            stream.active = time.time()
+            self.clients[sock] = stream
+            self.loop.register(sock)
+
+
+    # close the connection of a TCP client
+    def __closeClient(self, stream):
+        if self.clients.pop(stream.sock, None) is None:
+            return
+
+        self.loop.unregister(stream.sock)
+        stream.close()
+
+
+    # read the requests of a TCP client
+    def __readClient(self, stream):
+        stream.active = time.time()
+
+        for data in stream.read():
+            self.__request(data, stream.addr, stream)
+
+        if stream.closed:
+            self.logger.debug('TCP connection {0} has closed.', stream.addr)
+            self.__closeClient(stream)
+
+
+    # send the answers waiting for a writable TCP client
+    def __flushClient(self, stream):
+        stream.active = time.time()
+        stream.flush()
+
+        if stream.closed:
+            self.__closeClient(stream)
+        elif not stream.pending():
+            self.loop.watchWrite(stream.sock, False)
+
+
+    # close the TCP clients without activity (including the ones not reading their answers)
+    def __closeIdleClients(self, now):
+        for stream in list(self.clients.values()):
+            if stream.active + self.tcp_idle_timeout <= now:
+                self.logger.debug('TCP connection {0} is idle, closing it.', stream.addr)
+                self.__closeClient(stream)
+
+
+    # return the metrics of the cache, of the I/O and of the real DNS servers
+    # (called by the thread of the metrics endpoint)
+    def __collect(self):
+        cache = self.cache.stats()
+        verdicts = self.dummy.dns_processor.stats()
+        upstreams = self.forwarder.pool.upstreams
+
+        def each(attribute):
+            return [ ((('upstream', u), ), getattr(u, attribute)) for u in upstreams ]
+
+        return [
+            ('cache_entries', 'gauge', 'Answers in the cache', [ ((), cache['entries']) ]),
+            ('cache_memory_bytes', 'gauge', 'Memory used by the answers in the cache', [ ((), cache['memory']) ]),
+            ('cache_hits_total', 'counter', 'Answers found in the cache', [ ((), cache['hits']) ]),
+            ('cache_misses_total', 'counter', 'Answers not found in the cache', [ ((), cache['misses']) ]),
+            ('cache_evictions_total', 'counter', 'Answers removed from the cache before their TTL', [ ((), cache['evictions']) ]),
+            ('cache_prefetches_total', 'counter', 'Popular answers refreshed before their TTL', [ ((), cache['prefetches']) ]),
+            ('cache_stale_answers_total', 'counter', 'Expired answers given when the real DNS has failed', [ ((), cache['stale']) ]),
+            ('verdict_cache_entries', 'gauge', 'Verdicts of the rule processor in the cache', [ ((), verdicts['entries']) ]),
+            ('verdict_cache_hits_total', 'counter', 'Verdicts found in the cache', [ ((), verdicts['hits']) ]),
+            ('verdict_cache_misses_total', 'counter', 'Verdicts not found in the cache', [ ((), verdicts['misses']) ]),
+            ('verdict_cache_evictions_total', 'counter', 'Verdicts removed from the full cache', [ ((), verdicts['evictions']) ]),
+            ('packets_received_total', 'counter', 'Datagrams received from the clients', [ ((), self.io.received) ]),
+            ('packets_sent_total', 'counter', 'Datagrams sent to the clients', [ ((), self.io.sent) ]),
+            ('tcp_clients', 'gauge', 'TCP connections of the clients', [ ((), len(self.clients)) ]),
+            ('rate_limited_clients', 'gauge', 'Clients followed by the rate limiter', [ ((), len(self.limiter.buckets)) ]),
+            ('inflight_queries', 'gauge', 'Queries waiting for an answer of the real DNS', [ ((), self.forwarder.pending()) ]),
+            ('coalesced_queries_total', 'counter', 'Queries waiting for the answer of the same question in flight', [ ((), self.forwarder.coalesced) ]),
+            ('upstream_up', 'gauge', 'Health of the real DNS servers', [ (labels, int(value)) for labels, value in each('healthy') ]),
+            ('upstream_srtt_seconds', 'gauge', 'Smoothed round-trip time of the real DNS servers',
+                [ (labels, value) for labels, value in each('srtt') if value is not None ]),
+            ('upstream_queries_total', 'counter', 'Queries sent to the real DNS servers', each('queries')),
+            ('upstream_answers_total', 'counter', 'Answers received from the real DNS servers', each('answers')),
+            ('upstream_timeouts_total', 'counter', 'Queries without answer of the real DNS servers', each('timeouts')),
+        ]
+
+
+    # fill the caches with the snapshot of the previous run
+    # (only the index is read, the answers are read when they are asked)
+    def __restoreSnapshot(self):
+        start = time.time()
+        snapshot = CacheSnapshot(self.snapshot_path)
+        try:
+            snapshot.open()
+        except IOError as e:
+            self.logger.info("No cache snapshot restored: {0}", str(e))
+            return
+        except ValueError as e:
+            self.logger.warning("Cache snapshot {0} cannot be read: {1}", self.snapshot_path, str(e))
+            return
+
+        answers, verdicts = len(snapshot.answers), len(snapshot.verdicts)
+        restored = self.dummy.dns_processor.restoreVerdicts(snapshot.fingerprint, snapshot.verdicts)
+        snapshot.verdicts = None
+        self.cache.restore(snapshot)
+
+        self.logger.info("Cache snapshot of {0} restored in {1:.1f}ms: {2} answers ({3} expired), {4} of {5} verdicts",
+                         time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.created)), (time.time() - start) * 1000,
+                         answers, snapshot.expired, restored, verdicts)
+
+
+    # write the snapshot of the caches
+    # the caches are copied here and written by a thread (or now when wait is True)
+    def __saveSnapshot(self, wait = False):
+        if (self.snapshot_thread is not None) and self.snapshot_thread.is_alive():
+            if not wait:
+                return
+            self.snapshot_thread.join()
+
+        fingerprint, verdicts = self.dummy.dns_processor.verdicts()
+        args = (self.cache.items(), verdicts, fingerprint)
+
+        if wait:
+            self.__writeSnapshot(*args)
+            return
+
+        self.snapshot_thread = threading.Thread(target = self.__writeSnapshot, args = args, name = "CacheSnapshot")
+        self.snapshot_thread.daemon = True
+        self.snapshot_thread.start()
+
+
+    def __writeSnapshot(self, answers, verdicts, fingerprint):
+        start = time.time()
+        try:
+            answers, verdicts = writeSnapshot(self.snapshot_path, answers, verdicts, fingerprint)
+        except (IOError, OSError) as e:
+            self.logger.warning("Unable to write the cache snapshot {0}: {1}", self.snapshot_path, str(e))
+            return
+
+        self.logger.debug("Cache snapshot written in {0:.1f}ms: {1} answers, {2} verdicts", (time.time() - start) * 1000, answers, verdicts)
+
+
+    # create the listening sockets
+    def __listen(self):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
             self.sock.bind(('', self.listening_port))
+
+            if self.tcp:
+                self.tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if self.reuse_port:
+                    self.tcp_sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+                self.tcp_sock.bind(('', self.listening_port))
+                self.tcp_sock.listen(TCP_BACKLOG)
+                self.tcp_sock.setblocking(0)
         except socket.error as e:
-            self.logger.error('An error occured when creating the socket!: {0}'.format((str(e))))
-            return
+            self.logger.error('An error occured when creating the socket!: {0}', (str(e)))
+            return False
 
-        # list of listening socket for select
-        in_select = [ self.sock ]
+        return True
 
-        # main loop
-        self.logger.info('Starting UDP proxy ...')
-        self.isRunning = True
 
-        while self.isRunning:
+    # run the proxy
+    # return False if the proxy could not be started
+    def run(self):
+        # create the listening sockets
+        self.sock = None
+        self.tcp_sock = None
+        if self.__listen() == False:
+            for sock in (self.sock, self.tcp_sock):
+                if sock is not None:
+                    sock.close()
+            return False
 
-            # wait for an event while protecting select against select.error due to kill signal
-            while self.isRunning:
-                try:
-                    # wait for a socket
-                    rd, wr, ex = select.select(in_select, [], [])
-                    break
-                except select.error:
-                    if self.isRunning == False:
-                        rd = list()
-                        break
+        # engine watching the listening sockets, the upstream sockets and the TCP connections
+        self.loop = createEventLoop(self.event_loop, [ s for s in (self.sock, self.tcp_sock) if s is not None ])
+        self.clients = dict()
 
+        # create the upstream sockets
+        if self.forwarder.initialize(self.loop) == False:
+            self.loop.close()
+            self.sock.close()
+            if self.tcp_sock is not None:
+                self.tcp_sock.close()
+            return False
 
-            # treat only rd socket
-            for sock in rd:
-                # a new client has connected
-                if sock == self.sock:
+        # batched I/O on the listening socket
+        self.io = PacketIO(self.dummy, self.sock)
 
-                    # retrieve the data and who connect
-                    data, addr = sock.recvfrom(MAX_BUFFER)
-                    if not data:
-                        self.logger.debug('Connection {0} has closed.'.format(addr))
-                        continue
+        self.querylog.start()
 
-                    self.logger.debug('New connection from {0}'.format(addr))
-                    self.logger.debug('> {0}'.format(binascii.hexlify(data)))
+        self.metrics.addCollector(self.__collect)
+        self.metrics.start()
 
-                    # decode the DNS query
-                    query = DNSQuery()
-                    result = query.decode(data, addr)
-                    
-                    # unable to decode the packet!
-                    if result is None:
-                        continue
+        if self.snapshot_path is not None:
+            self.__restoreSnapshot()
 
-                    self.logger.info("New query from [{0}] : [{1}]".format(query.ip, query.domain))
+        # main loop
+        self.logger.info('Starting UDP{0} proxy ({1}) ...', '/TCP' if self.tcp else '', self.loop.name)
+        self.isRunning = True
+        next_sweep = time.time() + self.tcp_idle_timeout
+        next_snapshot = time.time() + self.snapshot_interval
 
-                    # create the values for the rules processor
-                    day = time.strftime("%a", time.localtime()).lower()
-                    daytime = time.strftime('%H%M', time.localtime())
-                    values = [ query.ip, query.domain, daytime, day ]
+        while self.isRunning:
 
-                    # check the rules
-                    result = self.dummy.dns_processor.processRules(values)
+            # wait for a socket or for the next in-flight query to expire
+            # (nothing is returned when a signal interrupts the wait)
+            rd, wr = self.loop.wait(self.forwarder.nextTimeout())
 
-                    # request has been denied
-                    if result == False:
-                        sock.sendto( query.deny(), addr )
-                        continue
+            # treat the rd sockets
+            for sock in rd:
+                # new requests from the clients
+                if sock is self.sock:
+                    for data, addr in self.io.receive():
+                        self.__request(data, addr)
 
-                    # request has been authorized -> request the real DNS
-                    new_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    new_sock.sendto(data, (self.dns_host, self.dns_port))
-                    response, _ = new_sock.recvfrom(MAX_BUFFER)
-                    new_sock.close()
+                # new TCP clients
+                elif sock is self.tcp_sock:
+                    self.__accept()
 
-                    # forward the answer to the initial caller
-                    self.logger.debug('< {0}'.format(binascii.hexlify(response)))
-                    sock.sendto(response, addr)
+                # requests from a TCP client
+                elif sock in self.clients:
+                    self.__readClient(self.clients[sock])
 
+                # an answer from the real DNS
+                elif self.forwarder.owns(sock):
+
+                    # forward the answers to the initial callers
+                    for entry, response in self.forwarder.receive(sock):
+                        if not entry.coalesced:
+                            self.cache.put(entry.query, response)
+
+                        # the client has already been answered (or it is a prefetch)
+                        if entry.answered:
+                            continue
+
+                        verdict = VERDICT_FORWARDED
+                        if (entry.stale is not None) and failed(response):
+                            response, verdict = entry.stale, VERDICT_STALE
+                            self.cache.servedStale()
+
+                        self.__reply(entry.sock, entry.query, response)
+                        latency = time.time() - entry.received
+                        self.metrics.total.record(latency)
+                        self.querylog.add(entry.query, verdict, entry.rule, latency, entry.sock is not self.sock)
 
                 # Wtf??
                 else:
                     self.logger.error('Unknown socket???')
 
+            # continue sending on the TCP connections
+            for sock in wr:
+                if sock in self.clients:
+                    self.__flushClient(self.clients[sock])
+                else:
+                    self.forwarder.flush(sock)
+
+            # forget the queries lost by the real DNS
+            for entry in self.forwarder.expire():
+                latency = time.time() - entry.received
+
+                # give the expired answer of the cache
+                if entry.stale is not None:
+                    self.logger.warning("No answer in time from the real DNS for [{0}] : [{1}], expired answer given", entry.query.ip, entry.query.domain)
+                    self.__reply(entry.sock, entry.query, entry.stale)
+                    self.cache.servedStale()
+                    self.metrics.total.record(latency)
+                    self.querylog.add(entry.query, VERDICT_STALE, entry.rule, latency, entry.sock is not self.sock)
+                    continue
+
+                # let the client fail right away instead of waiting for its own timeout
+                self.logger.warning("No answer from the real DNS for [{0}] : [{1}]", entry.query.ip, entry.query.domain)
+                self.__reply(entry.sock, entry.query, entry.query.answer(RCODE_SERVFAIL))
+                self.metrics.total.record(latency)
+                self.querylog.add(entry.query, VERDICT_LOST, entry.rule, latency, entry.sock is not self.sock)
+
+            # send all the answers of this round
+            self.io.flush()
+
+            # close the idle TCP clients from time to time
+            now = time.time()
+            if self.clients and (next_sweep <= now):
+                self.__closeIdleClients(now)
+                next_sweep = now + 1
+
+            # forget the clients back under their rate limit
+            if self.limiter.enabled() and (self.limiter.next_sweep <= now):
+                self.limiter.sweep(now)
+
+            # save the caches from time to time
+            if (self.snapshot_path is not None) and (self.snapshot_interval > 0) and (next_snapshot <= now):
+                self.__saveSnapshot()
+                next_snapshot = now + self.snapshot_interval
+
+        for stream in list(self.clients.values()):
+            self.__closeClient(stream)
+
+        if self.snapshot_path is not None:
+            self.__saveSnapshot(wait = True)
+
+        self.metrics.stop()
+        self.forwarder.close()
+        self.querylog.close()
+        self.loop.close()
+        self.sock.close()
+        if self.tcp_sock is not None:
+            self.tcp_sock.close()
+
+        self.logger.info('Cache statistics: {0}', self.cache.stats())
+        self.logger.info('Verdict cache statistics: {0}', self.dummy.dns_processor.stats())
+        self.logger.info('Rate limiter statistics: {0}, {1} queries shed', self.limiter.stats(), self.metrics.shed)
+        self.logger.info('I/O statistics: {0}', self.io.stats())
+        self.logger.info('Upstream statistics: {0}', self.forwarder.stats())
         self.logger.info('Proxy has been stopped')
@@ -0,0 +1,275 @@
+# @file     UpstreamPool.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Pool of real DNS servers with health and latency tracking
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           'dns_host' is a list of servers separated by commas (host or host:port,
+#           'dns_port' being the default port). For each server, the pool keeps a
+#           smoothed round-trip time (RFC 6298) used to pick the server and to compute
+#           the time after which a query is sent to another server.
+#           A server is marked down after upstream_max_failures consecutive timeouts,
+#           and up again as soon as it answers a query or a probe.
+#           Selection policies:
+#           fastest     : the healthy server with the lowest smoothed RTT
+#           round-robin : the healthy servers in turn
+#           race        : the query is sent to the upstream_race fastest healthy servers
+#                         and the first answer wins
+
+# imports
+#----------
+import socket
+
+
+# globals
+#----------
+
+POLICY_FASTEST     = 'fastest'
+POLICY_ROUND_ROBIN = 'round-robin'
+POLICY_RACE        = 'race'
+
+UPSTREAM_POLICIES = [ POLICY_FASTEST, POLICY_ROUND_ROBIN, POLICY_RACE ]
+
+# default values when the options are not present in the configuration
+DEFAULT_UPSTREAM_POLICY       = POLICY_FASTEST
+DEFAULT_UPSTREAM_RACE         = 2
+DEFAULT_UPSTREAM_MAX_FAILURES = 3
+
+# gains of the smoothed RTT and of its variation (RFC 6298)
+RTT_ALPHA = 0.125
+RTT_BETA  = 0.25
+
+# lower bound of the time to wait for an answer
+MIN_TIMEOUT = 0.1
+
+
+# functions
+#----------
+
+# return the list of (host, port) from the 'dns_host' option
+def parseUpstreams(dns_host, dns_port):
+    upstreams = list()
+
+    for item in dns_host.split(','):
+        item = item.strip()
+        if not item:
+            continue
+
+        host, port = item, dns_port
+        if ':' in item:
+            host, port = item.rsplit(':', 1)
+            port = int(port)
+
+        upstreams.append((host.strip(), port))
+
+    return upstreams
+
+
+# class
+#----------
+
+# a real DNS server
+class Upstream:
+    # constructor
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+        # sockets connected to the server
+        self.socks = list()
+        self.index = 0
+
+        # TCP connections to the server, managed by the forwarder
+        self.streams = list()
+        self.stream_index = 0
+
+        # smoothed round-trip time and its variation (None until the first answer)
+        self.srtt   = None
+        self.rttvar = 0.0
+
+        # health
+        self.failures = 0
+        self.healthy  = True
+
+        # counters
+        self.queries  = 0
+        self.answers  = 0
+        self.timeouts = 0
+
+
+    def __str__(self):
+        return "{0}:{1}".format(self.host, self.port)
+
+
+    # send a message through the sockets in turn
+    def send(self, data):
+        sock = self.socks[self.index]
+        self.index = (self.index + 1) % len(self.socks)
+
+        sock.send(data)
+        self.queries += 1
+
+
+    # take a round-trip time into account
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt   = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt   = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+
+        self.answers += 1
+
+
+    # return the time to wait for an answer, bounded by the maximum given
+    def rto(self, maximum):
+        if self.srtt is None:
+            return maximum
+
+        return min(maximum, max(MIN_TIMEOUT, self.srtt + 4 * self.rttvar))
+
+
+    # return the key used to sort the servers from the fastest to the slowest
+    # (the servers without any answer yet are tried first)
+    def rank(self):
+        if self.srtt is None:
+            return -1.0
+
+        return self.srtt
+
+
+class UpstreamPool:
+    # constructor
+    def __init__(self, dummy, dns_host, dns_port):
+        self.dummy  = dummy
+        self.config = dummy.application.config
+        self.logger = dummy.logger
+
+        self.upstreams = [ Upstream(host, port) for host, port in parseUpstreams(dns_host, dns_port) ]
+        self.index = 0
+
+        # socket -> server
+        self.owners = dict()
+
+        # read the options
+        self.policy       = DEFAULT_UPSTREAM_POLICY
+        self.race         = DEFAULT_UPSTREAM_RACE
+        self.max_failures = DEFAULT_UPSTREAM_MAX_FAILURES
+
+        if self.config.has_option('proxy', 'upstream_policy'):
+            self.policy = self.config.get('proxy', 'upstream_policy').lower()
+
+        if self.config.has_option('proxy', 'upstream_race'):
+            self.race = max(1, self.config.getint('proxy', 'upstream_race'))
+
+        if self.config.has_option('proxy', 'upstream_max_failures'):
+            self.max_failures = max(1, self.config.getint('proxy', 'upstream_max_failures'))
+
+
+    # check the options and create the sockets connected to the servers
+    def initialize(self, count):
+        if not self.upstreams:
+            self.logger.error("Option 'dns_host' does not contain any server!")
+            return False
+
+        if self.policy not in UPSTREAM_POLICIES:
+            self.logger.error("Option 'upstream_policy' should be one of {0}!", ', '.join(UPSTREAM_POLICIES))
+            return False
+
+        try:
+            for upstream in self.upstreams:
+                for i in range(count):
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock.connect((upstream.host, upstream.port))
+                    sock.setblocking(0)
+                    upstream.socks.append(sock)
+                    self.owners[sock] = upstream
+        except socket.error as e:
+            self.logger.error('An error occured when creating the upstream sockets!: {0}', str(e))
+            self.close()
+            return False
+
+        self.logger.info("DNS requests will be forwarded to {0} ({1})", ', '.join([ str(u) for u in self.upstreams ]), self.policy)
+        return True
+
+
+    # close all the sockets
+    def close(self):
+        for upstream in self.upstreams:
+            for sock in upstream.socks:
+                sock.close()
+            upstream.socks = list()
+
+        self.owners = dict()
+
+
+    # return all the sockets
+    def sockets(self):
+        return list(self.owners.keys())
+
+
+    # return the server connected to a socket
+    def owner(self, sock):
+        return self.owners.get(sock)
+
+
+    # return the servers where to send a query, skipping the ones already tried
+    def select(self, exclude = ()):
+        candidates = [ u for u in self.upstreams if u.healthy and u not in exclude ]
+
+        # no healthy server left: try the others anyway
+        if not candidates:
+            candidates = [ u for u in self.upstreams if u not in exclude ]
+        if not candidates:
+            candidates = self.upstreams
+
+        if self.policy == POLICY_ROUND_ROBIN:
+            self.index = (self.index + 1) % len(candidates)
+            return [ candidates[self.index] ]
+
+        # a query sent again does not race
+        if (self.policy == POLICY_RACE) and not exclude:
+            return sorted(candidates, key = Upstream.rank)[:self.race]
+
+        return [ min(candidates, key = Upstream.rank) ]
+
+
+    # a server has answered in rtt seconds
+    def success(self, upstream, rtt):
+        upstream.sample(rtt)
+        upstream.failures = 0
+
+        if not upstream.healthy:
+            upstream.healthy = True
+            self.logger.info("Real DNS {0} is up again", upstream)
+
+
+    # a server has not answered in time
+    def failure(self, upstream, timeout):
+        upstream.timeouts += 1
+        upstream.failures += 1
+
+        # a timeout counts as a slow answer
+        if upstream.srtt is None:
+            upstream.srtt = timeout
+        else:
+            upstream.srtt = (1 - RTT_ALPHA) * upstream.srtt + RTT_ALPHA * timeout
+
+        if upstream.healthy and (upstream.failures >= self.max_failures):
+            upstream.healthy = False
+            self.logger.warning("Real DNS {0} is down after {1} timeouts", upstream, upstream.failures)
+
+
+    # return the statistics of the servers
+    def stats(self):
+        items = list()
+        for u in self.upstreams:
+            srtt = '-' if u.srtt is None else '{0:.1f}ms'.format(u.srtt * 1000)
+            items.append("{0} [{1}, srtt={2}, queries={3}, answers={4}, timeouts={5}]".format(
+                u, 'up' if u.healthy else 'down', srtt, u.queries, u.answers, u.timeouts))
+
+        return ', '.join(items)
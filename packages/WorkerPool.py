@@ -0,0 +1,168 @@
+# @file     WorkerPool.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Run the proxy in several worker processes
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Each worker is a forked process binding its own SO_REUSEPORT socket on the
+#           listening port, so that the kernel spreads the requests between the workers.
+#           The parent process keeps the application lock, relays the signals USR1,
+#           USR2, TERM, TTIN and TTOU to all the workers and restarts the workers that die.
+#           A worker failing within STARTUP_TIME seconds after its start (for example when
+#           the port cannot be bound) is restarted with a doubled delay each time, and
+#           given up after MAX_STARTUP_FAILURES failures: the pool stops when all the
+#           workers have been given up. Each worker writes its own log file.
+
+# imports
+#----------
+import os
+import time
+import errno
+import signal
+import traceback
+
+
+# globals
+#----------
+
+# default number of workers when the option is not present in the configuration
+DEFAULT_WORKERS = 1
+
+# signals relayed to the workers
+RELAYED_SIGNALS = [ signal.SIGUSR1, signal.SIGUSR2, signal.SIGTERM, signal.SIGTTIN, signal.SIGTTOU ]
+
+# minimum time between two restarts of a worker
+RESTART_DELAY = 1.0
+
+# a worker failing within this time (in seconds) after its start has failed to start
+STARTUP_TIME = 10.0
+
+# number of failures in a row at the start of a worker before giving it up
+MAX_STARTUP_FAILURES = 3
+
+
+# functions
+#----------
+
+# return the number of workers requested in the configuration
+def workersCount(config):
+    if config.has_option('proxy', 'workers'):
+        return max(1, config.getint('proxy', 'workers'))
+
+    return DEFAULT_WORKERS
+
+
+# class
+#----------
+class WorkerPool:
+    # constructor
+    def __init__(self, dummy, target):
+        self.dummy  = dummy
+        self.logger = dummy.logger
+        self.target = target            # function executed by each worker
+
+        self.count = workersCount(dummy.application.config)
+
+        # pid -> worker number
+        self.workers = dict()
+        self.isRunning = False
+
+        # worker number -> time of its last start, number of failures in a row at its start
+        self.started  = dict()
+        self.failures = dict()
+
+
+    # start a worker process
+    def __spawn(self, number):
+        # write the pending logs once, before they get copied in the child
+        self.logger.flush()
+
+        pid = os.fork()
+
+        # worker process: run the proxy and leave without going back to the caller
+        # (the parent owns the application lock)
+        if pid == 0:
+            code = 0
+            self.logger.afterFork(number)
+            try:
+                # the signals are ignored until the worker sets its own handlers
+                for signum in RELAYED_SIGNALS:
+                    signal.signal(signum, signal.SIG_IGN)
+
+                if self.target(number) == False:
+                    code = 1
+            except:
+                self.logger.error("Worker #{0} has failed: {1}", number, traceback.format_exc())
+                code = 1
+            finally:
+                self.logger.close()
+                os._exit(code)
+
+        self.workers[pid] = number
+        self.started[number] = time.time()
+        self.logger.info("Worker #{0} started with pid {1}", number, pid)
+
+
+    # relay a signal to all the workers
+    def relay(self, signum, stack):
+        if signum == signal.SIGTERM:
+            self.logger.info('TERM: stopping the workers...')
+            self.isRunning = False
+
+        for pid in self.workers.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+
+    # start the workers and wait for them to finish
+    # return False if all the workers have failed
+    def run(self):
+        self.isRunning = True
+
+        for number in range(self.count):
+            self.__spawn(number)
+
+        for signum in RELAYED_SIGNALS:
+            signal.signal(signum, self.relay)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                break
+
+            number = self.workers.pop(pid, None)
+            if number is None:
+                continue
+
+            self.logger.info("Worker #{0} (pid {1}) has stopped with status {2}", number, pid, status)
+            if not self.isRunning:
+                continue
+
+            # count the failures in a row at the start of the worker
+            if (status != 0) and (time.time() - self.started[number] < STARTUP_TIME):
+                self.failures[number] = self.failures.get(number, 0) + 1
+                if self.failures[number] >= MAX_STARTUP_FAILURES:
+                    self.logger.error("Worker #{0} has failed {1} times at its start, it is not restarted.", number, self.failures[number])
+                    continue
+            else:
+                self.failures[number] = 0
+
+            # restart the workers that have died
+            time.sleep(RESTART_DELAY * (2 ** self.failures[number]))
+            if self.isRunning:
+                self.__spawn(number)
+
+        if self.isRunning:
+            self.logger.error('All the workers have failed, stopping the proxy.')
+            return False
+
+        self.logger.info('All the workers have been stopped')
+        return True
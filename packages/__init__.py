@@ -16,6 +16,7 @@ from Logger import LOGGER_LEVEL_WARNING
 from Logger import LOGGER_LEVEL_ERROR
 from Logger import LOGGER_LEVEL_CRITICAL
 
+from Logger import HexDump
 from Logger import Logger
 
 
@@ -29,21 +30,108 @@ from Lock import Lock
 from DNSRule import DNSRule
 
 
+# RuleSet.py
+#----------
+from RuleSet import RuleSet
+
+
+# AddressTree.py
+#----------
+from AddressTree import AddressTree
+
+
+# RuleTable.py
+#----------
+from RuleTable import RuleTable
+
+
+# DomainList.py
+#----------
+from DomainList import DomainList
+
+
+# DomainMatcher.py
+#----------
+from DomainMatcher import DomainMatcher
+
+
 # DNSQuery.py
 #----------
 from DNSQuery import DNSQuery
 
 
+# TCPStream.py
+#----------
+from TCPStream import TCPStream
+
+
+# UpstreamPool.py
+#----------
+from UpstreamPool import UpstreamPool
+
+
+# Forwarder.py
+#----------
+from Forwarder import Forwarder
+
+
+# ResponseCache.py
+#----------
+from ResponseCache import ResponseCache
+
+
+# CacheSnapshot.py
+#----------
+from CacheSnapshot import CacheSnapshot
+
+
+# EventLoop.py
+#----------
+from EventLoop import createEventLoop
+
+
+# PacketIO.py
+#----------
+from PacketIO import PacketIO
+
+
 # RuleProcessor.py
 #----------
 from RuleProcessor import RuleProcessor
 
 
+# RateLimiter.py
+#----------
+from RateLimiter import RateLimiter
+
+
 # SignalHandler.py
 #----------
 from SignalHandler import SignalHandler
 
 
+# Profiler.py
+#----------
+from Profiler import Profiler
+
+
+# Metrics.py
+#----------
+from Metrics import Histogram
+from Metrics import Metrics
+
+
+# QueryLog.py
+#----------
+from QueryLog import QueryLog
+
+
+# WorkerPool.py
+#----------
+from WorkerPool import workersCount
+from WorkerPool import WorkerPool
+
+
 # UDPProxy.py
 #----------
 from UDPProxy import UDPProxy
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# @file     benchDecode.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Micro-benchmark of the decoding of the DNS queries
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Compare the number of packets decoded per second by DNSQuery.decode with
+#           the original implementation (six struct.unpack and string concatenations).
+
+# imports
+#----------
+import os
+import sys
+import struct
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from packages import DNSQuery
+
+
+# globals
+#----------
+
+# queries used for the benchmark (also by benchProxy)
+PACKETS = [
+    # www.example.com A
+    struct.pack('>6H', 0x1234, 0x0100, 1, 0, 0, 0) + '\x03www\x07example\x03com\x00' + struct.pack('>HH', 1, 1),
+
+    # a longer name with an EDNS0 OPT record (DNSSEC OK)
+    struct.pack('>6H', 0x4321, 0x0100, 1, 0, 0, 1) + '\x0cgoogleads4-1\x01g\x0bdoubleclick\x03net\x00' + struct.pack('>HH', 28, 1)
+        + '\x00' + struct.pack('>HHIH', 41, 4096, 0x8000, 0),
+]
+
+
+# functions
+#----------
+
+# return the number of packets decoded per second
+def measure(factory, count):
+    addr = ('192.168.1.20', 53000)
+    timer = timeit.Timer(lambda: [ factory().decode(packet, addr) for packet in PACKETS ])
+    elapsed = min(timer.repeat(repeat = 5, number = count))
+    return count * len(PACKETS) / elapsed
+
+
+# class
+#----------
+
+# original implementation of DNSQuery.decode
+class LegacyQuery:
+    # constructor
+    def __init__(self):
+        self.requestID  = None
+        self.flags      = 0
+        self.queries    = 0
+        self.answers    = 0
+        self.authority  = 0
+        self.additional = 0
+        self.domain     = None
+
+        self.ip         = None
+        self.port       = None
+
+        self.data       = None
+        self.addr       = None
+
+
+    # decode a request from the client
+    def decode(self, data, addr):
+        try:
+            self.requestID  = int( struct.unpack('>H', data[0:2])[0] )
+            self.flags      = int( struct.unpack('>H', data[2:4])[0] )
+            self.queries    = int( struct.unpack('>H', data[4:6])[0] )
+            self.answers    = int( struct.unpack('>H', data[6:8])[0] )
+            self.authority  = int( struct.unpack('>H', data[8:10])[0] )
+            self.additional = int( struct.unpack('>H', data[10:12])[0] )
+            self.data       = data
+            self.addr       = addr
+
+            self.domain = ''
+            index = 12
+            while True:
+                count = struct.unpack('B',data[index])[0]
+                index = index + 1
+                if count == 0:
+                    break
+
+                text = data[index:index + count]
+                if self.domain == '':
+                    self.domain = text
+                else:
+                    self.domain = self.domain + '.' + text
+
+                index = index + count
+
+            self.ip, self.port = addr
+        except:
+            return None
+
+        return True
+
+
+# begin
+#----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark of DNSQuery.decode")
+    parser.add_argument("-n", "--number", action="store", dest="number", type=int, default=100000, help="Number of iterations")
+    args = parser.parse_args()
+
+    before = measure(LegacyQuery, args.number)
+    after  = measure(DNSQuery, args.number)
+
+    print("legacy decode  : {0:>12,.0f} packets/s".format(before))
+    print("DNSQuery.decode: {0:>12,.0f} packets/s ({1:+.0%})".format(after, after / before - 1))
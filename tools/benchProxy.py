@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# @file     benchProxy.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Micro-benchmarks of the functions on the path of each query
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Measure the number of calls per second of DNSQuery.decode, DNSQuery.deny
+#           (for each block mode) and RuleProcessor.processRules with rule sets of
+#           several sizes. The rule sets are generated: one section per rule, with a
+#           domain name and its sub-domains ((^|\.)name$) for most of them and a regular
+#           expression for a part of them (--regex), some of the rules limited to a
+#           client or a time window.
+#           The looked up domains are half in the rule set, half unknown. The cache of
+#           the verdicts is disabled: each call evaluates the rules.
+#           The best time of several runs is kept, to be compared between two versions.
+
+# imports
+#----------
+import os
+import sys
+import time
+import random
+import timeit
+import argparse
+import ConfigParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from packages import DNSQuery
+from packages import Logger
+from packages import RuleProcessor
+from packages.DNSQuery import BLOCK_MODES
+
+# queries used for the benchmark of the decoding and of the answers
+from benchDecode import PACKETS
+
+
+# globals
+#----------
+
+ADDR = ('192.168.1.20', 53000)
+
+# clients of the generated rules
+CLIENTS = [ '192.168.1.{0}'.format(i) for i in range(10, 30) ]
+
+# number of domains looked up in the benchmark of the rules
+LOOKUPS = 1000
+
+
+# functions
+#----------
+
+# return the number of calls per second of a function called count times by run
+def measure(run, count):
+    elapsed = min(timeit.Timer(run).repeat(repeat = 5, number = 1))
+    return count / elapsed
+
+
+# print the result of a benchmark
+def report(label, rate, extra = ''):
+    print("{0:<28}: {1:>12,.0f} calls/s{2}".format(label, rate, extra))
+
+
+# return the configuration of a rule set of the given size
+def buildConfig(size, regex, log_file):
+    config = ConfigParser.RawConfigParser()
+    config.add_section('proxy')
+    config.set('proxy', 'log_file', log_file)
+    config.set('proxy', 'log_mode', 'async')
+    config.set('proxy', 'default_action', 'allow')
+    config.set('proxy', 'process_rule', 'yes')
+    config.set('proxy', 'verdict_cache', '0')
+
+    config.add_section('generic')
+    config.set('generic', 'rule01', '*;*-*;*;allow')
+
+    rand = random.Random(size)
+    domains = list()
+    for i in range(size):
+        section = 'bench{0}'.format(i)
+        if rand.random() < regex:
+            domain = '.*tracker{0}[0-9]*\\.'.format(i)
+            sample = 'www.tracker{0}42.example'.format(i)
+        else:
+            name = 'site{0}.domain{1}.com'.format(i, i % 97)
+            domain = '(^|\\.)' + name.replace('.', '\\.') + '$'
+            sample = 'www.' + name
+
+        client = '*' if rand.random() < 0.5 else rand.choice(CLIENTS)
+        window = '*-*' if rand.random() < 0.7 else '08:00-20:00'
+        action = 'deny' if rand.random() < 0.8 else 'allow'
+
+        config.add_section(section)
+        config.set(section, 'domain', domain)
+        config.set(section, 'rule01', '*;{0};{1};{2}'.format(window, client, action))
+        domains.append(sample)
+
+    return config, domains
+
+
+# return the values given to processRules for a sample of domains
+def buildValues(domains):
+    rand = random.Random(0)
+    values = list()
+    for i in range(LOOKUPS):
+        if i % 2:
+            domain = 'host{0}.unknown{1}.org'.format(i, i % 13)
+        else:
+            domain = rand.choice(domains)
+
+        values.append([ rand.choice(CLIENTS), domain, rand.randint(0, 1439), rand.randint(0, 6) ])
+
+    return values
+
+
+# class
+#----------
+
+# global object given to the classes of the proxy
+class Dummy:
+    def __init__(self):
+        pass
+
+
+# begin
+#----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Micro-benchmarks of the DNS proxy")
+    parser.add_argument("-n", "--number", action="store", dest="number", type=int, default=100000, help="Number of iterations for the packets")
+    parser.add_argument("--sizes", action="store", dest="sizes", default="10,1000,100000", help="Number of rules of the rule sets")
+    parser.add_argument("--regex", action="store", dest="regex", type=float, default=0.01, help="Part of the domains given as regular expressions")
+    parser.add_argument("--log", action="store", dest="log", default=os.devnull, help="Log file of the rule processor")
+    args = parser.parse_args()
+
+    # decoding and answers
+    queries = list()
+    for packet in PACKETS:
+        query = DNSQuery()
+        query.decode(packet, ADDR)
+        queries.append(query)
+
+    count = args.number * len(PACKETS)
+    rate = measure(lambda: [ DNSQuery().decode(packet, ADDR) for i in xrange(args.number) for packet in PACKETS ], count)
+    report("DNSQuery.decode", rate)
+
+    for mode in BLOCK_MODES:
+        rate = measure(lambda: [ query.deny(mode) for i in xrange(args.number) for query in queries ], count)
+        report("DNSQuery.deny ({0})".format(mode), rate)
+
+    # rules
+    for size in [ int(value) for value in args.sizes.split(',') ]:
+        dummy = Dummy()
+        dummy.application = Dummy()
+        dummy.application.config, domains = buildConfig(size, args.regex, args.log)
+        dummy.logger = Logger(dummy)
+
+        processor = RuleProcessor(dummy)
+        start = time.time()
+        processor.loadRules()
+        loading = time.time() - start
+
+        values = buildValues(domains)
+        rate = measure(lambda: [ processor.processRules(v) for v in values ], len(values))
+        report("processRules ({0} rules)".format(size), rate, " (rules loaded in {0:.2f}s)".format(loading))
+
+        dummy.logger.close()
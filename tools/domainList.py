@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# @file     domainList.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Build the indexes of the lists of domains used by the rules
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The proxy writes the index of a list (file.idx) the first time it reads it.
+#           This tool builds them beforehand (after downloading new lists, or when the
+#           directory of the lists is not writable by the proxy), and tells which list
+#           contains a domain.
+#           Commands:
+#           build : build the index of the lists given
+#           check : print the lists matching the domains given
+
+# imports
+#----------
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from packages.DomainList import DomainList
+from packages.DomainList import suffixHashes
+
+
+# commands
+#----------
+def build(args):
+    for path in args.lists:
+        start = time.time()
+        domains = DomainList([ path ])
+        domains.load()
+        print("{0}: {1} domains, {2:.2f}s".format(path, len(domains), time.time() - start))
+
+
+def check(args):
+    lists = list()
+    for path in args.lists:
+        domains = DomainList([ path ])
+        domains.load()
+        lists.append((path, domains))
+
+    for domain in args.domains:
+        found = [ path for path, domains in lists if domains.contains(suffixHashes(domain)) ]
+        print("{0}: {1}".format(domain, ', '.join(found) or '-'))
+
+
+COMMANDS = {
+    'build' : build,
+    'check' : check,
+}
+
+
+# begin
+#----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Build the indexes of the lists of domains of the DNS proxy")
+    parser.add_argument("command", choices = sorted(COMMANDS.keys()), help = "Action to do")
+    parser.add_argument("lists", nargs = "+", help = "Files of the lists")
+    parser.add_argument("-d", "--domain", action="append", dest="domains", default=[], help="Domain to look for (check)")
+    args = parser.parse_args()
+
+    COMMANDS[args.command](args)
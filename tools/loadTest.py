@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# @file     loadTest.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Load generator measuring the throughput and the latency of the proxy
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The queries are sent over UDP at a constant rate (open loop: a slow answer
+#           does not delay the next queries) for a given duration. The domains follow a
+#           Zipf distribution over a generated list (or the list of a file, the most
+#           popular first), the types follow the given mix, and the queries come from
+#           several client sockets: on the loopback, each one is bound to its own
+#           address (127.0.0.1, 127.0.0.2, ...) so that the rules see different clients.
+#           A query without answer after the timeout is counted as lost.
+#           Use tools/stubDNS.py as the real DNS of the proxy to measure the proxy alone.
+
+# imports
+#----------
+import time
+import errno
+import bisect
+import random
+import select
+import socket
+import struct
+import argparse
+import collections
+
+
+# globals
+#----------
+
+HEADER = struct.Struct('>6H')
+
+# types of query by name
+QTYPES = {
+    'A'     : 1,
+    'NS'    : 2,
+    'CNAME' : 5,
+    'PTR'   : 12,
+    'MX'    : 15,
+    'TXT'   : 16,
+    'AAAA'  : 28,
+    'SRV'   : 33,
+    'HTTPS' : 65,
+}
+
+RCODES = [ 'NOERROR', 'FORMERR', 'SERVFAIL', 'NXDOMAIN', 'NOTIMP', 'REFUSED' ]
+
+MAX_BUFFER = 65535
+
+
+# functions
+#----------
+
+# return the list of the domains of the test
+def loadDomains(args):
+    if args.domains_file:
+        with open(args.domains_file) as fh:
+            domains = [ line.strip() for line in fh if line.strip() and not line.startswith('#') ]
+        return domains[:args.domains]
+
+    return [ "host{0}.domain{1}.bench.test".format(i, i % 97) for i in range(args.domains) ]
+
+
+# return a function choosing an item with a Zipf distribution of exponent s (uniform when s = 0)
+def zipfChooser(items, s):
+    cumulative = list()
+    total = 0.0
+    for rank in range(1, len(items) + 1):
+        total += 1.0 / (rank ** s)
+        cumulative.append(total)
+
+    return lambda: items[min(len(items) - 1, bisect.bisect_left(cumulative, random.random() * total))]
+
+
+# parse a mix of query types 'A:80,AAAA:15,MX:5'
+# return a function choosing a type with these weights
+def typeChooser(text):
+    types = list()
+    cumulative = list()
+    total = 0.0
+    for item in text.split(','):
+        name, _, weight = item.strip().partition(':')
+        name = name.upper()
+        if name not in QTYPES:
+            raise ValueError("Unknown query type '{0}'".format(name))
+
+        total += float(weight or 1)
+        types.append(QTYPES[name])
+        cumulative.append(total)
+
+    return lambda: types[bisect.bisect_left(cumulative, random.random() * total)]
+
+
+# return the DNS query of a domain (recursion desired)
+def buildQuery(requestID, domain, qtype):
+    data = HEADER.pack(requestID, 0x0100, 1, 0, 0, 0)
+    for label in domain.split('.'):
+        data += chr(len(label)) + label
+    return data + '\x00' + struct.pack('>HH', qtype, 1)
+
+
+# return the value of a percentile of a sorted list
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+# return the client sockets
+def clientSockets(host, count):
+    loopback = host.startswith('127.')
+    socks = list()
+    for i in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        if loopback:
+            sock.bind(('127.{0}.{1}.{2}'.format((i >> 16) & 0xFF, (i >> 8) & 0xFF, (i & 0xFF) + 1), 0))
+        sock.setblocking(0)
+        socks.append(sock)
+
+    return socks
+
+
+# class
+#----------
+class LoadTest:
+    # constructor
+    def __init__(self, args):
+        self.args = args
+
+        host, _, port = args.server.partition(':')
+        self.server = (socket.gethostbyname(host), int(port or 53))
+        self.socks = clientSockets(self.server[0], args.clients)
+
+        self.domain = zipfChooser(loadDomains(args), args.zipf)
+        self.qtype = typeChooser(args.qtypes)
+
+        # queries waiting for an answer: (socket, id) -> time when the query has been sent
+        self.pending = dict()
+        self.sent_queue = collections.deque()
+
+        self.sent = 0
+        self.errors = 0
+        self.lost = 0
+        self.latencies = list()
+        self.rcodes = collections.Counter()
+
+
+    # send one query from a random client
+    def __send(self, now):
+        sock = random.choice(self.socks)
+        requestID = random.randint(0, 0xFFFF)
+        key = (sock, requestID)
+        if key in self.pending:
+            return
+
+        try:
+            sock.sendto(buildQuery(requestID, self.domain(), self.qtype()), self.server)
+        except socket.error:
+            self.errors += 1
+            return
+
+        self.sent += 1
+        self.pending[key] = now
+        self.sent_queue.append((now, key))
+
+
+    # read the answers available on a socket
+    def __receive(self, sock, now):
+        while True:
+            try:
+                data = sock.recv(MAX_BUFFER)
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED):
+                    raise
+                return
+
+            if len(data) < 12:
+                continue
+
+            requestID, flags = HEADER.unpack_from(data)[:2]
+            sent = self.pending.pop((sock, requestID), None)
+            if sent is None:
+                continue
+
+            self.latencies.append(now - sent)
+            rcode = flags & 0x000F
+            self.rcodes[RCODES[rcode] if rcode < len(RCODES) else str(rcode)] += 1
+
+
+    # count the queries without answer in time
+    def __expire(self, now):
+        limit = now - self.args.timeout
+        queue = self.sent_queue
+        while queue and (queue[0][0] <= limit):
+            sent, key = queue.popleft()
+            if self.pending.get(key) == sent:
+                del self.pending[key]
+                self.lost += 1
+
+
+    # run the test
+    def run(self):
+        interval = 1.0 / self.args.rate
+        start = time.time()
+        end = start + self.args.duration
+        next_send = start
+
+        while True:
+            now = time.time()
+
+            # send the queries due (catch up when late)
+            while (next_send <= now) and (next_send < end):
+                self.__send(now)
+                next_send += interval
+
+            if (now >= end) and (not self.pending or now >= end + self.args.timeout):
+                break
+
+            timeout = max(0, (next_send if next_send < end else now + 0.05) - now)
+            for sock in select.select(self.socks, [], [], timeout)[0]:
+                self.__receive(sock, time.time())
+
+            self.__expire(time.time())
+
+        self.lost += len(self.pending)
+        self.elapsed = self.args.duration
+
+
+    # print the results
+    def report(self):
+        latencies = sorted(self.latencies)
+        answered = len(latencies)
+
+        print("queries sent    : {0} ({1:.0f}/s, target {2}/s), {3} send errors".format(self.sent, self.sent / self.elapsed, self.args.rate, self.errors))
+        print("answers         : {0} ({1:.0f}/s)".format(answered, answered / self.elapsed))
+        print("lost            : {0} ({1:.2%})".format(self.lost, float(self.lost) / max(1, self.sent)))
+        print("latency (ms)    : p50 {0:.3f}  p99 {1:.3f}  p99.9 {2:.3f}  max {3:.3f}".format(
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+            percentile(latencies, 99.9) * 1000, (latencies[-1] if latencies else 0) * 1000))
+        print("answer codes    : {0}".format(', '.join("{0}={1}".format(k, v) for k, v in self.rcodes.most_common())))
+
+
+# begin
+#----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Load generator for the DNS proxy")
+    parser.add_argument("-s", "--server", action="store", dest="server", default="127.0.0.1:53", help="Address of the proxy (host:port)")
+    parser.add_argument("-r", "--rate", action="store", dest="rate", type=float, default=1000, help="Queries per second")
+    parser.add_argument("-t", "--duration", action="store", dest="duration", type=float, default=10, help="Duration of the test (s)")
+    parser.add_argument("--timeout", action="store", dest="timeout", type=float, default=2.0, help="Time after which a query is lost (s)")
+    parser.add_argument("--clients", action="store", dest="clients", type=int, default=16, help="Number of clients")
+    parser.add_argument("--domains", action="store", dest="domains", type=int, default=10000, help="Number of distinct domains")
+    parser.add_argument("--domains-file", action="store", dest="domains_file", help="File of the domains, the most popular first")
+    parser.add_argument("--zipf", action="store", dest="zipf", type=float, default=1.0, help="Exponent of the popularity of the domains (0 for uniform)")
+    parser.add_argument("--qtypes", action="store", dest="qtypes", default="A:70,AAAA:25,HTTPS:3,MX:1,TXT:1", help="Mix of query types (TYPE:weight,...)")
+    args = parser.parse_args()
+
+    test = LoadTest(args)
+    test.run()
+    test.report()
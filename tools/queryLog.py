@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# @file     queryLog.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Aggregate the binary query log of the proxy
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           The segments are memory-mapped and read as arrays of 32 bits integers:
+#           a column of the records is a slice of the array, and the verdicts are
+#           a slice of the bytes, so that the aggregations run in C.
+#           Commands:
+#           summary : number of queries and verdicts per day
+#           domains : most requested domains (all, or denied only with --denied)
+#           clients : queries and denial rate per client
+#           rules   : rules that have denied the most queries
+
+# imports
+#----------
+import os
+import re
+import sys
+import mmap
+import time
+import array
+import argparse
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from packages.QueryLog import RECORD
+from packages.QueryLog import RECORD_WORDS
+from packages.QueryLog import WORD_CLIENT
+from packages.QueryLog import WORD_DOMAIN
+from packages.QueryLog import WORD_RULE
+from packages.QueryLog import BYTE_VERDICT
+from packages.QueryLog import VERDICTS
+from packages.QueryLog import VERDICT_DENIED
+from packages.QueryLog import NAME_DOMAIN
+from packages.QueryLog import NAME_RULE
+from packages.QueryLog import intToIp
+from packages.QueryLog import readNames
+
+
+# globals
+#----------
+
+SEGMENT = re.compile(r'^queries-(\d{8})\.bin$')
+
+DENIED = chr(VERDICT_DENIED)
+
+
+# functions
+#----------
+
+# return the list of (day, path) of the segments of the period, sorted by day
+def findSegments(directory, first, last):
+    segments = list()
+    for name in os.listdir(directory):
+        match = SEGMENT.match(name)
+        if match and (first <= match.group(1) <= last):
+            segments.append((match.group(1), os.path.join(directory, name)))
+
+    return sorted(segments)
+
+
+# yield (day, words, verdicts, names) for each segment
+# words is the array of the 32 bits integers, verdicts the string of the verdicts
+def readSegments(segments):
+    for day, path in segments:
+        size = os.path.getsize(path)
+        size = size - size % RECORD.size
+        if size == 0:
+            continue
+
+        with open(path, 'rb') as fh:
+            mm = mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                words = array.array('I')
+                words.fromstring(mm[:size])
+                if sys.byteorder != 'little':
+                    words.byteswap()
+
+                verdicts = mm[BYTE_VERDICT:size:RECORD.size]
+            finally:
+                mm.close()
+
+        yield day, words, verdicts, readNames(path[:-4] + '.names')
+
+
+# return the values of a column for the denied queries
+def deniedColumn(words, verdicts, column):
+    values = words[column::RECORD_WORDS]
+
+    denied = list()
+    index = verdicts.find(DENIED)
+    while index >= 0:
+        denied.append(values[index])
+        index = verdicts.find(DENIED, index + 1)
+
+    return denied
+
+
+# print the lines of a table
+def printTable(header, rows):
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        print(row)
+
+
+# commands
+#----------
+def summary(segments, args):
+    rows = list()
+    total = collections.Counter()
+    for day, words, verdicts, names in readSegments(segments):
+        counts = collections.Counter(verdicts)
+        total.update(counts)
+        rows.append("{0}  {1:>10}  ".format(day, len(verdicts))
+                    + "  ".join([ "{0:>10}".format(counts[chr(v)]) for v in range(len(VERDICTS)) ]))
+
+    rows.append("{0:<8}  {1:>10}  ".format('total', sum(total.values()))
+                + "  ".join([ "{0:>10}".format(total[chr(v)]) for v in range(len(VERDICTS)) ]))
+
+    printTable("day          queries  " + "  ".join([ "{0:>10}".format(v) for v in VERDICTS ]), rows)
+
+
+def domains(segments, args):
+    counts = collections.Counter()
+    allnames = dict()
+    for day, words, verdicts, names in readSegments(segments):
+        if args.denied:
+            counts.update(deniedColumn(words, verdicts, WORD_DOMAIN))
+        else:
+            counts.update(words[WORD_DOMAIN::RECORD_WORDS])
+        allnames.update(names)
+
+    rows = [ "{0:>10}  {1}".format(count, allnames.get((NAME_DOMAIN, key), '#{0:08x}'.format(key)))
+             for key, count in counts.most_common(args.top) ]
+    printTable("   queries  domain", rows)
+
+
+def clients(segments, args):
+    queries = collections.Counter()
+    denied  = collections.Counter()
+    for day, words, verdicts, names in readSegments(segments):
+        queries.update(words[WORD_CLIENT::RECORD_WORDS])
+        denied.update(deniedColumn(words, verdicts, WORD_CLIENT))
+
+    rows = [ "{0:<16}  {1:>10}  {2:>10}  {3:>7.1%}".format(intToIp(ip), count, denied[ip], float(denied[ip]) / count)
+             for ip, count in queries.most_common(args.top) ]
+    printTable("client               queries      denied     rate", rows)
+
+
+def rules(segments, args):
+    counts = collections.Counter()
+    allnames = dict()
+    for day, words, verdicts, names in readSegments(segments):
+        counts.update(deniedColumn(words, verdicts, WORD_RULE))
+        allnames.update(names)
+
+    rows = list()
+    for key, count in counts.most_common(args.top):
+        name = 'default action' if key == 0 else allnames.get((NAME_RULE, key), '#{0:08x}'.format(key))
+        rows.append("{0:>10}  {1}".format(count, name))
+
+    printTable("    denied  rule", rows)
+
+
+COMMANDS = {
+    'summary' : summary,
+    'domains' : domains,
+    'clients' : clients,
+    'rules'   : rules,
+}
+
+
+# begin
+#----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Aggregate the binary query log of the DNS proxy")
+    parser.add_argument("command", choices = sorted(COMMANDS.keys()), help = "Aggregation to print")
+    parser.add_argument("-d", "--dir", action="store", dest="dir", required=True, help="Directory of the query log (query_log_dir)")
+    parser.add_argument("--days", action="store", dest="days", type=int, default=7, help="Number of days to read, up to today")
+    parser.add_argument("--from", action="store", dest="first", help="First day to read (YYYYMMDD)")
+    parser.add_argument("--to", action="store", dest="last", help="Last day to read (YYYYMMDD)")
+    parser.add_argument("--top", action="store", dest="top", type=int, default=20, help="Number of lines to print")
+    parser.add_argument("--denied", action="store_true", dest="denied", help="Count only the denied queries")
+    args = parser.parse_args()
+
+    now = time.time()
+    last  = args.last or time.strftime('%Y%m%d', time.localtime(now))
+    first = args.first or time.strftime('%Y%m%d', time.localtime(now - (args.days - 1) * 86400))
+
+    start = time.time()
+    COMMANDS[args.command](findSegments(args.dir, first, last), args)
+    sys.stderr.write("{0:.2f}s\n".format(time.time() - start))
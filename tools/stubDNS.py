@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# @file     stubDNS.py
+# @author   Sebastien LEGRAND
+# @date     2026-10-18
+#
+# @brief    Local stub of a real DNS server for the benchmarks of the proxy
+# @history
+#           2026-10-18 - 1.0.0 - SLE
+#           Initial Version
+# @notes
+#           Answer every query over UDP and TCP with one record (A 192.0.2.1,
+#           AAAA 2001:db8::1, an empty NOERROR answer for the other types), right
+#           away or after a delay. A part of the UDP queries can be dropped to
+#           simulate the loss. The delayed answers are kept in a heap so that the
+#           delay does not limit the throughput.
+
+# imports
+#----------
+import os
+import sys
+import time
+import heapq
+import errno
+import random
+import select
+import socket
+import struct
+import argparse
+
+
+# globals
+#----------
+
+HEADER = struct.Struct('>6H')
+RECORD = struct.Struct('>HHIH')
+
+TYPE_A    = 1
+TYPE_AAAA = 28
+
+ADDRESSES = {
+    TYPE_A    : socket.inet_aton('192.0.2.1'),
+    TYPE_AAAA : '\x20\x01\x0d\xb8' + '\x00' * 11 + '\x01',
+}
+
+MAX_BUFFER = 65535
+
+
+# functions
+#----------
+
+# return the answer to a query (None if the query cannot be decoded)
+def answer(data, ttl):
+    try:
+        requestID, flags, qdcount = HEADER.unpack_from(data)[:3]
+
+        index = 12
+        while data[index] != '\x00':
+            index += ord(data[index]) + 1
+        qtype = struct.unpack_from('>H', data, index + 1)[0]
+        end = index + 5
+    except (struct.error, IndexError):
+        return None
+
+    address = ADDRESSES.get(qtype)
+    count = 0 if address is None else 1
+    response = HEADER.pack(requestID, 0x8180 | (flags & 0x0100), 1, count, 0, 0) + data[12:end]
+    if address is not None:
+        response += '\xc0\x0c' + RECORD.pack(qtype, 1, ttl, len(address)) + address
+
+    return response
+
+
+# class
+#----------
+class StubDNS:
+    # constructor
+    def __init__(self, args):
+        self.args = args
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.udp.bind((args.address, args.port))
+        self.udp.setblocking(0)
+
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((args.address, args.port))
+        self.tcp.listen(64)
+
+        # TCP connections: socket -> bytes received
+        self.clients = dict()
+
+        # delayed answers: (time, sequence, socket, addr, data)
+        self.delayed  = list()
+        self.sequence = 0
+
+        self.queries = 0
+        self.dropped = 0
+
+
+    # send an answer now or later
+    def __schedule(self, sock, addr, data):
+        delay = self.args.delay
+        if self.args.jitter:
+            delay = max(0.0, random.gauss(delay, self.args.jitter))
+
+        if delay <= 0:
+            self.__send(sock, addr, data)
+            return
+
+        self.sequence += 1
+        heapq.heappush(self.delayed, (time.time() + delay / 1000.0, self.sequence, sock, addr, data))
+
+
+    def __send(self, sock, addr, data):
+        try:
+            if addr is None:
+                sock.sendall(struct.pack('>H', len(data)) + data)
+            else:
+                sock.sendto(data, addr)
+        except socket.error:
+            pass
+
+
+    # read the queries available on the UDP socket
+    def __readUDP(self):
+        while True:
+            try:
+                data, addr = self.udp.recvfrom(MAX_BUFFER)
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                return
+
+            self.queries += 1
+            if self.args.loss and (random.random() < self.args.loss):
+                self.dropped += 1
+                continue
+
+            response = answer(data, self.args.ttl)
+            if response is not None:
+                self.__schedule(self.udp, addr, response)
+
+
+    # read the queries of a TCP connection
+    def __readTCP(self, sock):
+        try:
+            data = sock.recv(MAX_BUFFER)
+        except socket.error:
+            data = ''
+
+        if not data:
+            del self.clients[sock]
+            sock.close()
+            return
+
+        buf = self.clients[sock] + data
+        while len(buf) >= 2:
+            size = struct.unpack('>H', buf[:2])[0]
+            if len(buf) < size + 2:
+                break
+
+            self.queries += 1
+            response = answer(buf[2:size + 2], self.args.ttl)
+            if response is not None:
+                self.__schedule(sock, None, response)
+            buf = buf[size + 2:]
+
+        self.clients[sock] = buf
+
+
+    # answer the queries until interrupted
+    def run(self):
+        while True:
+            timeout = None
+            if self.delayed:
+                timeout = max(0, self.delayed[0][0] - time.time())
+
+            rd = select.select([ self.udp, self.tcp ] + self.clients.keys(), [], [], timeout)[0]
+            for sock in rd:
+                if sock is self.udp:
+                    self.__readUDP()
+                elif sock is self.tcp:
+                    conn, addr = self.tcp.accept()
+                    self.clients[conn] = ''
+                else:
+                    self.__readTCP(sock)
+
+            now = time.time()
+            while self.delayed and (self.delayed[0][0] <= now):
+                when, sequence, sock, addr, data = heapq.heappop(self.delayed)
+                if (addr is not None) or (sock in self.clients):
+                    self.__send(sock, addr, data)
+
+
+# begin
+#----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Stub of a real DNS server for the benchmarks of the proxy")
+    parser.add_argument("-a", "--address", action="store", dest="address", default="127.0.0.1", help="Listening address")
+    parser.add_argument("-p", "--port", action="store", dest="port", type=int, default=1053, help="Listening port (UDP and TCP)")
+    parser.add_argument("--delay", action="store", dest="delay", type=float, default=0.0, help="Delay of the answers (ms)")
+    parser.add_argument("--jitter", action="store", dest="jitter", type=float, default=0.0, help="Standard deviation of the delay (ms)")
+    parser.add_argument("--loss", action="store", dest="loss", type=float, default=0.0, help="Part of the UDP queries dropped (0 to 1)")
+    parser.add_argument("--ttl", action="store", dest="ttl", type=int, default=60, help="TTL of the records")
+    args = parser.parse_args()
+
+    stub = StubDNS(args)
+    sys.stderr.write("Listening on {0}:{1} (pid {2})\n".format(args.address, args.port, os.getpid()))
+    try:
+        stub.run()
+    except KeyboardInterrupt:
+        pass
+
+    sys.stderr.write("{0} queries, {1} dropped\n".format(stub.queries, stub.dropped))